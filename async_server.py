@@ -0,0 +1,247 @@
+"""
+Асинхронный HTTP сервер грейдера на asyncio.
+
+Альтернатива grader.start(): принимает те же POST запросы от XQueue,
+но поддерживает постоянные соединения HTTP/1.1 (keep-alive) и ожидает
+завершения тестировщиков без блокировки, поэтому один процесс может
+держать тысячи оцениваемых решений без отдельного потока на каждое.
+
+Запуск:
+    python3 async_server.py
+"""
+
+import asyncio
+import json
+import time
+from contextlib import aclosing
+from http import HTTPStatus
+from json.decoder import JSONDecodeError
+
+import batch
+import grader
+import metrics
+import timing
+from pool import ISOLATION_FORK
+from scheduler import QueueFull
+from util import log_event, print_log, stop_logging
+
+# Сколько секунд постоянное соединение может простаивать между запросами
+KEEP_ALIVE_TIMEOUT = 75
+
+# Максимальный размер тела запроса в байтах
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+# Максимальное количество заголовков в запросе
+MAX_HEADERS = 100
+
+
+class BadRequest(Exception):
+    """Запрос не удалось разобрать. Соединение после ответа закрывается."""
+    def __init__(self, status, message=''):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader):
+    """
+    Читает из соединения один HTTP запрос.
+
+    Возвращает:
+        (method, path, version, headers, body, read_time) или None, если клиент
+        закрыл соединение или не прислал запрос за KEEP_ALIVE_TIMEOUT секунд.
+        read_time - время чтения запроса после получения его первой строки.
+    """
+    try:
+        line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    if not line:
+        return None
+    started = time.monotonic()
+
+    try:
+        method, path, version = line.decode('latin-1').split()
+    except ValueError:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, 'Некорректная строка запроса')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise BadRequest(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise BadRequest(HTTPStatus.NOT_IMPLEMENTED, 'Transfer-Encoding: chunked не поддерживается')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, 'Некорректный Content-Length')
+    if length > MAX_BODY_SIZE:
+        raise BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), path, version.upper(), headers, body, time.monotonic() - started
+
+
+def keep_alive(version, headers):
+    """Определяет, нужно ли оставить соединение открытым после ответа."""
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+
+def write_response(writer, status, body=b'', headers=None, close=False):
+    """Записывает HTTP ответ в соединение."""
+    status = HTTPStatus(status)
+    lines = ['HTTP/1.1 {} {}'.format(status.value, status.phrase),
+             'Content-Length: {}'.format(len(body)),
+             'Connection: {}'.format('close' if close else 'keep-alive')]
+    for name, value in (headers or {}).items():
+        lines.append('{}: {}'.format(name, value))
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+
+async def handle_post(body):
+    """
+    Обрабатывает POST запрос от XQueue так же, как grader.Handler.do_POST.
+    Сведения о запросе записываются в текущий timing.RequestTrace.
+
+    Возвращает:
+        (status, body, headers) ответа
+    """
+    trace = timing.current()
+    try:
+        with timing.stage('parse'):
+            problem_name, hide_answer, student_response, user_id = grader.parse_request(body.decode())
+    except (JSONDecodeError, UnicodeDecodeError):
+        print_log('JSONDecodeError, post_body не было загружено должным образом')
+        metrics.JSON_ERRORS.inc()
+        trace.info['outcome'] = 'bad_request'
+        return HTTPStatus.BAD_REQUEST, b'', {}
+
+    trace.info.update(problem=problem_name, user=user_id)
+    log_event('submitted', problem=problem_name, user=user_id)
+    try:
+        result, wait, complete = await grader.grade_scheduled_async(
+            problem_name, student_response, hide_answer)
+    except QueueFull as err:
+        print_log('Очередь заполнена, решение пользователя {} отклонено'.format(user_id))
+        grader.record_request(problem_name, 'rejected')
+        trace.info['outcome'] = 'rejected'
+        return HTTPStatus.SERVICE_UNAVAILABLE, b'', {'Retry-After': str(err.retry_after)}
+    grader.store_submission(problem_name, user_id, student_response, hide_answer, result, complete)
+
+    grader.record_request(problem_name, 'graded', trace.elapsed())
+    trace.info.update(outcome='graded', correct=result.get('correct'), score=result.get('score'))
+    return HTTPStatus.OK, json.dumps(result).encode(), {'Content-Type': 'application/json'}
+
+
+async def handle_batch(writer, body, version):
+    """
+    Оценивает пакет решений и отправляет результаты по мере готовности.
+
+    Клиенту HTTP/1.1 ответ отправляется частями (Transfer-Encoding: chunked)
+    и соединение остается открытым. Клиенту HTTP/1.0 конец ответа обозначается
+    закрытием соединения.
+
+    Возвращает:
+        True, если соединение нужно закрыть
+    """
+    chunked = version == 'HTTP/1.1'
+    lines = ['HTTP/1.1 200 OK', 'Content-Type: {}'.format(batch.CONTENT_TYPE)]
+    lines.append('Transfer-Encoding: chunked' if chunked else 'Connection: close')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    try:
+        submissions = batch.parse_lines(body.decode().splitlines())
+    except UnicodeDecodeError:
+        submissions = iter([batch.Submission('1', error='Тело запроса не в кодировке UTF-8')])
+    async with aclosing(batch.grade_batch_async(submissions)) as records:
+        async for record in records:
+            data = batch.encode(record)
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+            await writer.drain()
+    if chunked:
+        writer.write(b'0\r\n\r\n')
+    await writer.drain()
+    return not chunked
+
+
+async def handle_connection(reader, writer):
+    """Обслуживает одно соединение, пока клиент не закроет его."""
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except BadRequest as err:
+                write_response(writer, err.status, str(err).encode(), close=True)
+                await writer.drain()
+                break
+            if request is None:
+                break
+
+            method, path, version, headers, body, read_time = request
+            close = not keep_alive(version, headers)
+            if method == 'POST' and path.split('?', 1)[0] == batch.BATCH_PATH:
+                close = await handle_batch(writer, body, version) or close
+            elif method == 'POST':
+                with timing.trace_request(headers.get('x-request-id')) as trace:
+                    trace.add('read', read_time)
+                    status, payload, extra = await handle_post(body)
+                    with timing.stage('write'):
+                        write_response(writer, status, payload, extra, close)
+                        await writer.drain()
+                    grader.log_request(trace)
+            else:
+                if method in ('GET', 'HEAD'):
+                    status, payload, extra = grader.handle_get(path)
+                else:
+                    status, payload, extra = HTTPStatus.METHOD_NOT_ALLOWED, b'', {}
+                write_response(writer, status, b'' if method == 'HEAD' else payload, extra, close)
+                await writer.drain()
+            if close:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        # ValueError выбрасывает readline() при слишком длинной строке
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    server = await asyncio.start_server(handle_connection, host, port)
+    print('Async grader started on {}:{}.'.format(host, port))
+    print('Press Ctrl+C to stop grader')
+    async with server:
+        await server.serve_forever()
+
+
+def start(host='localhost', port=1710, pool_size=None, pool_max_jobs=100,
+          pool_isolation=ISOLATION_FORK, slots=None, max_queue=None,
+          cache_size=10000, cache_path=None, limits=None, store_path=None):
+    """
+    Запускает асинхронный грейдер. Аргументы те же, что у grader.start().
+
+    Так как ожидающие решения не занимают потоков, max_queue
+    можно делать намного больше, чем для grader.start().
+    """
+    grader.setup(pool_size, pool_max_jobs, pool_isolation, slots, max_queue,
+                 cache_size, cache_path, limits, store_path=store_path)
+    try:
+        asyncio.run(serve(host, port))
+    except KeyboardInterrupt:
+        print('\nGrader was stopped with Ctrl+C')
+    finally:
+        grader.calibrator.stop()
+        grader.tester_pool.close()
+        if grader.submission_store is not None:
+            grader.submission_store.close()
+        stop_logging()
+
+
+if __name__ == '__main__':
+    start()
@@ -0,0 +1,291 @@
+"""
+Пакетная оценка решений.
+
+Используется для повторной оценки сохраненных решений, например после
+исправления файла задания. Решения читаются из файла JSON lines или из всех
+файлов *.jsonl каталога, оцениваются параллельно с той же логикой, что
+и отдельные запросы XQueue (планировщик, кэш, проверка задания), а результаты
+выводятся в формате NDJSON по мере готовности, а не в порядке чтения.
+
+Каждая строка входного файла - либо тело запроса XQueue
+    {"xqueue_body": "..."}
+либо решение в простом виде
+    {"id": "...", "problem_name": "...", "student_response": "...", "hide_answer": false}
+Строка результата:
+    {"id": "...", "problem_name": "...", "user": "...", "result": {"correct": ..., "score": ..., "msg": ...}}
+или {"id": "...", "error": "..."}, если строку не удалось разобрать.
+Если у решения нет поля id, им становится <имя файла>:<номер строки>.
+
+Запуск:
+    python3 batch.py submissions.jsonl -o results.jsonl
+    python3 batch.py submissions/ -o results.jsonl --resume
+
+С флагом --resume решения, результаты которых уже есть в выходном файле,
+пропускаются, а новые результаты дописываются в его конец, поэтому прерванную
+оценку можно продолжить с места остановки.
+
+Оба сервера грейдера принимают пакет решений POST запросом по адресу BATCH_PATH
+с телом в том же формате и отвечают потоком строк NDJSON. Номер строки в теле
+запроса служит id решения, у которого нет своего.
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import grader
+from scheduler import QueueFull
+from store import SOURCE_REGRADE
+from util import print_log, start_logging, stop_logging
+
+# Адрес, по которому серверы грейдера принимают пакеты решений
+BATCH_PATH = '/batch'
+
+# Тип содержимого ответа на пакетный запрос
+CONTENT_TYPE = 'application/x-ndjson'
+
+
+class Submission:
+    """
+    Решение из пакета.
+
+    Атрибуты:
+        id (str): идентификатор решения в пакете
+        problem_name (str), student_response (str), hide_answer (bool), user (str):
+            поля решения, как их возвращает grader.parse_request()
+        error (str): причина, по которой строку не удалось разобрать, или None
+    """
+    def __init__(self, id, problem_name=None, student_response=None, hide_answer=False,
+                 user=None, error=None):
+        self.id = id
+        self.problem_name = problem_name
+        self.student_response = student_response
+        self.hide_answer = hide_answer
+        self.user = user
+        self.error = error
+
+
+def parse_submission(line, default_id):
+    """Разбирает одну строку пакета. Ошибки разбора возвращаются в поле error."""
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError('строка пакета должна быть объектом JSON')
+        submission_id = str(record.get('id', default_id))
+        if 'xqueue_body' in record:
+            problem_name, hide_answer, student_response, user = grader.get_info(record)
+            hide_answer = hide_answer == 'True'
+        else:
+            problem_name = record['problem_name']
+            student_response = record['student_response']
+            hide_answer = record.get('hide_answer', False) in (True, 'True')
+            user = record.get('user', 'unknown')
+    except (ValueError, KeyError, TypeError) as err:
+        return Submission(default_id, error='Некорректная строка пакета: {!r}'.format(err))
+    return Submission(submission_id, problem_name, student_response, hide_answer, user)
+
+
+def parse_lines(lines, name=''):
+    """Разбирает строки пакета. Пустые строки пропускаются."""
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            yield parse_submission(line, '{}:{}'.format(name, number) if name else str(number))
+
+
+def read_submissions(path, exclude=None):
+    """
+    Читает решения из файла JSON lines или из всех файлов *.jsonl каталога path.
+    Файл exclude пропускается, чтобы результаты, записываемые в тот же каталог,
+    не читались как решения.
+    """
+    if os.path.isdir(path):
+        paths = sorted(glob.glob(os.path.join(path, '*.jsonl')))
+    else:
+        paths = [path]
+    for file_path in paths:
+        if exclude is not None and os.path.abspath(file_path) == exclude:
+            continue
+        with open(file_path, encoding='utf-8') as f:
+            yield from parse_lines(f, os.path.basename(file_path))
+
+
+def load_checkpoint(path):
+    """
+    Возвращает id решений, результаты которых уже записаны в файл path.
+
+    Если последняя строка файла записана не полностью (оценка была прервана
+    во время записи), она удаляется, чтобы новые результаты дописывались
+    с начала строки.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            done.add(json.loads(line)['id'])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return done
+
+
+def _record(submission, response):
+    return {'id': submission.id, 'problem_name': submission.problem_name,
+            'user': submission.user, 'result': response}
+
+
+def _store(submission, response, complete):
+    grader.store_submission(submission.problem_name, submission.user, submission.student_response,
+                            submission.hide_answer, response, complete, SOURCE_REGRADE)
+
+
+def grade_submission(submission):
+    """
+    Оценивает решение так же, как запрос XQueue, но в очереди повторной оценки
+    планировщика, и возвращает строку результата. Если очередь планировщика
+    заполнена, решение ожидает и отправляется снова.
+    """
+    if submission.error is not None:
+        return {'id': submission.id, 'error': submission.error}
+    while True:
+        try:
+            response, _, complete = grader.grade_scheduled(
+                submission.problem_name, submission.student_response, submission.hide_answer,
+                regrade=True)
+            _store(submission, response, complete)
+            return _record(submission, response)
+        except QueueFull as err:
+            time.sleep(err.retry_after)
+
+
+async def grade_submission_async(submission):
+    """Асинхронная версия grade_submission()."""
+    if submission.error is not None:
+        return {'id': submission.id, 'error': submission.error}
+    while True:
+        try:
+            response, _, complete = await grader.grade_scheduled_async(
+                submission.problem_name, submission.student_response, submission.hide_answer,
+                regrade=True)
+            _store(submission, response, complete)
+            return _record(submission, response)
+        except QueueFull as err:
+            await asyncio.sleep(err.retry_after)
+
+
+def _workers(workers):
+    if workers:
+        return workers
+    return grader.scheduler.slots if grader.scheduler is not None else os.cpu_count() or 1
+
+
+def grade_batch(submissions, workers=None):
+    """
+    Оценивает решения в workers потоках и возвращает строки результатов по мере готовности.
+
+    Решения читаются из submissions постепенно, поэтому пакет может быть
+    больше доступной памяти. По умолчанию workers равно числу слотов планировщика.
+    """
+    workers = _workers(workers)
+    executor = ThreadPoolExecutor(workers, thread_name_prefix='batch')
+    pending = set()
+    try:
+        for submission in submissions:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(grade_submission, submission))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Если результаты больше не нужны (клиент отключился), оставшиеся решения не оцениваются
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def grade_batch_async(submissions, workers=None):
+    """Асинхронная версия grade_batch(), решения оцениваются задачами asyncio."""
+    workers = _workers(workers)
+    pending = set()
+    try:
+        for submission in submissions:
+            if len(pending) >= workers * 2:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.ensure_future(grade_submission_async(submission)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def encode(record):
+    """Строка NDJSON с результатом."""
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетная оценка решений')
+    parser.add_argument('input', help='файл JSON lines или каталог с файлами *.jsonl')
+    parser.add_argument('-o', '--output', help='файл для результатов, по умолчанию stdout')
+    parser.add_argument('--resume', action='store_true',
+                        help='пропустить решения, результаты которых уже есть в файле output')
+    parser.add_argument('--workers', type=int, help='количество одновременно оцениваемых решений')
+    parser.add_argument('--pool-size', type=int, help='количество процессов-шаблонов тестировщика')
+    parser.add_argument('--store', help='файл хранилища, в которое сохраняются результаты (store.py)')
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error('для --resume нужно указать --output')
+
+    # grader.setup() меняет рабочую директорию
+    input_path = os.path.abspath(args.input)
+    output_path = args.output and os.path.abspath(args.output)
+    store_path = args.store and os.path.abspath(args.store)
+
+    # Лог пишется в stderr, чтобы не смешиваться с результатами в stdout
+    start_logging(sys.stderr)
+    grader.setup(args.pool_size, slots=args.workers, store_path=store_path)
+    try:
+        done = load_checkpoint(output_path) if args.resume else set()
+        submissions = (submission for submission in read_submissions(input_path, output_path)
+                       if submission.id not in done)
+        output = open(output_path, 'ab' if args.resume else 'wb') if output_path else sys.stdout.buffer
+        graded = 0
+        started = time.time()
+        try:
+            for record in grade_batch(submissions, args.workers):
+                output.write(encode(record))
+                output.flush()
+                graded += 1
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        print_log('Оценено решений: {} за {:.1f} сек., пропущено уже оцененных: {}'.format(
+            graded, time.time() - started, len(done)))
+    except KeyboardInterrupt:
+        print_log('Оценка прервана, для продолжения запустите ее с флагом --resume')
+    finally:
+        grader.calibrator.stop()
+        grader.tester_pool.close()
+        if grader.submission_store is not None:
+            grader.submission_store.close()
+        stop_logging()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,471 @@
+"""
+Нагрузочное тестирование грейдера.
+
+Генерирует запросы XQueue к заданиям problems/TEST_000 - TEST_002 в том же
+формате, который разбирает get_info(): правильные и неправильные решения,
+решения с синтаксической ошибкой, бесконечным циклом, огромным выводом
+и решения, которые пытаются выделить слишком много памяти. Запросы
+отправляются запущенному локально грейдеру с заданным числом одновременных
+соединений, а результат - пропускная способность, перцентили времени ответа
+и использование ресурсов машины - печатается и сохраняется в JSON файл,
+чтобы результаты разных версий грейдера можно было сравнить. С флагом
+--replay вместо сгенерированных запросов отправляются настоящие решения,
+сохраненные в хранилище store.py.
+
+Запуск:
+    python3 benchmark.py --server async --requests 500 --concurrency 16
+    python3 benchmark.py --url http://localhost:1710 --duration 60
+    python3 benchmark.py --replay submissions.db --requests 1000
+    python3 benchmark.py --compare before.json after.json
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from launcher import GraderServer
+from store import SubmissionStore
+
+# Решения для нагрузочного теста: вид решения -> список (задание, код)
+SUBMISSIONS = {
+    'correct': [
+        ('TEST_000', "s = int(input())\n"
+                     "print('{}:{}:{}'.format(s // 3600, s // 60 % 60, s % 60))\n"),
+        ('TEST_001', 'def sum(x, y):\n    return x + y\n'),
+        ('TEST_002', 'answer = [1, 2, 3, 4, 5]\n'),
+    ],
+    'wrong': [
+        ('TEST_000', "s = int(input())\nprint('{}:{}'.format(s // 60, s % 60))\n"),
+        ('TEST_001', 'def sum(x, y):\n    return x - y\n'),
+        ('TEST_002', 'answer = [5, 4, 3, 2, 1]\n'),
+    ],
+    'syntax_error': [
+        ('TEST_000', 's = int(input()\nprint(s)\n'),
+        ('TEST_001', 'def sum(x, y)\n    return x + y\n'),
+    ],
+    'infinite_loop': [
+        ('TEST_000', 'while True:\n    pass\n'),
+        ('TEST_001', 'def sum(x, y):\n    while True:\n        x += y\n'),
+    ],
+    'huge_output': [
+        ('TEST_000', "input()\nwhile True:\n    print('x' * 1000)\n"),
+        ('TEST_001', "def sum(x, y):\n    print('y' * 10 ** 7)\n    return x + y\n"),
+    ],
+    'memory_hungry': [
+        ('TEST_001', 'def sum(x, y):\n    data = [0] * 10 ** 9\n    return x + y\n'),
+        ('TEST_002', 'answer = list(range(10 ** 9))\n'),
+    ],
+}
+
+# Доля каждого вида решений в нагрузке
+DEFAULT_MIX = {'correct': 40, 'wrong': 25, 'syntax_error': 10,
+               'infinite_loop': 5, 'huge_output': 10, 'memory_hungry': 10}
+
+# Перцентили времени ответа в отчете
+PERCENTILES = (50, 95, 99)
+
+
+def xqueue_body(problem_name, student_response, student_id, hide_answer=False):
+    """Тело POST запроса XQueue с вложенными JSON строками, как его разбирает get_info()."""
+    return json.dumps({'xqueue_body': json.dumps({
+        'grader_payload': json.dumps({'problem_name': problem_name,
+                                      'hide_answer': str(hide_answer)}),
+        'student_response': student_response,
+        'student_info': json.dumps({'anonymous_student_id': student_id}),
+    })}).encode()
+
+
+def generate_requests(count, mix=None, seed=0, unique=True):
+    """
+    Генерирует count запросов в случайном, но воспроизводимом при одинаковом seed порядке.
+
+    Аргументы:
+        mix (dict): доля каждого вида решений, по умолчанию DEFAULT_MIX
+        unique (bool): добавлять к каждому решению уникальный комментарий, чтобы
+                       повторные решения оценивались заново, а не брались из кэша
+
+    Возвращает:
+        список (kind, problem_name, body)
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    requests = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        problem_name, code = rng.choice(SUBMISSIONS[kind])
+        if unique:
+            code += '# {} {}\n'.format(seed, i)
+        student_id = 'student_{}'.format(rng.randrange(10000))
+        requests.append((kind, problem_name, xqueue_body(problem_name, code, student_id)))
+    return requests
+
+
+def replay_requests(path, count, problem_name=None):
+    """
+    Запросы с решениями из хранилища path (см. store.py) в порядке их записи.
+    Вид запроса - 'correct' или 'wrong' по сохраненному результату.
+
+    Возвращает:
+        список (kind, problem_name, body), не длиннее count
+    """
+    submission_store = SubmissionStore(path)
+    try:
+        submissions = itertools.islice(submission_store.submissions(problem_name), count)
+        return [('correct' if submission['correct'] else 'wrong', submission['problem'],
+                 xqueue_body(submission['problem'], submission['code'], submission['user'],
+                             submission['hide_answer']))
+                for submission in submissions]
+    finally:
+        submission_store.close()
+
+
+def parse_mix(value):
+    """Разбирает строку вида 'correct=50,wrong=50' в словарь долей."""
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in SUBMISSIONS:
+            raise argparse.ArgumentTypeError('неизвестный вид решений: {}'.format(kind))
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    """Перцентиль p отсортированного списка values методом ближайшего ранга."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, -(-len(values) * p // 100) - 1))
+    return values[int(index)]
+
+
+def latency_summary(latencies):
+    """Статистика времени ответа в миллисекундах."""
+    values = sorted(latencies)
+    summary = {'count': len(values)}
+    if values:
+        summary['mean'] = round(sum(values) / len(values) * 1000, 3)
+        summary['max'] = round(values[-1] * 1000, 3)
+        for p in PERCENTILES:
+            summary['p{}'.format(p)] = round(percentile(values, p) * 1000, 3)
+    return summary
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Периодически измеряет загрузку процессора и памяти машины по /proc,
+    а также память процесса грейдера вместе со всеми его дочерними процессами.
+    """
+    def __init__(self, pid=None, interval=0.25):
+        super().__init__(name='resource-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.memory_used = []
+        self.server_rss = []
+        self._stopped = threading.Event()
+
+    def run(self):
+        previous = _cpu_times()
+        while not self._stopped.wait(self.interval):
+            current = _cpu_times()
+            busy, total = current[0] - previous[0], current[1] - previous[1]
+            previous = current
+            if total > 0:
+                self.cpu.append(busy / total * 100)
+            self.memory_used.append(_memory_used())
+            if self.pid is not None:
+                self.server_rss.append(_tree_rss(self.pid))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def summary(self):
+        summary = {'cpu_count': os.cpu_count(),
+                   'load_average': list(os.getloadavg())}
+        if self.cpu:
+            summary['cpu_percent_mean'] = round(sum(self.cpu) / len(self.cpu), 1)
+            summary['cpu_percent_max'] = round(max(self.cpu), 1)
+        if self.memory_used:
+            summary['memory_used_mb_max'] = round(max(self.memory_used) / 2 ** 20, 1)
+        if self.server_rss:
+            summary['server_rss_mb_max'] = round(max(self.server_rss) / 2 ** 20, 1)
+        return summary
+
+
+def _cpu_times():
+    # Возвращает (занятое, общее) время всех процессоров из /proc/stat
+    with open('/proc/stat') as f:
+        values = [int(value) for value in f.readline().split()[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values) - idle, sum(values)
+
+
+def _memory_used():
+    info = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            name, value = line.split(':', 1)
+            info[name] = int(value.split()[0]) * 1024
+    return info['MemTotal'] - info.get('MemAvailable', info['MemFree'])
+
+
+def _tree_rss(root):
+    # Сумма RSS процесса root и всех его потомков
+    children = {}
+    rss = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        pid = int(name)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * page_size
+    total, stack = 0, [root]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, ()))
+    return total
+
+
+class LoadGenerator:
+    """
+    Отправляет запросы грейдеру из concurrency потоков, каждый из которых
+    использует одно постоянное соединение.
+
+    Аргументы:
+        host, port: адрес грейдера
+        requests (list): запросы из generate_requests()
+        concurrency (int): количество одновременных соединений
+        duration (float): если задано, запросы отправляются по кругу до истечения
+                          duration секунд, иначе каждый запрос отправляется один раз
+        timeout (float): время ожидания ответа на один запрос
+    """
+    def __init__(self, host, port, requests, concurrency=8, duration=None, timeout=60):
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.duration = duration
+        self.timeout = timeout
+        self._requests = itertools.cycle(requests) if duration else iter(requests)
+        self._lock = threading.Lock()
+        self._deadline = None
+        self.samples = []
+
+    def run(self):
+        """Выполняет тест и возвращает его длительность в секундах."""
+        started = time.monotonic()
+        if self.duration:
+            self._deadline = started + self.duration
+        threads = [threading.Thread(target=self._worker, name='load-{}'.format(i))
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started
+
+    def _next(self):
+        with self._lock:
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                return None
+            return next(self._requests, None)
+
+    def _worker(self):
+        connection = None
+        while True:
+            item = self._next()
+            if item is None:
+                break
+            kind, problem_name, body = item
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            sent = time.monotonic()
+            try:
+                connection.request('POST', '/', body, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                payload = response.read()
+                status = response.status
+                if response.will_close:
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException) as err:
+                status, payload = type(err).__name__, b''
+                connection.close()
+                connection = None
+            latency = time.monotonic() - sent
+
+            correct = None
+            if status == 200:
+                try:
+                    correct = json.loads(payload).get('correct')
+                except ValueError:
+                    status = 'invalid_json'
+            with self._lock:
+                self.samples.append((kind, problem_name, status, correct, latency))
+        if connection is not None:
+            connection.close()
+
+
+def build_report(samples, elapsed, config, resources):
+    """Собирает результаты теста в словарь, который сохраняется в JSON."""
+    statuses = {}
+    by_kind = {}
+    for kind, problem_name, status, correct, latency in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        entry = by_kind.setdefault(kind, {'latencies': [], 'statuses': {}, 'correct': 0})
+        entry['latencies'].append(latency)
+        entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+        entry['correct'] += bool(correct)
+
+    graded = [latency for _, _, status, _, latency in samples if status == 200]
+    kinds = {}
+    for kind, entry in sorted(by_kind.items()):
+        kinds[kind] = dict(latency_summary(entry['latencies']),
+                           statuses=entry['statuses'], correct=entry['correct'])
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': config,
+        'elapsed': round(elapsed, 3),
+        'requests': len(samples),
+        'statuses': statuses,
+        'throughput': round(len(graded) / elapsed, 3) if elapsed else None,
+        'latency_ms': latency_summary(graded),
+        'kinds': kinds,
+        'resources': resources,
+    }
+
+
+def print_report(report):
+    latency = report['latency_ms']
+    print('Запросов: {}, за {:.1f} сек., ответы: {}'.format(
+        report['requests'], report['elapsed'], report['statuses']))
+    print('Пропускная способность: {} решений/сек.'.format(report['throughput']))
+    if latency['count']:
+        print('Время ответа, мс: ' + ', '.join(
+            '{} {}'.format(name, latency[name])
+            for name in ['mean'] + ['p{}'.format(p) for p in PERCENTILES] + ['max']))
+    for kind, entry in report['kinds'].items():
+        print('  {:<14} {:>5} запросов, p50 {} мс, p99 {} мс, ответы {}'.format(
+            kind, entry['count'], entry.get('p50'), entry.get('p99'), entry['statuses']))
+    print('Ресурсы: {}'.format(report['resources']))
+
+
+def compare_reports(base, other):
+    """Печатает изменение основных показателей между двумя сохраненными отчетами."""
+    rows = [('throughput', base['throughput'], other['throughput'])]
+    for name in ['mean'] + ['p{}'.format(p) for p in PERCENTILES]:
+        rows.append(('latency ' + name, base['latency_ms'].get(name), other['latency_ms'].get(name)))
+    for name in ('cpu_percent_mean', 'server_rss_mb_max'):
+        rows.append((name, base['resources'].get(name), other['resources'].get(name)))
+    for name, old, new in rows:
+        change = ''
+        if old and new is not None:
+            change = '{:+.1f}%'.format((new - old) / old * 100)
+        print('{:<20} {:>12} {:>12} {:>9}'.format(name, str(old), str(new), change))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование грейдера')
+    parser.add_argument('--server', choices=('sync', 'async'), default='async',
+                        help='режим запускаемого грейдера')
+    parser.add_argument('--url', help='адрес уже запущенного грейдера, тогда грейдер не запускается')
+    parser.add_argument('--requests', type=int, default=200, help='количество запросов')
+    parser.add_argument('--duration', type=float,
+                        help='длительность теста в секундах вместо фиксированного числа запросов')
+    parser.add_argument('--concurrency', type=int, default=8, help='одновременных соединений')
+    parser.add_argument('--mix', type=parse_mix, help='доли решений, например correct=50,wrong=50')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', metavar='DATABASE',
+                        help='отправлять решения из хранилища store.py вместо --mix')
+    parser.add_argument('--repeat', action='store_true',
+                        help='не делать решения уникальными, чтобы проверить кэш')
+    parser.add_argument('--pool-size', type=int, help='pool_size запускаемого грейдера')
+    parser.add_argument('--slots', type=int, help='slots запускаемого грейдера')
+    parser.add_argument('--max-queue', type=int, help='max_queue запускаемого грейдера')
+    parser.add_argument('--server-log', help='файл для вывода запускаемого грейдера')
+    parser.add_argument('--output', help='файл для отчета, по умолчанию benchmark-<время>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'OTHER'),
+                        help='сравнить два сохраненных отчета и выйти')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path) as f:
+                reports.append(json.load(f))
+        compare_reports(*reports)
+        return
+
+    # При тесте по времени запросы повторяются по кругу
+    count = args.requests if not args.duration else max(args.requests, 1000)
+    if args.replay:
+        requests = replay_requests(args.replay, count)
+        if not requests:
+            print('В хранилище {} нет решений'.format(args.replay))
+            return
+    else:
+        requests = generate_requests(count, args.mix, args.seed, unique=not args.repeat)
+
+    server = None
+    if args.url:
+        address = urlsplit(args.url)
+        host, port = address.hostname, address.port or 80
+    else:
+        host, port = 'localhost', free_port()
+        options = {name: value for name, value in [('pool_size', args.pool_size),
+                                                   ('slots', args.slots),
+                                                   ('max_queue', args.max_queue)]
+                   if value is not None}
+        server = GraderServer(args.server, port, options, args.server_log)
+        server.start()
+
+    sampler = ResourceSampler(server.process.pid if server else None)
+    try:
+        sampler.start()
+        generator = LoadGenerator(host, port, requests, args.concurrency, args.duration)
+        elapsed = generator.run()
+    finally:
+        sampler.stop()
+        if server is not None:
+            server.stop()
+
+    config = {'server': 'external' if args.url else args.server,
+              'concurrency': args.concurrency, 'requests': args.requests,
+              'duration': args.duration, 'mix': args.mix or DEFAULT_MIX,
+              'seed': args.seed, 'unique': not args.repeat, 'replay': args.replay,
+              'pool_size': args.pool_size, 'slots': args.slots, 'max_queue': args.max_queue}
+    report = build_report(generator.samples, elapsed, config, sampler.summary())
+    print_report(report)
+
+    output = args.output or 'benchmark-{}.json'.format(time.strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print('Отчет сохранен в {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Кэш результатов оценки повторно отправленных решений.
+
+Ключ кэша строится по названию задания, хэшу нормализованного кода
+пользователя, флагу hide_answer и версии файла problems/<name>.py,
+поэтому при изменении задания старые результаты перестают находиться.
+
+Кэш двухуровневый: LRU в памяти и, при необходимости, база SQLite
+на диске, которая сохраняется между перезапусками грейдера.
+
+Задания, которые генерируют случайные тестовые значения, должны явно
+запретить кэширование, объявив в модуле задания
+    CACHE_RESULTS = False
+иначе повторная отправка неверного решения, которому повезло со случайными
+значениями, всегда будет получать тот же успешный результат.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from util import print_log, source_version
+
+# Атрибут модуля задания, разрешающий или запрещающий кэширование
+POLICY_ATTRIBUTE = 'CACHE_RESULTS'
+
+
+def normalize_code(student_response):
+    """
+    Приводит код к виду, в котором незначимые отличия не меняют ключ кэша:
+    одинаковые переводы строк и отсутствие пробельных символов в конце.
+    """
+    return student_response.replace('\r\n', '\n').replace('\r', '\n').rstrip()
+
+
+def code_digest(student_response):
+    """Хэш нормализованного кода пользователя."""
+    return hashlib.sha256(normalize_code(student_response).encode()).hexdigest()
+
+
+class ProblemInfo:
+    """
+    Версия файла задания и его политика кэширования.
+
+    Файл перечитывается, только если изменились его размер или время изменения.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._known = {}
+
+    def get(self, problem_name):
+        """
+        Возвращает (version, cacheable) для задания problem_name
+        или (None, False), если файла задания нет.
+        """
+        path = os.path.join('problems', '{}.py'.format(problem_name))
+        try:
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return None, False
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            known = self._known.get(problem_name)
+        if known is not None and known[0] == stamp:
+            return known[1], known[2]
+
+        with open(path, 'rb') as f:
+            source = f.read()
+        version = source_version(source)
+        cacheable = _read_policy(source)
+        with self._lock:
+            self._known[problem_name] = (stamp, version, cacheable)
+        return version, cacheable
+
+
+def _read_policy(source):
+    # Значение CACHE_RESULTS читается без импорта модуля задания
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return False
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == POLICY_ATTRIBUTE
+                for target in node.targets):
+            try:
+                return bool(ast.literal_eval(node.value))
+            except ValueError:
+                return False
+    return True
+
+
+class ResultCache:
+    """
+    Кэш ответов XQueue для уже оцененных решений.
+
+    Аргументы:
+        max_entries (int): количество ответов в памяти.
+        path (str): путь к файлу SQLite для хранения ответов на диске.
+                    Если не указан, кэш хранится только в памяти.
+        max_disk_entries (int): количество ответов на диске.
+    """
+    def __init__(self, max_entries=10000, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.problems = ProblemInfo()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+        # Обращения к кэшу с файлом на диске могут ожидать ввода-вывода
+        self.persistent = path is not None
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                             '(key TEXT PRIMARY KEY, response TEXT, accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            self._db.commit()
+            self._disk_count = self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+        # Статистика
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def key(self, problem_name, student_response, hide_answer):
+        """
+        Возвращает ключ кэша для решения или None, если решение кэшировать нельзя.
+        """
+        version, cacheable = self.problems.get(problem_name)
+        if not cacheable:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        return '{}:{}:{}:{}'.format(problem_name, version, int(bool(hide_answer)),
+                                    code_digest(student_response))
+
+    def get(self, key):
+        """Возвращает сохраненный ответ или None."""
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return response
+
+            if self._db is not None:
+                row = self._db.execute('SELECT response FROM results WHERE key = ?',
+                                       (key,)).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE results SET accessed = ? WHERE key = ?',
+                                     (time.time(), key))
+                    self._db.commit()
+                    response = json.loads(row[0])
+                    self._remember(key, response)
+                    self.disk_hits += 1
+                    return response
+
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        """Сохраняет ответ в кэш."""
+        with self._lock:
+            self._remember(key, response)
+            if self._db is None:
+                return
+            try:
+                row = (key, json.dumps(response), time.time())
+                if self._db.execute('INSERT OR IGNORE INTO results VALUES (?, ?, ?)', row).rowcount:
+                    self._disk_count += 1
+                else:
+                    self._db.execute('UPDATE results SET response = ?, accessed = ? WHERE key = ?',
+                                     row[1:] + row[:1])
+                excess = self._disk_count - self.max_disk_entries
+                if excess > 0:
+                    self._db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                                     'ORDER BY accessed LIMIT ?)', (excess,))
+                    self._disk_count -= excess
+                    self.evictions += excess
+                self._db.commit()
+            except sqlite3.Error:
+                print_log('Не удалось сохранить результат в кэш на диске: {}'.format(key))
+
+    def _remember(self, key, response):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """Возвращает словарь со статистикой кэша."""
+        with self._lock:
+            return {'memory_entries': len(self._memory),
+                    'memory_hits': self.memory_hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'bypassed': self.bypassed,
+                    'evictions': self.evictions}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
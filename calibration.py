@@ -0,0 +1,253 @@
+"""
+Калибровка ограничения времени оценки решений для каждого задания.
+
+Задание может объявить эталонное решение - строку с кодом, который
+проходит все тесты:
+
+    REFERENCE_SOLUTION = '''
+    def sum(x, y):
+        return x + y
+    '''
+
+Эталонное решение оценивается CALIBRATION_RUNS раз тем же путем, что и
+решения пользователей (пул тестировщиков, планировщик), и время оценки
+решения задания ограничивается TIME_LIMIT_FACTOR временами самого долгого
+из этих запусков, но не меньше MIN_TIME_LIMIT и не больше MAX_TIME_LIMIT
+секунд. Пока задание не откалибровано или если у него нет эталонного
+решения, используется grader.TESTER_TIMEOUT.
+
+Результаты калибровки хранятся в файле CALIBRATION_FILE каталога заданий
+вместе с хэшем файла задания, поэтому после перезапуска грейдера задания
+заново не калибруются, а после изменения файла задания калибруются снова.
+
+Запуск калибровки всех заданий без запуска сервера:
+    python3 calibration.py
+    python3 calibration.py TEST_000 --force
+"""
+
+import argparse
+import json
+import os
+import queue
+import statistics
+import threading
+
+import grader
+from util import file_version, print_log, stop_logging
+
+# Файл с результатами калибровки в каталоге заданий
+CALIBRATION_FILE = 'calibration.json'
+
+# Сколько раз оценивается эталонное решение
+CALIBRATION_RUNS = 5
+
+# Во сколько раз время оценки решения может превышать время эталонного решения
+TIME_LIMIT_FACTOR = 5
+
+# Границы ограничения времени в секундах
+MIN_TIME_LIMIT = 1
+MAX_TIME_LIMIT = 30
+
+
+class Calibration:
+    """
+    Результат калибровки задания.
+
+    Атрибуты:
+        problem_name (str): название задания
+        version (str): хэш файла задания, для которого выполнена калибровка
+        runs (list): время оценки эталонного решения в каждом запуске, в секундах
+    """
+    def __init__(self, problem_name, version, runs):
+        self.problem_name = problem_name
+        self.version = version
+        self.runs = runs
+
+    @property
+    def reference_time(self):
+        """Медианное время оценки эталонного решения."""
+        return statistics.median(self.runs)
+
+    @property
+    def time_limit(self):
+        """Ограничение времени оценки решения задания в секундах."""
+        limit = TIME_LIMIT_FACTOR * max(self.runs)
+        return round(min(MAX_TIME_LIMIT, max(MIN_TIME_LIMIT, limit)), 1)
+
+    def as_dict(self):
+        return {'version': self.version,
+                'runs': [round(seconds, 4) for seconds in self.runs],
+                'reference_time': round(self.reference_time, 4),
+                'time_limit': self.time_limit}
+
+    @classmethod
+    def from_dict(cls, problem_name, values):
+        return cls(problem_name, values['version'], values['runs'])
+
+
+class Calibrator:
+    """
+    Калибрует задания реестра и назначает им ограничение времени
+    (атрибут time_limit задания).
+
+    Аргументы:
+        registry (ProblemRegistry): реестр заданий
+        run (function): run(problem_name, code, timeout) оценивает код как решение
+                        задания и возвращает (correct, complete, seconds) - пройдены
+                        ли все тесты, завершилось ли тестирование и время работы
+                        тестировщика без ожидания слота
+        path (str): файл с результатами калибровки, по умолчанию
+                    CALIBRATION_FILE в каталоге заданий
+        runs (int): сколько раз оценивается эталонное решение
+    """
+    def __init__(self, registry, run, path=None, runs=CALIBRATION_RUNS):
+        self.registry = registry
+        self.run = run
+        self.path = path or os.path.join(registry.directory, CALIBRATION_FILE)
+        self.runs = runs
+        self._lock = threading.Lock()
+        self._saved = self._read()
+        self._seen = {}
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Запускает фоновую калибровку заданий, у которых нет актуальной калибровки."""
+        self._thread = threading.Thread(target=self._loop, name='calibration', daemon=True)
+        self._thread.start()
+        for name in self.registry.names():
+            self.time_limit(name)
+
+    def stop(self):
+        """Останавливает калибровку после текущего запуска эталонного решения."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def time_limit(self, problem_name):
+        """
+        Ограничение времени задания problem_name или None, если задание
+        еще не откалибровано. Задание, загруженное впервые или заново,
+        получает сохраненную калибровку или ставится в очередь на калибровку.
+        """
+        problem = self.registry.get(problem_name)
+        if problem is None or not problem.valid:
+            return None
+        with self._lock:
+            seen = self._seen.get(problem.name) is problem
+            self._seen[problem.name] = problem
+        if not seen:
+            self._prepare(problem)
+        return problem.time_limit
+
+    def _prepare(self, problem):
+        if getattr(problem.module, 'REFERENCE_SOLUTION', None) is None:
+            return
+        version = file_version(problem.module.__file__)
+        with self._lock:
+            saved = self._saved.get(problem.name)
+        if saved is not None and saved.version == version:
+            problem.time_limit = saved.time_limit
+        elif self._thread is not None:
+            self._queue.put((problem, version))
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            problem, version = item
+            # Задание могло быть загружено заново, пока ожидало в очереди
+            if self.registry.get(problem.name) is problem:
+                self.calibrate(problem, version)
+
+    def calibrate(self, problem, version=None):
+        """
+        Оценивает эталонное решение задания и назначает заданию ограничение времени.
+
+        Возвращает:
+            Calibration или None, если эталонное решение не прошло тесты
+        """
+        reference = problem.module.REFERENCE_SOLUTION
+        version = version or file_version(problem.module.__file__)
+        runs = []
+        for _ in range(self.runs):
+            if self._stopped.is_set():
+                return None
+            correct, complete, seconds = self.run(problem.name, reference, MAX_TIME_LIMIT)
+            if not (correct and complete):
+                print_log('Эталонное решение задания {} не прошло тесты, используется '
+                          'ограничение времени по умолчанию'.format(problem.name))
+                return None
+            runs.append(seconds)
+
+        calibration = Calibration(problem.name, version, runs)
+        problem.time_limit = calibration.time_limit
+        with self._lock:
+            self._saved[problem.name] = calibration
+            self._write()
+        print_log('Задание {} откалибровано: эталонное решение {:.3f} сек., '
+                  'ограничение времени {} сек.'.format(problem.name, calibration.reference_time,
+                                                      calibration.time_limit))
+        return calibration
+
+    def saved(self):
+        """Сохраненные результаты калибровки по названиям заданий."""
+        with self._lock:
+            return dict(self._saved)
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                values = json.load(f)
+            return {name: Calibration.from_dict(name, entry) for name, entry in values.items()}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            print_log('Файл калибровки {} поврежден, задания будут откалиброваны заново'.format(
+                self.path))
+            return {}
+
+    def _write(self):
+        # Вызывается под self._lock. Файл заменяется целиком, чтобы его нельзя было прочитать недописанным
+        values = {name: calibration.as_dict() for name, calibration in sorted(self._saved.items())}
+        temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(values, f, indent=2, ensure_ascii=False)
+        os.replace(temporary, self.path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Калибровка ограничения времени заданий')
+    parser.add_argument('problems', nargs='*', help='задания, по умолчанию все')
+    parser.add_argument('--force', action='store_true',
+                        help='калибровать задания, даже если калибровка актуальна')
+    parser.add_argument('--pool-size', type=int, help='количество процессов-шаблонов тестировщика')
+    args = parser.parse_args(argv)
+
+    grader.setup(args.pool_size, calibrate=False)
+    calibrator = grader.calibrator
+    try:
+        for name in args.problems or grader.registry.names():
+            problem = grader.registry.get(name)
+            if problem is None or not problem.valid:
+                print_log('Задание {} не найдено или загружено с ошибкой'.format(name))
+                continue
+            if getattr(problem.module, 'REFERENCE_SOLUTION', None) is None:
+                print_log('У задания {} нет эталонного решения'.format(name))
+                continue
+            if args.force or calibrator.time_limit(name) is None:
+                calibrator.calibrate(problem)
+        for name, calibration in sorted(calibrator.saved().items()):
+            print('{:<20} {:>8.3f} {:>6} сек.'.format(name, calibration.reference_time,
+                                                    calibration.time_limit))
+    finally:
+        grader.tester_pool.close()
+        stop_logging()
+
+
+if __name__ == '__main__':
+    main()
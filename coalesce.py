@@ -0,0 +1,148 @@
+"""
+Объединение одновременных одинаковых запросов на оценку.
+
+Если пользователь дважды нажал кнопку отправки или XQueue повторил запрос,
+который еще оценивается, грейдер получает несколько одинаковых решений
+одновременно. Пока первое из них оценивается, остальные ждут его результата
+и получают тот же ответ, не запуская собственный тестировщик. Если первый
+запрос отменен (клиент asyncio сервера закрыл соединение), ожидавшие его
+запросы выполняют оценку заново. Ключ запроса включает версию файла задания,
+поэтому решение, полученное после изменения задания, не ждет результата,
+полученного со старой версией.
+"""
+
+import asyncio
+import threading
+
+from cache import ProblemInfo, code_digest
+
+
+def submission_key(problem_name, version, student_response, hide_answer, regrade=False):
+    """
+    Ключ, по которому одинаковые решения считаются одним запросом. Повторная
+    оценка (regrade) объединяется только с повторной оценкой: иначе решение
+    студента ждало бы результата из очереди планировщика с низким приоритетом.
+    """
+    return '{}:{}:{}:{}:{}'.format(problem_name, version, int(bool(hide_answer)),
+                                   int(bool(regrade)), code_digest(student_response))
+
+
+class _Call:
+    """Выполняющаяся оценка, результат которой ожидают другие запросы."""
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.event = threading.Event()
+        self.callbacks = []
+
+    def finish(self):
+        self.event.set()
+        for callback in self.callbacks:
+            callback()
+
+
+class Coalescer:
+    """Выполняет одну оценку на все одновременные запросы с одинаковым ключом."""
+    def __init__(self):
+        self.problems = ProblemInfo()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+        # Статистика
+        self.executed = 0
+        self.coalesced = 0
+
+    def key(self, problem_name, student_response, hide_answer, regrade=False):
+        """Возвращает submission_key() решения для текущей версии файла задания."""
+        version, _ = self.problems.get(problem_name)
+        return submission_key(problem_name, version, student_response, hide_answer, regrade)
+
+    def _join(self, key):
+        # Возвращает (call, leader): leader == True, если оценку выполняет этот запрос
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._inflight[key] = _Call()
+            self.executed += 1
+            return call, True
+
+    def _leave(self, key, call):
+        with self._lock:
+            del self._inflight[key]
+            call.finish()
+
+    def run(self, key, function):
+        """
+        Вызывает function() или дожидается результата такого же вызова,
+        уже выполняющегося в другом потоке.
+
+        Возвращает:
+            result: результат function()
+            shared (bool): True, если результат получен от другого запроса
+        """
+        call, leader = self._join(key)
+        if leader:
+            try:
+                call.result = function()
+            except BaseException as err:
+                call.error = err
+                raise
+            finally:
+                self._leave(key, call)
+            return call.result, False
+
+        call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    async def run_async(self, key, function):
+        """
+        Асинхронная версия run(): function() должна возвращать корутину.
+
+        Отмена запроса, выполняющего оценку, не передается ожидающим его
+        запросам: один из них выполняет оценку заново, а остальные ждут его.
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                try:
+                    call.result = await function()
+                except asyncio.CancelledError:
+                    call.cancelled = True
+                    raise
+                except BaseException as err:
+                    call.error = err
+                    raise
+                finally:
+                    self._leave(key, call)
+                return call.result, False
+
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                if call.event.is_set():
+                    future.set_result(None)
+                else:
+                    call.callbacks.append(lambda: loop.call_soon_threadsafe(_set_result, future))
+            await future
+            if call.cancelled:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+    def stats(self):
+        """Возвращает словарь со статистикой объединения запросов."""
+        with self._lock:
+            return {'executed': self.executed,
+                    'coalesced': self.coalesced,
+                    'inflight': len(self._inflight)}
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,357 @@
+"""
+Распределение решений между несколькими грейдерами.
+
+Диспетчер принимает те же POST запросы XQueue, что и grader.Handler,
+и пересылает каждый запрос одному из грейдеров. Выбирается исправный грейдер
+с наименьшей загрузкой: число пересылаемых ему запросов и число решений,
+о котором он сообщил в /healthz, деленные на количество его слотов.
+Состояние грейдеров проверяется фоновым потоком раз в HEALTH_INTERVAL секунд,
+все грейдеры одновременно: грейдер, не ответивший за HEALTH_TIMEOUT секунд,
+считается неисправным и не задерживает проверку остальных.
+
+С флагом affinity решения одного задания отправляются на один и тот же
+грейдер (rendezvous hashing по problem_name), чтобы его кэш результатов
+и загруженные модули заданий использовались повторно. Если этот грейдер
+перегружен или неисправен, выбирается наименее загруженный из остальных.
+
+Если грейдер не ответил или ответил кодом 5xx, запрос пересылается
+следующему грейдеру. Если ни один грейдер не смог принять решение,
+XQueue получает ответ 503 с заголовком Retry-After.
+
+Запуск:
+    python3 dispatcher.py --backend http://localhost:1711 --backend http://localhost:1712
+    python3 dispatcher.py --local 3 --affinity
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from json.decoder import JSONDecodeError
+from socketserver import ThreadingMixIn
+
+import grader
+from launcher import GraderServer
+from util import print_log
+from xqueue_client import ConnectionPool, ResponseTimeout
+
+# Как часто проверять состояние грейдеров, в секундах
+HEALTH_INTERVAL = 1
+
+# Сколько секунд ждать ответа грейдера на /healthz
+HEALTH_TIMEOUT = 2
+
+# Сколько секунд ждать ответа грейдера на решение
+FORWARD_TIMEOUT = 60
+
+# Грейдер, выбранный по заданию, используется, пока его загрузка
+# (решений на один слот) не превышает AFFINITY_MAX_LOAD
+AFFINITY_MAX_LOAD = 2
+
+# Заголовки запроса, которые пересылаются грейдеру
+FORWARD_HEADERS = ('Content-Type', 'X-Request-ID')
+
+
+class Backend:
+    """
+    Грейдер, которому пересылаются решения.
+
+    Атрибуты:
+        url (str): адрес грейдера
+        healthy (bool): грейдер отвечает на /healthz и принимает решения
+        inflight (int): количество запросов, пересылаемых грейдеру сейчас
+        state (dict): последний ответ грейдера на /healthz
+    """
+    def __init__(self, url, pool_size=16):
+        self.url = url.rstrip('/')
+        self.pool = ConnectionPool(self.url, pool_size, FORWARD_TIMEOUT)
+        self.healthy = True
+        self.inflight = 0
+        self.state = {}
+        self.forwarded = 0
+        self.failures = 0
+        self._checker = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Загрузка грейдера: количество решений на один слот."""
+        reported = self.state.get('running', 0) + self.state.get('queued', 0)
+        return max(self.inflight, reported) / max(1, self.state.get('slots', 1))
+
+    def check(self):
+        """Запрашивает /healthz и обновляет состояние грейдера."""
+        connection = http.client.HTTPConnection(self.pool.host, self.pool.port,
+                                                timeout=HEALTH_TIMEOUT)
+        try:
+            connection.request('GET', self.pool.prefix + '/healthz')
+            response = connection.getresponse()
+            state = json.loads(response.read())
+        except (OSError, http.client.HTTPException, ValueError):
+            self.set_healthy(False)
+            return
+        finally:
+            connection.close()
+        # Переполненный грейдер (saturated) исправен, но выбирается в последнюю очередь
+        self.state = state
+        self.set_healthy(state.get('status') in ('ok', 'saturated'))
+
+    def start_check(self):
+        """
+        Запускает check() в отдельном потоке и возвращает этот поток. Если
+        предыдущая проверка еще не закончилась, новая не запускается и
+        возвращается None.
+        """
+        if self._checker is not None and self._checker.is_alive():
+            return None
+        self._checker = threading.Thread(target=self.check, name='health-check-{}'.format(self.url),
+                                         daemon=True)
+        self._checker.start()
+        return self._checker
+
+    def set_healthy(self, healthy):
+        """Отмечает грейдер исправным или неисправным до следующей проверки."""
+        # Вызывается и потоком проверки, и потоками, пересылающими запросы
+        with self._lock:
+            changed, self.healthy = healthy != self.healthy, healthy
+        if changed:
+            print_log('Грейдер {} {}'.format(self.url, 'снова доступен' if healthy else 'недоступен'))
+
+    def as_dict(self):
+        return {'url': self.url, 'healthy': self.healthy, 'inflight': self.inflight,
+                'load': round(self.load(), 3), 'forwarded': self.forwarded,
+                'failures': self.failures, 'state': self.state}
+
+
+class NoBackend(Exception):
+    """Ни один грейдер не принял решение."""
+    def __init__(self, retry_after=1):
+        super().__init__('Нет доступных грейдеров')
+        self.retry_after = retry_after
+
+
+class BackendTimeout(Exception):
+    """Грейдер получил решение, но не ответил за FORWARD_TIMEOUT секунд."""
+    def __init__(self, backend):
+        super().__init__('Грейдер {} не ответил за {} сек.'.format(backend.url, FORWARD_TIMEOUT))
+        self.backend = backend
+
+
+class Dispatcher:
+    """
+    Выбирает грейдер для каждого решения и пересылает ему запрос.
+
+    Аргументы:
+        urls (list): адреса грейдеров
+        affinity (bool): отправлять решения одного задания на один грейдер
+    """
+    def __init__(self, urls, affinity=False):
+        self.backends = [Backend(url) for url in urls]
+        self.affinity = affinity
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._checker = threading.Thread(target=self._check_loop, name='health-check', daemon=True)
+
+    def start(self):
+        self.check_all()
+        self._checker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._checker.join()
+        for backend in self.backends:
+            backend.pool.close()
+
+    def check_all(self):
+        """
+        Проверяет все грейдеры одновременно и ждет ответов не дольше HEALTH_TIMEOUT
+        секунд. Грейдер, проверка которого не закончилась за это время, отмечается
+        неисправным.
+        """
+        deadline = time.monotonic() + HEALTH_TIMEOUT
+        checks = [(backend, backend.start_check()) for backend in self.backends]
+        for backend, thread in checks:
+            if thread is not None:
+                thread.join(max(0.0, deadline - time.monotonic()))
+            if thread is None or thread.is_alive():
+                backend.set_healthy(False)
+
+    def _check_loop(self):
+        while not self._stop.wait(HEALTH_INTERVAL):
+            self.check_all()
+
+    def order(self, problem_name=None):
+        """
+        Грейдеры в порядке, в котором им предлагается решение: сначала исправные
+        по возрастанию загрузки (или выбранный по заданию), затем неисправные.
+        """
+        with self._lock:
+            healthy = [backend for backend in self.backends if backend.healthy]
+            broken = [backend for backend in self.backends if not backend.healthy]
+            # Случайный порядок перед сортировкой распределяет запросы между одинаково загруженными
+            random.shuffle(healthy)
+            healthy.sort(key=lambda backend: (backend.state.get('status') == 'saturated',
+                                              backend.load()))
+            if self.affinity and problem_name is not None and healthy:
+                preferred = max(healthy, key=lambda backend: _rendezvous(problem_name, backend.url))
+                if preferred.load() < AFFINITY_MAX_LOAD:
+                    healthy.remove(preferred)
+                    healthy.insert(0, preferred)
+        return healthy + broken
+
+    def forward(self, path, body, headers, problem_name=None):
+        """
+        Пересылает запрос грейдерам по очереди, пока один из них не ответит.
+
+        Возвращает:
+            (backend, status, headers, body) ответа грейдера
+        Выбрасывает:
+            NoBackend: если ни один грейдер не принял решение
+            BackendTimeout: если грейдер получил решение, но не ответил вовремя.
+                            Решение не пересылается другому грейдеру, иначе оно
+                            было бы оценено и сохранено дважды
+        """
+        retry_after = 1
+        for backend in self.order(problem_name):
+            with self._lock:
+                backend.inflight += 1
+            try:
+                status, response_headers, data = backend.pool.request('POST', path, body, headers)
+            except ResponseTimeout as err:
+                with self._lock:
+                    backend.failures += 1
+                raise BackendTimeout(backend) from err
+            except (OSError, http.client.HTTPException) as err:
+                print_log('Грейдер {} не ответил: {}'.format(backend.url, err))
+                with self._lock:
+                    backend.failures += 1
+                backend.set_healthy(False)
+                continue
+            finally:
+                with self._lock:
+                    backend.inflight -= 1
+
+            if status == 503:
+                # Очередь грейдера заполнена, пробуем следующий
+                retry_after = max(retry_after, int(response_headers.get('Retry-After', 1)))
+                continue
+            if status >= 500:
+                with self._lock:
+                    backend.failures += 1
+                continue
+            with self._lock:
+                backend.forwarded += 1
+            return backend, status, response_headers, data
+        raise NoBackend(retry_after)
+
+    def health(self):
+        backends = [backend.as_dict() for backend in self.backends]
+        healthy = any(backend['healthy'] for backend in backends)
+        return (200 if healthy else 503), {'status': 'ok' if healthy else 'unavailable',
+                                           'backends': backends}
+
+
+def _rendezvous(problem_name, url):
+    # Вес пары задание - грейдер для rendezvous hashing
+    return hashlib.sha1('{}|{}'.format(problem_name, url).encode()).digest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Обработчик запросов XQueue, пересылающий их грейдерам."""
+    dispatcher = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] == '/healthz':
+            status, state = self.dispatcher.health()
+            self._send(status, json.dumps(state).encode(), {'Content-Type': 'application/json'})
+        else:
+            self._send(404, b'')
+
+    def do_POST(self):
+        content_len = int(self.headers['Content-Length'])
+        post_body = self.rfile.read(content_len)
+
+        problem_name = None
+        if self.dispatcher.affinity:
+            try:
+                problem_name = grader.parse_request(post_body.decode())[0]
+            except (JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                # Некорректный запрос пересылается как есть, ответ на него даст грейдер
+                pass
+
+        headers = {name: self.headers[name] for name in FORWARD_HEADERS if self.headers[name]}
+        start = time.time()
+        try:
+            backend, status, response_headers, data = self.dispatcher.forward(
+                self.path, post_body, headers, problem_name)
+        except NoBackend as err:
+            print_log('Решение не принято ни одним грейдером')
+            self._send(503, b'', {'Retry-After': str(err.retry_after)})
+            return
+        except BackendTimeout as err:
+            print_log(str(err))
+            self._send(504, b'')
+            return
+        print_log('Решение {}переслано грейдеру {}, ответ {} за {:.3f} сек.'.format(
+            'для задания {} '.format(problem_name) if problem_name else '', backend.url,
+            status, time.time() - start))
+        extra = {name: response_headers[name] for name in ('Content-Type', 'Retry-After')
+                 if response_headers[name]}
+        self._send(status, data, extra)
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start(urls, host='localhost', port=1710, affinity=False):
+    """Запускает диспетчер для грейдеров с адресами urls."""
+    dispatcher = Dispatcher(urls, affinity)
+    dispatcher.start()
+    handler = type('DispatcherHandler', (Handler,), {'dispatcher': dispatcher})
+    try:
+        server = ThreadedHTTPServer((host, port), handler)
+        print('Dispatcher started on {}:{} for {} graders.'.format(host, port, len(urls)))
+        print('Press Ctrl+C to stop dispatcher')
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nDispatcher was stopped with Ctrl+C')
+    finally:
+        dispatcher.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Распределение решений между грейдерами')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1710)
+    parser.add_argument('--backend', action='append', default=[], help='адрес грейдера')
+    parser.add_argument('--local', type=int, default=0,
+                        help='запустить столько локальных грейдеров на портах после --port')
+    parser.add_argument('--local-mode', choices=('sync', 'async'), default='async')
+    parser.add_argument('--affinity', action='store_true',
+                        help='отправлять решения одного задания на один грейдер')
+    args = parser.parse_args()
+
+    # Локальные грейдеры запускаются так же, как для нагрузочного теста
+    servers = [GraderServer(args.local_mode, args.port + i + 1) for i in range(args.local)]
+    try:
+        for server in servers:
+            server.start()
+        urls = args.backend + ['http://localhost:{}'.format(server.port) for server in servers]
+        if not urls:
+            parser.error('нужно указать --backend или --local')
+        start(urls, args.host, args.port, args.affinity)
+    finally:
+        for server in servers:
+            server.stop()
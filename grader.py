@@ -5,59 +5,171 @@
 Так же в данном модуле описан класс обработчика для принятия запросов от XQueue.
 """
 
+import asyncio
 import gc
 import json
 import os
 import re
-import shutil
+import signal
 import subprocess
 import sys
 import time
 import traceback
+from contextlib import aclosing, asynccontextmanager, contextmanager
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from json.decoder import JSONDecodeError
 from socketserver import ThreadingMixIn
 
-from util import print_log, generate_random_filename
+import batch
+import calibration
+import metrics
+import report
+import timing
+from cache import ResultCache
+from coalesce import Coalescer
+from limits import OutputLimitExceeded
+from pool import TesterPool, ISOLATION_FORK, ISOLATION_PROCESS
+from protocol import ResultStream
+from registry import ProblemRegistry
+from scheduler import BULK, GradingScheduler, QueueFull
+from store import SOURCE_XQUEUE, SubmissionStore
+from util import log_event, print_log, start_logging, stop_logging
+
+# Пул процессов-шаблонов тестировщика, создается при запуске грейдера.
+# Если пул не создан, тестировщик запускается как новый процесс python3 tester.py
+tester_pool = None
+_direct_pool = TesterPool(isolation=ISOLATION_PROCESS)
+
+# Время в секундах, отведенное тестировщику на оценку одного решения,
+# если задание не откалибровано (см. calibration.py)
+TESTER_TIMEOUT = 30
+
+# Добавлять в ответ XQueue ресурсы, использованные при оценке решения,
+# в виде {'usage': {'wall_time': (float), 'cpu_time': (float), 'max_rss': (int)}}
+REPORT_USAGE = False
+
+# Кэш результатов оценки повторно отправленных решений.
+# Если кэш не создан, каждое решение оценивается заново
+result_cache = None
+
+# Объединяет одновременные запросы с одинаковыми решениями в одну оценку
+coalescer = None
+
+# Планировщик, ограничивающий число одновременно оцениваемых решений.
+# Если планировщик не создан, все решения оцениваются сразу
+scheduler = None
+
+# Реестр заданий, создается при запуске грейдера. Если реестр не создан,
+# решения для несуществующих заданий отклоняет сам тестировщик
+registry = None
+
+# Хранилище оцененных решений. Если хранилище не создано, решения не сохраняются
+submission_store = None
+
+# Калибрует ограничение времени заданий по их эталонным решениям.
+# Если калибровка не запущена, для всех заданий используется TESTER_TIMEOUT
+calibrator = None
+
+# Значения метрик, вычисляемые при каждом запросе /metrics
+metrics.INFLIGHT.set_function(lambda: scheduler.stats()['running'] if scheduler else 0)
+metrics.QUEUED.set_function(lambda: scheduler.stats()['queued'] if scheduler else 0)
+
+
+def _cache_stat(name):
+    # Значение из статистики кэша результатов для метрик
+    return lambda: result_cache.stats()[name] if result_cache is not None else 0
+
+
+metrics.CACHE_ENTRIES.set_function(_cache_stat('memory_entries'))
+metrics.CACHE_MEMORY_HITS.set_function(_cache_stat('memory_hits'))
+metrics.CACHE_DISK_HITS.set_function(_cache_stat('disk_hits'))
+metrics.CACHE_MISSES.set_function(_cache_stat('misses'))
+metrics.COALESCED.set_function(lambda: coalescer.stats()['coalesced'] if coalescer is not None else 0)
+
 
 class Handler(BaseHTTPRequestHandler):
     """Обработчик для запросов XQueue."""
     def do_HEAD(self):
-        pass
+        self._send_get(head=True)
 
     def do_GET(self):
-        pass
+        self._send_get()
+
+    def _send_get(self, head=False):
+        # /metrics и /healthz, остальные адреса не существуют
+        status, body, headers = handle_get(self.path)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
 
     def do_POST(self):
         # Метод для обработки POST запроса
-        start = time.time()
-        content_len  = int(self.headers['Content-Length'])
-        post_body = self.rfile.read(content_len ).decode()
+        if self.path.split('?', 1)[0] == batch.BATCH_PATH:
+            self._handle_batch()
+            return
+        with timing.trace_request(self.headers.get('X-Request-ID')) as trace:
+            self._handle_post(trace)
+            log_request(trace)
+
+    def _handle_post(self, trace):
+        with timing.stage('read'):
+            content_len  = int(self.headers['Content-Length'])
+            post_body = self.rfile.read(content_len ).decode()
 
         try:
-            body_content = json.loads(post_body)
+            with timing.stage('parse'):
+                problem_name, hide_answer, student_response, user_id = parse_request(post_body)
         except JSONDecodeError:
-            print('JSONDecodeError, post_body не было загружено должным образом.')
-        else:
-            problem_name, hide_answer, student_response, user_id = get_info(body_content)
-
-            if hide_answer == "True":
-                hide_answer = True
-            else:
-                hide_answer = False
-            print(hide_answer)
+            print_log('JSONDecodeError, post_body не было загружено должным образом')
+            metrics.JSON_ERRORS.inc()
+            trace.info['outcome'] = 'bad_request'
+            self.send_response(400)
+            self.end_headers()
+            return
 
+        trace.info.update(problem=problem_name, user=user_id)
+        log_event('submitted', problem=problem_name, user=user_id)
+        try:
             # Выполняем оценку пользоательского ответа на задание
-            print_log('User with id {} submitted code for problem {}.'.format(user_id, problem_name))
-            result = grade(problem_name, student_response, hide_answer)
+            result, wait, complete = grade_scheduled(problem_name, student_response, hide_answer)
+        except QueueFull as err:
+            # Просим XQueue повторить запрос позже
+            print_log('Очередь заполнена, решение пользователя {} отклонено'.format(user_id))
+            record_request(problem_name, 'rejected')
+            trace.info['outcome'] = 'rejected'
+            self.send_response(503)
+            self.send_header('Retry-After', str(err.retry_after))
+            self.end_headers()
+            return
+        store_submission(problem_name, user_id, student_response, hide_answer, result, complete)
 
-            # Отправляем ответ XQueue, содержащий результаты проверки
+        # Отправляем ответ XQueue, содержащий результаты проверки
+        with timing.stage('write'):
             send = json.dumps(result).encode()
             self.send_response(200)
             self.end_headers()
             self.wfile.write(send)
+        record_request(problem_name, 'graded', trace.elapsed())
+        trace.info.update(outcome='graded', correct=result.get('correct'), score=result.get('score'))
+
 
-            print_log('Submittedd code from user with id {} was graded in {} sec.'.format(user_id, time.time()-start))
+    def _handle_batch(self):
+        # Пакет решений, результаты отправляются по мере готовности. Ответ
+        # не содержит Content-Length, его конец обозначается закрытием соединения
+        content_len = int(self.headers['Content-Length'])
+        post_body = self.rfile.read(content_len).decode()
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', batch.CONTENT_TYPE)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for record in batch.grade_batch(batch.parse_lines(post_body.splitlines())):
+            self.wfile.write(batch.encode(record))
+            self.wfile.flush()
 
 
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
@@ -66,6 +178,241 @@ class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """
 
 
+def grade_scheduled(problem_name, student_response, hide_answer, regrade=False):
+    """
+    Оценивает решение, дождавшись свободного слота планировщика.
+    Решения, результат которых уже есть в кэше, не занимают слот,
+    а одинаковые решения, присланные одновременно, оцениваются один раз.
+    Повторная оценка (regrade) ожидает слот в очереди с низким приоритетом,
+    см. scheduler.py.
+
+    Возвращает:
+        result (dict): ответ для XQueue, как у grade()
+        wait (float): время ожидания слота в секундах
+        complete (bool): False, если тестирование не завершилось (истекло время,
+                         системная ошибка) и ответ нельзя использовать повторно
+    Выбрасывает:
+        QueueFull: если очередь планировщика заполнена
+    """
+    rejected = check_problem(problem_name, hide_answer)
+    if rejected is not None:
+        return rejected, 0.0, False
+
+    if coalescer is None:
+        return _grade_scheduled(problem_name, student_response, hide_answer, regrade)
+
+    key = coalescer.key(problem_name, student_response, hide_answer, regrade)
+    result, shared = coalescer.run(
+        key, lambda: _grade_scheduled(problem_name, student_response, hide_answer, regrade))
+    if shared:
+        print_log('Решение для задания {} совпало с уже оцениваемым, '
+                  'использован его результат'.format(problem_name))
+    return result
+
+
+async def grade_scheduled_async(problem_name, student_response, hide_answer, regrade=False):
+    """
+    Асинхронная версия grade_scheduled(). Проверка задания (при изменении файла
+    оно загружается заново) и обращения к кэшу на диске выполняются в пуле
+    потоков, чтобы не блокировать цикл событий.
+    """
+    rejected = await asyncio.to_thread(check_problem, problem_name, hide_answer)
+    if rejected is not None:
+        return rejected, 0.0, False
+
+    if coalescer is None:
+        return await _grade_scheduled_async(problem_name, student_response, hide_answer, regrade)
+
+    key = coalescer.key(problem_name, student_response, hide_answer, regrade)
+    result, shared = await coalescer.run_async(
+        key, lambda: _grade_scheduled_async(problem_name, student_response, hide_answer, regrade))
+    if shared:
+        print_log('Решение для задания {} совпало с уже оцениваемым, '
+                  'использован его результат'.format(problem_name))
+    return result
+
+
+def _grade_scheduled(problem_name, student_response, hide_answer, regrade=False):
+    key, response = cache_lookup(problem_name, student_response, hide_answer)
+    if response is not None:
+        return response, 0.0, True
+
+    with _slot(problem_name, regrade) as wait:
+        result, complete, usage = run_tester(problem_name, student_response)
+
+    response, cached = _render(result, complete, usage, hide_answer)
+    if cached is not None:
+        cache_store(key, cached)
+    return response, wait, complete
+
+
+async def _grade_scheduled_async(problem_name, student_response, hide_answer, regrade=False):
+    key, response = await _cache_call(cache_lookup, problem_name, student_response, hide_answer)
+    if response is not None:
+        return response, 0.0, True
+
+    async with _slot_async(problem_name, regrade) as wait:
+        result, complete, usage = await run_tester_async(problem_name, student_response)
+
+    response, cached = _render(result, complete, usage, hide_answer)
+    if cached is not None:
+        await _cache_call(cache_store, key, cached)
+    return response, wait, complete
+
+
+@contextmanager
+def _slot(problem_name, regrade):
+    # Слот планировщика на время оценки, возвращает время ожидания слота
+    if scheduler is None:
+        yield 0.0
+        return
+    with scheduler.slot(problem_name, scheduler_lane(problem_name, regrade)) as wait:
+        timing.add('queue', wait)
+        yield wait
+
+
+@asynccontextmanager
+async def _slot_async(problem_name, regrade):
+    if scheduler is None:
+        yield 0.0
+        return
+    async with scheduler.async_slot(problem_name, scheduler_lane(problem_name, regrade)) as wait:
+        timing.add('queue', wait)
+        yield wait
+
+
+def _render(result, complete, usage, hide_answer):
+    # Ответ XQueue и ответ для кэша результатов (None, если тестирование не завершилось)
+    with timing.stage('render'):
+        response = create_response(result, hide_answer)
+    cached = response if complete else None
+    if REPORT_USAGE:
+        response = dict(response, usage=usage)
+    return response, cached
+
+
+async def _cache_call(function, *args):
+    # Кэш в памяти отвечает сразу, а кэш с файлом на диске вызывается в пуле потоков
+    if result_cache is not None and result_cache.persistent:
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+
+def scheduler_lane(problem_name, regrade):
+    """Очередь планировщика для решения. Записывается в итоговую запись лога о запросе."""
+    lane = scheduler.lane(problem_name, regrade)
+    trace = timing.current()
+    if trace is not None:
+        trace.info['lane'] = lane
+    return lane
+
+
+def handle_get(path):
+    """
+    Отвечает на GET запросы служебных адресов, общих для обоих серверов грейдера:
+    /metrics - метрики в формате Prometheus, /healthz - состояние грейдера.
+
+    Возвращает:
+        (status, body, headers) ответа
+    """
+    path = path.split('?', 1)[0]
+    if path == '/metrics':
+        return 200, metrics.render().encode(), {'Content-Type': 'text/plain; version=0.0.4'}
+    if path == '/healthz':
+        status, state = health()
+        return status, json.dumps(state).encode(), {'Content-Type': 'application/json'}
+    return 404, b'', {}
+
+
+def health():
+    """
+    Состояние грейдера для балансировщика нагрузки.
+
+    Возвращает код 503, если грейдер не запущен или его очередь заполнена.
+    """
+    if tester_pool is None or scheduler is None:
+        return 503, {'status': 'starting'}
+    state = scheduler.stats()
+    state['status'] = 'ok' if state['queued'] < state['max_queue'] else 'saturated'
+    return (200 if state['status'] == 'ok' else 503), state
+
+
+def metric_problem(problem_name):
+    """Название задания для меток метрик. Несуществующие задания объединяются в одну метку."""
+    if registry is None or registry.get(problem_name) is not None:
+        return str(problem_name)
+    return 'unknown'
+
+
+def log_request(trace):
+    """Записывает в лог итоговую запись об обработке запроса со временем всех этапов."""
+    log_event('request', total_ms=round(trace.elapsed() * 1000, 3),
+              stages=trace.as_dict(), **trace.info)
+
+
+def store_submission(problem_name, user_id, student_response, hide_answer, response, complete,
+                     source=SOURCE_XQUEUE):
+    """
+    Сохраняет оцененное решение в хранилище вместе со временем этапов текущего
+    запроса. complete - третье значение, возвращенное grade_scheduled().
+    """
+    if submission_store is None:
+        return
+    trace = timing.current()
+    submission_store.record(problem_name, user_id, student_response, hide_answer, response,
+                            complete, trace.as_dict() if trace is not None else None, source)
+
+
+def record_request(problem_name, outcome, seconds=None):
+    """Учитывает обработанное решение в метриках."""
+    problem = metric_problem(problem_name)
+    metrics.REQUESTS.inc(problem=problem, outcome=outcome)
+    if seconds is not None:
+        metrics.GRADING_SECONDS.observe(seconds, problem=problem)
+
+
+def check_problem(problem_name, hide_answer):
+    """
+    Проверяет задание по реестру, не запуская тестировщик.
+
+    Возвращает:
+        None, если задание может проверять решения, иначе ответ для XQueue с ошибкой
+    """
+    if registry is None:
+        return None
+    problem = registry.get(problem_name)
+    if problem is None:
+        print_log('Задание {} не найдено, решение отклонено'.format(problem_name))
+        error = 'Решение для проблемы {} отсутсвует'.format(problem_name)
+    elif not problem.valid:
+        error = 'Решение для проблемы {} работает некорректно. '.format(problem_name)
+    else:
+        return None
+    return create_response({'correct': False, 'error': error}, hide_answer)
+
+
+def cache_lookup(problem_name, student_response, hide_answer):
+    """
+    Ищет ответ в кэше результатов.
+
+    Возвращает:
+        key (str): ключ кэша или None, если решение не кэшируется
+        response (dict): сохраненный ответ или None
+    """
+    if result_cache is None:
+        return None, None
+    key = result_cache.key(problem_name, student_response, hide_answer)
+    if key is None:
+        return None, None
+    return key, result_cache.get(key)
+
+
+def cache_store(key, response):
+    """Сохраняет ответ в кэш результатов, если решение кэшируется."""
+    if result_cache is not None and key is not None:
+        result_cache.put(key, response)
+
+
 def grade(problem_name, student_response, hide_answer):
     """
     Функция оценки пользовательского решения
@@ -83,69 +430,247 @@ def grade(problem_name, student_response, hide_answer):
                     score (float): процент успеха прохождения тестов в виде от 0 до 1
                     msg (str): отформатированные в HTML код результаты тестов
     """
-    try:
-        random_filename = generate_random_filename()
+    result, _, _ = run_tester(problem_name, student_response)
 
-        # Создаем временный каталог tmp, если он не существует
-        if not os.path.exists('tmp'):
-            print_log('Создание каталога ./tmp')
-            os.makedirs('tmp')
+    # Формируем ответ XQueue с результатами проверки
+    result = create_response(result, hide_answer)
 
-        # Создание файла с кодом python для тестирования из отправленного пользователем решения
-        student_program = 'Program{}_{}'.format(problem_name, random_filename)
-        source_file = open('tmp/{}.py'.format(student_program), 'w')
-    
-        source_file.write(student_response)
-        source_file.close()
-        
+    return result
+
+
+async def grade_async(problem_name, student_response, hide_answer):
+    """
+    Асинхронная версия grade() для сервера на asyncio.
+
+    Тестировщик запускается так же, как в grade(), но его завершение
+    ожидается без блокировки цикла событий и без отдельного потока.
+    """
+    result, _, _ = await run_tester_async(problem_name, student_response)
+
+    # Формируем ответ XQueue с результатами проверки
+    return create_response(result, hide_answer)
+
+
+def run_tester(problem_name, student_response, timeout=None):
+    """
+    Запускает тестировщик для пользовательского решения.
+    Код решения передается тестировщику в памяти, без временных файлов.
+
+    Результаты тестов читаются по мере их выполнения, поэтому если время
+    оценки истекло, пользователь получает результаты уже пройденных тестов.
+    По умолчанию время оценки ограничено problem_time_limit() секундами.
+
+    Возвращает:
+        result (list или dict): результаты тестов для create_response()
+        complete (bool): False, если тестирование прервано по времени или
+                         из-за системной ошибки и результат нельзя кэшировать
+        usage (dict): ресурсы, использованные тестировщиком, или None
+    """
+    try:
         # Выполняем в новом процессе дочернюю программу
-        process = subprocess.Popen(['python3',
-                                    'tester.py',
-                                    problem_name, student_program],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
+        spawned = time.monotonic()
+        process = (tester_pool or _direct_pool).spawn(problem_name, student_response)
+        record_spawn(time.monotonic() - spawned)
+        stream = ResultStream()
 
-        timeout = 30
+        timeout = timeout or problem_time_limit(problem_name)
+        error = None
         try:
-            # Запущенный процесс отработает 30 секунд,
-            # если время истечет и реезультат работы не
+            # Запущенный процесс отработает timeout секунд,
+            # если время истечет и итоговый результат не
             # будет получен, то будет выброшено исключение
-            out, error = process.communicate(timeout=timeout)
-        except subprocess.TimeoutExpired:
-            process.kill()
-            result = {'correct':False, 'error': 'Время оценки истекло за {} секунд. \n'
-                                                'Проверьте код на бесконечный цикл.'.format(timeout)}
-        else:
-            if error:
-                print_log('Тестировщик упал: {}', error.decode())
-                result = {'correct':False, 'error':error.decode()}
+            for data in process.read_output(timeout=timeout):
+                if feed_result(stream, data):
+                    # Итоговый результат получен, дожидаться завершения процесса не нужно
+                    break
             else:
-                if isinstance(out, bytes):
-                    out = out.decode('utf-8')
-                try:
-                    result = json.loads(out)
+                stream.close()
+        except (subprocess.TimeoutExpired, OutputLimitExceeded, ValueError) as err:
+            error = err
+        finally:
+            process.kill()
+            finish_run(stream, spawned)
+        result, complete = tester_result(problem_name, process, stream, timeout, error)
+        usage = log_usage(problem_name, process.usage)
 
-                except JSONDecodeError:
-                    print_log('JSONDecodeError: {}'.format(traceback.format_exc()))
-                    result = {'correct':False, 'error': 'Ошибка при оценке кода, проверьте синтаксис.'}
+        gc.collect()
 
-            # Удаляем пользовательскую программу после тестирования
-            os.remove('tmp/{}.py'.format(student_program))
+    except Exception:
+        return system_error_result(), False, None
+
+    return result, complete, usage
 
-        gc.collect()
+
+async def run_tester_async(problem_name, student_response, timeout=None):
+    """Асинхронная версия run_tester()."""
+    try:
+        spawned = time.monotonic()
+        process = await (tester_pool or _direct_pool).spawn_async(problem_name, student_response)
+        record_spawn(time.monotonic() - spawned)
+        stream = ResultStream()
+
+        timeout = timeout or problem_time_limit(problem_name)
+        error = None
+        try:
+            async with aclosing(process.read_output_async(timeout=timeout)) as output:
+                async for data in output:
+                    if feed_result(stream, data):
+                        break
+                else:
+                    stream.close()
+        except (subprocess.TimeoutExpired, OutputLimitExceeded, ValueError) as err:
+            error = err
+        finally:
+            process.kill()
+            finish_run(stream, spawned)
+        result, complete = tester_result(problem_name, process, stream, timeout, error)
+        usage = log_usage(problem_name, process.usage)
 
     except Exception:
-        result = {'correct':False, 'error': 'Произошла системная ошибка'}          
+        return system_error_result(), False, None
 
-    # Формируем ответ XQueue с результатами проверки
-    result = create_response(result, hide_answer)
+    return result, complete, usage
+
+
+def feed_result(stream, data):
+    """Передает часть вывода тестировщика в stream. Возвращает True, если получен итоговый результат."""
+    with timing.stage('result'):
+        return stream.feed(data)
 
-    return result
+
+def tester_result(problem_name, process, stream, timeout, error=None):
+    """
+    Результат завершенного тестирования для run_tester() и run_tester_async().
+
+    Аргументы:
+        process: тестировщик, запущенный пулом
+        stream (ResultStream): записи, полученные из stdout тестировщика
+        timeout (float): время, отведенное на оценку, в секундах
+        error (Exception): исключение, прервавшее чтение вывода тестировщика, или None
+
+    Возвращает:
+        (result, complete) как run_tester()
+    """
+    if isinstance(error, subprocess.TimeoutExpired):
+        metrics.TIMEOUTS.inc(problem=metric_problem(problem_name))
+        return stream.partial(timeout_result(timeout)), False
+    if isinstance(error, OutputLimitExceeded):
+        return stream.partial({'correct':False, 'error': 'Слишком большой вывод: {}'.format(error)}), True
+    if isinstance(error, ValueError):
+        print_log('JSONDecodeError: {}'.format(''.join(traceback.format_exception(error))))
+        return corrupt_result(), True
+    if process.lost and stream.summary is None:
+        # Без кода возврата нельзя отличить превышение ограничений от сбоя пула
+        print_log('Процесс-шаблон тестировщика завершился во время тестирования')
+        return system_error_result(), False
+    if stream.summary is None:
+        metrics.CRASHES.inc(problem=metric_problem(problem_name))
+    return parse_tester_output(stream, process.stderr, process.returncode), True
+
+
+def problem_time_limit(problem_name):
+    """Время в секундах на оценку решения задания: назначенное калибровкой или TESTER_TIMEOUT."""
+    if calibrator is not None:
+        limit = calibrator.time_limit(problem_name)
+        if limit is not None:
+            return limit
+    return TESTER_TIMEOUT
+
+
+def run_reference(problem_name, code, timeout):
+    """
+    Оценивает эталонное решение задания для калибровки, заняв слот планировщика.
+
+    Возвращает:
+        (correct, complete, seconds): пройдены ли все тесты, завершилось ли
+        тестирование и время работы тестировщика, без ожидания слота
+    """
+    while True:
+        try:
+            if scheduler is None:
+                started = time.monotonic()
+                result, complete, _ = run_tester(problem_name, code, timeout)
+                seconds = time.monotonic() - started
+            else:
+                with scheduler.slot(problem_name, BULK):
+                    started = time.monotonic()
+                    result, complete, _ = run_tester(problem_name, code, timeout)
+                    seconds = time.monotonic() - started
+            break
+        except QueueFull as err:
+            time.sleep(err.retry_after)
+    return create_response(result, True)['correct'], complete, seconds
+
+
+def timeout_result(timeout):
+    """Результат тестирования, которое не уложилось в timeout секунд."""
+    return {'correct':False, 'error': 'Время оценки истекло за {} секунд. \n'
+                                      'Проверьте код на бесконечный цикл.'.format(timeout)}
+
+
+def system_error_result():
+    """Результат тестирования, которое не удалось выполнить из-за ошибки грейдера."""
+    return {'correct':False, 'error': 'Произошла системная ошибка'}
+
+
+def corrupt_result():
+    """Результат тестирования, вывод тестировщика которого не удалось разобрать."""
+    return {'correct':False, 'error': 'Ошибка при оценке кода, проверьте синтаксис.'}
+
+
+def record_spawn(seconds):
+    """Учитывает время запуска тестировщика в метриках и во времени этапов запроса."""
+    metrics.SPAWN_SECONDS.observe(seconds)
+    timing.add('spawn', seconds)
+
+
+def finish_run(stream, spawned):
+    """Добавляет ко времени этапов запроса время работы тестировщика и его этапов."""
+    timing.add('tester', time.monotonic() - spawned)
+    for name, seconds in stream.timings.items():
+        timing.add(name, seconds)
+
+
+def log_usage(problem_name, usage):
+    """Записывает в лог ресурсы, использованные тестировщиком, и возвращает их."""
+    if usage is not None:
+        print_log('Задание {}: время {:.3f} сек., процессор {} сек., память {} КБ'.format(
+            problem_name, usage['wall_time'],
+            'н/д' if usage['cpu_time'] is None else '{:.3f}'.format(usage['cpu_time']),
+            'н/д' if usage['max_rss'] is None else usage['max_rss']))
+    return usage
+
+
+def parse_tester_output(stream, error, returncode=None):
+    """
+    Возвращает результаты тестов по выводу завершившегося тестировщика.
+
+    Аргументы:
+        stream (ResultStream): записи, полученные из stdout тестировщика
+        error (bytes): stderr тестировщика
+        returncode (int): код возврата тестировщика
+    """
+    if stream.summary is not None:
+        return stream.summary
+
+    if not error and returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        # Процесс завершен ядром при превышении ограничений ресурсов
+        return stream.partial({'correct':False,
+                               'error': 'Тестирование прервано: превышено ограничение '
+                                        'процессорного времени или памяти.'})
+
+    if error:
+        # Тестировщик упал, не закончив тестирование
+        print_log('Тестировщик упал: {}'.format(error.decode()))
+        return stream.partial({'correct':False, 'error':error.decode()})
+
+    print_log('Тестировщик завершился, не вернув итоговый результат')
+    return stream.partial(corrupt_result())
 
 def create_response(result, hide_answer):
     """ 
     Получает список результатов тестов и создает ответ для XQueue.
-    Результты тестирования форматируются HTML кодом.
+    Результты тестирования форматируются HTML кодом (см. report.py).
 
     Аргументы:
         result (list): Список тестов, каждый тест представлен словарем.
@@ -171,63 +696,6 @@ def create_response(result, hide_answer):
                     msg (str): отформатированные в HTML код результаты тестов
     """
 
-    start = """
-            <div class="test">
-                <header>Test results</header>
-                <section>
-                    <div class="shortform">
-                    {}
-                    <a href="#" class="full full-top">See full test results</a>
-                    </div>
-            <div class="longform" style="display: none;">
-            """
-
-    end = """</div></section></div>"""
-
-    correct =  """
-                <div class="result-output result-correct">
-                    <h4>{header}</h4>
-                    <pre>{function}</pre>
-                    <dl>
-                        <dt>Output:</dt>
-                        <dd class="result-actual-output"><pre>{result}</pre></dd>
-                    </dl>
-                </div>
-                """
-    
-    correct_hidden =  """
-                <div class="result-output result-correct">
-                    <h4>{header}</h4>
-                </div>
-                """
-    wrong = """
-            <div class="result-output result-incorrect">
-                    <h4>{header}</h4>
-                    <pre>{function}</pre>
-                    <dl>
-                        <dt>Your output:</dt>
-                        <dd class="result-actual-output"><pre>{result}</pre></dd>
-                        <dt>Correct output:</dt>
-                        <dd><pre>{expected}</pre></dd>
-                    </dl>
-            </div>
-            """
-    wrong_hidden = """
-            <div class="result-output result-incorrect">
-                    <h4>{header}</h4>
-            </div>
-            """
-
-    fatal = """
-            <div class="result-output result-incorrect">
-                <h4>Error</h4>
-                <dl>
-                <dt>Message:</dt>
-                <dd class="result-actual-output"><pre>{error}</pre></dd>
-                </dl>
-            </div>
-            """
-
     out = {}
 
     # Объединяем одиночный результат теста в список
@@ -247,38 +715,7 @@ def create_response(result, hide_answer):
     out['score'] = number_passed / len(result)
 
     # Результаты тестов в HTML формате
-    # start содержит заголовок с общим сообщением и кнопками открытия подробных результатов
-    if any(('error' in res) for res in result):
-        html_message = start.format('ERROR')
-    elif out['correct']:
-        html_message = start.format('CORRECT')
-    else:
-        html_message = start.format('INCORRECT')
-
-    # Средняя часть сообщения
-    for i, res in enumerate(result):
-        # Здесь объявляются состояния по умолчанию для всех составляющих
-        answer = {'correct': False, 'function': '', 'result': '', 'expected': ''}
-        answer.update(res)
-
-        if 'error' in res:
-            html_message += fatal.format(**answer)
-        else:
-            name = 'Test Case {}'.format(i+1)
-            if hide_answer:
-                if res['correct']:
-                    html_message += correct_hidden.format(header=name)
-                else:
-                    html_message += wrong_hidden.format(header=name)
-            else:
-                if res['correct']:
-                    html_message += correct.format(header=name, **answer)
-                else:
-                    html_message += wrong.format(header=name, **answer)
-
-    # end закрывает все открытые HTML тэги
-    html_message += end
-    out['msg'] = html_message
+    out['msg'] = report.render(result, hide_answer)
 
     return out
 
@@ -303,10 +740,101 @@ def get_info(json_object):
     hide_answer = grader_payload['hide_answer']
     return problem_name, hide_answer, student_response, student_id
 
-def start(host='localhost', port=1710):
+def parse_request(post_body):
+    """
+    Разбирает тело POST запроса от XQueue.
+
+    Возвращает:
+        problem_name (str), hide_answer (bool), student_response (str), student_id (str)
+    Выбрасывает:
+        JSONDecodeError: если тело запроса не является JSON
+    """
+    body_content = json.loads(post_body)
+    problem_name, hide_answer, student_response, user_id = get_info(body_content)
+    hide_answer = hide_answer == "True"
+    return problem_name, hide_answer, student_response, user_id
+
+
+def setup(pool_size=None, pool_max_jobs=100, pool_isolation=ISOLATION_FORK,
+          slots=None, max_queue=None, cache_size=10000, cache_path=None, limits=None,
+          calibrate=True, store_path=None):
+    """
+    Подготавливает грейдер к работе: устанавливает рабочую директорию,
+    загружает задания, запускает пул тестировщиков и планировщик.
+    Аргументы описаны в start(). Если calibrate равен False, задания
+    получают только сохраненные результаты калибровки, а фоновая
+    калибровка не запускается.
+    """
+    global tester_pool, scheduler, result_cache, coalescer, registry, calibrator, submission_store
+
     # Установка рабочей директории
     os.chdir(os.path.abspath(os.path.dirname(sys.argv[0])))
 
+    # Записи лога пишутся в формате JSON lines фоновым потоком
+    start_logging()
+
+    # Загрузка и проверка заданий. При изменении файла задания процессы-шаблоны
+    # перезапускаются, чтобы загрузить его новую версию
+    registry = ProblemRegistry(on_change=lambda name: tester_pool.recycle())
+    registry.scan()
+
+    # Запуск пула тестировщиков
+    tester_pool = TesterPool(pool_size, pool_max_jobs, pool_isolation, limits)
+    tester_pool.start()
+    scheduler = GradingScheduler(slots or tester_pool.size, max_queue)
+    if cache_size:
+        result_cache = ResultCache(cache_size, cache_path)
+    coalescer = Coalescer()
+
+    # Кэш результатов заполняется ответами на решения, сохраненные до перезапуска
+    if store_path:
+        submission_store = SubmissionStore(store_path)
+        if result_cache is not None:
+            print_log('Кэш результатов заполнен из хранилища решений: {}'.format(
+                submission_store.warm_cache(result_cache)))
+
+    # Задания без актуальной калибровки калибруются в фоне, пока грейдер принимает решения
+    calibrator = calibration.Calibrator(registry, run_reference)
+
+    # Очереди планировщика и порядок в них сразу учитывают время оценки заданий
+    # до перезапуска: время эталонного решения, а если есть - реальных решений
+    history = {name: saved.reference_time for name, saved in calibrator.saved().items()}
+    if submission_store is not None:
+        history.update(submission_store.service_times())
+    scheduler.seed(history)
+
+    if calibrate:
+        calibrator.start()
+
+
+def start(host='localhost', port=1710, pool_size=None, pool_max_jobs=100,
+          pool_isolation=ISOLATION_FORK, slots=None, max_queue=None,
+          cache_size=10000, cache_path=None, limits=None, store_path=None):
+    """
+    Запускает грейдер.
+
+    Аргументы:
+        host (str), port (int): адрес, на котором грейдер принимает запросы XQueue
+        pool_size (int): количество процессов-шаблонов тестировщика,
+                         по умолчанию равно числу ядер
+        pool_max_jobs (int): количество тестирований, после которого
+                             процесс-шаблон перезапускается
+        pool_isolation (str): режим изоляции решений, см. pool.TesterPool
+        slots (int): количество одновременно оцениваемых решений,
+                     по умолчанию равно размеру пула
+        max_queue (int): длина очереди ожидания, при заполнении которой
+                         грейдер отвечает XQueue кодом 503
+        cache_size (int): количество ответов в кэше в памяти, 0 отключает кэш
+        cache_path (str): файл SQLite для кэша на диске, по умолчанию кэш
+                          хранится только в памяти
+        limits (ResourceLimits): ограничения ресурсов для каждого решения,
+                                 по умолчанию limits.ResourceLimits()
+        store_path (str): файл SQLite для хранилища оцененных решений (см. store.py),
+                          по умолчанию решения не сохраняются
+    """
+    setup(pool_size, pool_max_jobs, pool_isolation, slots, max_queue, cache_size, cache_path,
+          limits, store_path=store_path)
+
     # Запуск грейдера
     try:
         server = ThreadedHTTPServer((host, port), Handler)
@@ -317,6 +845,12 @@ def start(host='localhost', port=1710):
     except KeyboardInterrupt:
         # Завершение работы грейдера при нажатии Ctrl+C
         print('\nGrader was stopped with Ctrl+C')
+    finally:
+        calibrator.stop()
+        tester_pool.close()
+        if submission_store is not None:
+            submission_store.close()
+        stop_logging()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+"""
+Запуск грейдера в отдельном процессе.
+
+Используется нагрузочным тестом (benchmark.py) и диспетчером (dispatcher.py
+--local), чтобы запускать грейдеры одинаково: grader.start() или
+async_server.start() в новом интерпретаторе с аргументами в JSON. Грейдер
+считается запущенным, когда он отвечает на /healthz.
+"""
+
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# Сколько секунд ждать, пока запущенный грейдер начнет отвечать на /healthz
+STARTUP_TIMEOUT = 30
+
+
+class GraderServer:
+    """
+    Грейдер, запущенный в отдельном процессе.
+
+    Аргументы:
+        mode (str): 'sync' для grader.start() или 'async' для async_server.start()
+        port (int): порт грейдера
+        options (dict): дополнительные аргументы функции start()
+        log_path (str): файл для вывода грейдера, по умолчанию вывод отбрасывается
+    """
+    def __init__(self, mode, port, options=None, log_path=None):
+        self.mode = mode
+        self.port = port
+        self.options = options or {}
+        self.log_path = log_path
+        self.process = None
+
+    def start(self):
+        module = 'grader' if self.mode == 'sync' else 'async_server'
+        options = dict(self.options, host='localhost', port=self.port)
+        code = 'import json, sys, {0}; {0}.start(**json.loads(sys.argv[1]))'.format(module)
+        log = open(self.log_path or os.devnull, 'wb')
+        with log:
+            self.process = subprocess.Popen([sys.executable, '-c', code, json.dumps(options)],
+                                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                                            stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('Грейдер завершился при запуске с кодом {}'.format(
+                    self.process.returncode))
+            try:
+                status, _ = request('localhost', self.port, 'GET', '/healthz')
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError('Грейдер не запустился за {} сек.'.format(STARTUP_TIMEOUT))
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        # grader.start() и async_server.start() останавливаются по Ctrl+C
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def request(host, port, method, path, body=None, timeout=60):
+    """Отправляет один запрос в новом соединении и возвращает (status, body)."""
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
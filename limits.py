@@ -0,0 +1,105 @@
+"""
+Ограничения ресурсов для процессов тестировщика и учет использованных ресурсов.
+
+Ограничения устанавливаются в дочернем процессе перед запуском кода
+пользователя при помощи setrlimit(), поэтому решение, которое выделяет
+гигабайты памяти или запускает процессы в цикле, завершается с ошибкой,
+а не мешает работе остальных тестировщиков и всего сервера.
+
+Объем вывода тестировщика ограничивается грейдером при чтении stdout.
+"""
+
+import json
+import os
+import resource
+
+# Переменная окружения, через которую ограничения передаются
+# тестировщику, запущенному как отдельный процесс python3 tester.py
+ENV_VARIABLE = 'TESTER_LIMITS'
+
+# Ограничения setrlimit(), соответствующие атрибутам ResourceLimits
+_RLIMITS = {'address_space': resource.RLIMIT_AS,
+            'cpu_time': resource.RLIMIT_CPU,
+            'open_files': resource.RLIMIT_NOFILE,
+            'processes': resource.RLIMIT_NPROC}
+
+
+class OutputLimitExceeded(Exception):
+    """Выбрасывается, когда тестировщик вывел больше байт, чем разрешено."""
+    def __init__(self, limit):
+        super().__init__('Вывод тестировщика превысил {} байт'.format(limit))
+        self.limit = limit
+
+
+class ResourceLimits:
+    """
+    Ограничения ресурсов для одного пользовательского решения.
+    None означает отсутствие ограничения.
+
+    Аргументы:
+        address_space (int): размер адресного пространства процесса в байтах.
+        cpu_time (int): процессорное время в секундах.
+        open_files (int): количество открытых файлов.
+        processes (int): количество процессов. Ограничение RLIMIT_NPROC
+                         считает все процессы пользователя, от имени которого
+                         запущен грейдер, поэтому его стоит включать, только если
+                         грейдер работает от имени отдельного пользователя.
+        output_bytes (int): объем stdout тестировщика в байтах.
+    """
+    def __init__(self, address_space=1024 * 1024 * 1024, cpu_time=10, open_files=64,
+                 processes=None, output_bytes=1024 * 1024):
+        self.address_space = address_space
+        self.cpu_time = cpu_time
+        self.open_files = open_files
+        self.processes = processes
+        self.output_bytes = output_bytes
+
+    def as_dict(self):
+        return {'address_space': self.address_space,
+                'cpu_time': self.cpu_time,
+                'open_files': self.open_files,
+                'processes': self.processes,
+                'output_bytes': self.output_bytes}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    def environ(self):
+        """Окружение для запуска python3 tester.py с этими ограничениями."""
+        env = dict(os.environ)
+        env[ENV_VARIABLE] = json.dumps(self.as_dict())
+        return env
+
+    @classmethod
+    def from_env(cls):
+        """Ограничения, переданные тестировщику грейдером, или None."""
+        values = os.environ.get(ENV_VARIABLE)
+        if values is None:
+            return None
+        return cls.from_dict(json.loads(values))
+
+    def apply(self):
+        """Устанавливает ограничения для текущего процесса и всех его будущих дочерних процессов."""
+        for name, rlimit in _RLIMITS.items():
+            value = getattr(self, name)
+            if value is None:
+                continue
+            soft, hard = resource.getrlimit(rlimit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            if rlimit == resource.RLIMIT_CPU:
+                # После мягкого ограничения процесс получает SIGXCPU, а через секунду SIGKILL
+                hard = value + 1 if hard == resource.RLIM_INFINITY else min(value + 1, hard)
+            else:
+                hard = value
+            try:
+                resource.setrlimit(rlimit, (value, hard))
+            except (ValueError, OSError):
+                pass
+
+
+def rusage_dict(rusage):
+    """Использованные ресурсы из результата os.wait4()."""
+    return {'cpu_time': rusage.ru_utime + rusage.ru_stime,
+            'max_rss': rusage.ru_maxrss}
@@ -0,0 +1,245 @@
+"""
+Локальная замена XQueue для проверки грейдера в режиме опроса очереди.
+
+Хранит очереди решений в памяти и отвечает на те же запросы API внешних
+грейдеров, что и XQueue (см. xqueue_client.py). Дополнительно принимает
+решения и отдает результаты:
+    POST /xqueue/submit/?queue_name=<очередь>  решения в формате batch.py, по одному в строке
+    GET  /xqueue/results/                      полученные результаты
+
+Запуск:
+    python3 local_xqueue.py --port 18040 --load submissions.jsonl
+"""
+
+import argparse
+import json
+import secrets
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+from util import print_log
+
+# Название очереди, если оно не указано
+DEFAULT_QUEUE = 'python'
+
+
+class LocalQueue:
+    """
+    Очереди решений и полученные результаты.
+
+    Аргументы:
+        username, password (str): учетные данные, которые должен указать грейдер.
+                                  Если username не задан, вход разрешен всем.
+    """
+    def __init__(self, username=None, password=None):
+        self.username = username
+        self.password = password
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._pending = {}
+        self._sessions = set()
+        self._next_id = 1
+        self.results = []
+
+    def login(self, username, password):
+        """Возвращает идентификатор сессии или None, если учетные данные неверны."""
+        if self.username is not None and (username, password) != (self.username, self.password):
+            return None
+        session = secrets.token_hex(16)
+        with self._lock:
+            self._sessions.add(session)
+        return session
+
+    def authorized(self, session):
+        with self._lock:
+            return session in self._sessions
+
+    def submit(self, queue_name, xqueue_body):
+        """Добавляет решение с телом xqueue_body в очередь и возвращает его номер."""
+        with self._lock:
+            submission_id = self._next_id
+            self._next_id += 1
+            header = json.dumps({'submission_id': submission_id,
+                                 'submission_key': secrets.token_hex(8),
+                                 'lms_callback_url': 'local'})
+            self._queues.setdefault(queue_name, deque()).append(
+                {'xqueue_header': header, 'xqueue_body': xqueue_body, 'xqueue_files': '{}'})
+        return submission_id
+
+    def length(self, queue_name):
+        with self._lock:
+            return len(self._queues.get(queue_name, ()))
+
+    def get(self, queue_name):
+        """Выдает следующее решение очереди или None. Решение ожидает результата."""
+        with self._lock:
+            submissions = self._queues.get(queue_name)
+            if not submissions:
+                return None
+            submission = submissions.popleft()
+            key = json.loads(submission['xqueue_header'])['submission_key']
+            self._pending[key] = submission
+            return submission
+
+    def put(self, header, body):
+        """Принимает результат. Возвращает False для неизвестного или уже оцененного решения."""
+        try:
+            key = json.loads(header)['submission_key']
+            result = json.loads(body)
+        except (ValueError, KeyError, TypeError):
+            return False
+        with self._lock:
+            if self._pending.pop(key, None) is None:
+                return False
+            self.results.append({'xqueue_header': header, 'result': result})
+        return True
+
+    def received(self):
+        """Полученные результаты."""
+        with self._lock:
+            return list(self.results)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': {name: len(items) for name, items in self._queues.items()},
+                    'pending': len(self._pending),
+                    'results': len(self.results)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Обработчик запросов к локальной очереди."""
+    protocol_version = 'HTTP/1.1'
+    queue = None
+
+    def do_GET(self):
+        address = urlsplit(self.path)
+        query = parse_qs(address.query)
+        queue_name = query.get('queue_name', [DEFAULT_QUEUE])[0]
+        if address.path == '/xqueue/results/':
+            self._send_json(200, dict(self.queue.stats(), results=self.queue.received()))
+        elif not self._authorized():
+            self._send_json(403, {'return_code': 1, 'content': 'login_required'})
+        elif address.path == '/xqueue/get_queuelen/':
+            self._send_json(200, {'return_code': 0, 'content': self.queue.length(queue_name)})
+        elif address.path == '/xqueue/get_submission/':
+            submission = self.queue.get(queue_name)
+            if submission is None:
+                self._send_json(200, {'return_code': 1,
+                                      'content': 'Queue {} is empty'.format(queue_name)})
+            else:
+                self._send_json(200, {'return_code': 0, 'content': json.dumps(submission)})
+        else:
+            self._send_json(404, {'return_code': 1, 'content': 'not found'})
+
+    def do_POST(self):
+        address = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode()
+        if address.path == '/xqueue/login/':
+            form = parse_qs(body)
+            session = self.queue.login(form.get('username', [None])[0],
+                                       form.get('password', [None])[0])
+            if session is None:
+                self._send_json(200, {'return_code': 1, 'content': 'Incorrect login credentials'})
+            else:
+                self._send_json(200, {'return_code': 0, 'content': 'Logged in'},
+                                {'Set-Cookie': 'sessionid={}; Path=/'.format(session)})
+        elif address.path == '/xqueue/submit/':
+            queue_name = parse_qs(address.query).get('queue_name', [DEFAULT_QUEUE])[0]
+            try:
+                bodies = [xqueue_body(line) for line in body.splitlines() if line.strip()]
+            except (ValueError, KeyError, TypeError) as err:
+                self._send_json(400, {'return_code': 1, 'content': 'Invalid submission: {!r}'.format(err)})
+                return
+            ids = [self.queue.submit(queue_name, submission) for submission in bodies]
+            self._send_json(200, {'return_code': 0, 'content': ids})
+        elif not self._authorized():
+            self._send_json(403, {'return_code': 1, 'content': 'login_required'})
+        elif address.path == '/xqueue/put_result/':
+            form = parse_qs(body)
+            accepted = self.queue.put(form.get('xqueue_header', [''])[0],
+                                      form.get('xqueue_body', [''])[0])
+            if accepted:
+                self._send_json(200, {'return_code': 0, 'content': ''})
+            else:
+                self._send_json(200, {'return_code': 1, 'content': 'Submission does not exist'})
+        else:
+            self._send_json(404, {'return_code': 1, 'content': 'not found'})
+
+    def _authorized(self):
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'sessionid':
+                return self.queue.authorized(value)
+        return False
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def xqueue_body(line):
+    """
+    Строка xqueue_body для решения из строки line в формате batch.py:
+    тела запроса XQueue или решения в простом виде.
+    """
+    record = json.loads(line)
+    if 'xqueue_body' in record:
+        return record['xqueue_body']
+    return json.dumps({
+        'grader_payload': json.dumps({'problem_name': record['problem_name'],
+                                      'hide_answer': str(record.get('hide_answer', False))}),
+        'student_response': record['student_response'],
+        'student_info': json.dumps({'anonymous_student_id': record.get('user', 'unknown')}),
+    })
+
+
+def start(host='localhost', port=18040, username=None, password=None, load=None,
+          queue_name=DEFAULT_QUEUE):
+    """Запускает локальную очередь. Решения из файла load сразу добавляются в очередь queue_name."""
+    local_queue = LocalQueue(username, password)
+    if load:
+        with open(load, encoding='utf-8') as f:
+            count = sum(1 for line in f if line.strip() and
+                        local_queue.submit(queue_name, xqueue_body(line)))
+        print_log('В очередь {} добавлено решений: {}'.format(queue_name, count))
+
+    handler = type('LocalQueueHandler', (Handler,), {'queue': local_queue})
+    server = ThreadedHTTPServer((host, port), handler)
+    print('Local XQueue started on {}:{}.'.format(host, port))
+    print('Press Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nLocal XQueue was stopped with Ctrl+C')
+    finally:
+        server.server_close()
+        print_log('Результатов получено: {}'.format(len(local_queue.results)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная замена XQueue')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=18040)
+    parser.add_argument('--user', help='имя пользователя грейдера, по умолчанию вход без проверки')
+    parser.add_argument('--password')
+    parser.add_argument('--load', help='файл с решениями в формате batch.py')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE, help='очередь для решений из --load')
+    args = parser.parse_args()
+    start(args.host, args.port, args.user, args.password, args.load, args.queue)
@@ -0,0 +1,171 @@
+"""
+Метрики грейдера в текстовом формате Prometheus.
+
+Метрики объявлены на уровне модуля и обновляются грейдером при обработке
+запросов, а отдаются обоими HTTP серверами по адресу /metrics.
+"""
+
+import threading
+
+# Границы интервалов гистограмм длительности в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Все объявленные метрики в порядке объявления
+_METRICS = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._function = None
+        _METRICS.append(self)
+
+    def set_function(self, function):
+        """Значение метрики без меток будет вычисляться вызовом function() при каждом чтении."""
+        self._function = function
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('Метрика {} ожидает метки {}'.format(self.name, self.labels))
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        if self._function is not None:
+            lines.append('{} {}'.format(self.name, _format_value(self._function())))
+        else:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, key), _format_value(value))
+                for key, value in values]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        if not self.labels:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Текущее значение, которое может как расти, так и уменьшаться."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Распределение наблюдаемых значений по интервалам."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, ([*state[0]], state[1], state[2]))
+                            for key, state in self._values.items())
+        lines = []
+        for key, (counts, count, total) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labels, key, [('le', _format_value(bound))]),
+                    cumulative))
+            labels = _format_labels(self.labels, key)
+            lines.append('{}_count{} {}'.format(self.name, labels, count))
+            lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(total)))
+        return lines
+
+
+def render():
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики грейдера
+REQUESTS = Counter('grader_requests_total',
+                   'Количество решений по заданиям и результатам обработки', ('problem', 'outcome'))
+GRADING_SECONDS = Histogram('grader_grading_seconds',
+                            'Время ответа на решение вместе с ожиданием в очереди', ('problem',))
+TIMEOUTS = Counter('grader_tester_timeouts_total',
+                   'Тестирования, прерванные по TESTER_TIMEOUT', ('problem',))
+CRASHES = Counter('grader_tester_crashes_total',
+                  'Тестирования, завершившиеся без итогового результата', ('problem',))
+JSON_ERRORS = Counter('grader_json_decode_errors_total',
+                      'Запросы, тело которых не удалось разобрать')
+SPAWN_SECONDS = Histogram('grader_tester_spawn_seconds',
+                          'Время запуска процесса тестировщика',
+                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+INFLIGHT = Gauge('grader_inflight_submissions', 'Решения, оцениваемые в данный момент')
+QUEUED = Gauge('grader_queued_submissions', 'Решения, ожидающие свободного слота')
+CACHE_ENTRIES = Gauge('grader_cache_entries', 'Ответы в памяти кэша результатов')
+CACHE_MEMORY_HITS = Counter('grader_cache_memory_hits_total',
+                            'Ответы, найденные в памяти кэша результатов')
+CACHE_DISK_HITS = Counter('grader_cache_disk_hits_total',
+                          'Ответы, найденные в файле кэша результатов')
+CACHE_MISSES = Counter('grader_cache_misses_total', 'Решения, ответа на которые нет в кэше')
+COALESCED = Counter('grader_coalesced_requests_total',
+                    'Решения, получившие ответ одновременного такого же решения')
@@ -0,0 +1,685 @@
+"""
+Пул заранее запущенных процессов-шаблонов тестировщика.
+
+Каждый процесс-шаблон один раз импортирует `tester`, `testing_tools` и все
+модули из каталога problems, после чего для каждого пользовательского решения
+порождает при помощи fork() новый дочерний процесс. Решение не платит за
+запуск интерпретатора и импорт модулей, но по-прежнему выполняется в
+отдельном процессе, который завершается сразу после тестирования.
+
+Связь с процессом-шаблоном идет через unix-сокет: грейдер передает название
+задания и код решения вместе с файловыми дескрипторами каналов stdout и stderr,
+а шаблон отвечает pid порожденного процесса и, после его завершения, кодом возврата.
+"""
+
+import asyncio
+import gc
+import glob
+import importlib
+import json
+import os
+import queue
+import random
+import select
+import selectors
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+import protocol
+import testsets
+from limits import OutputLimitExceeded, ResourceLimits, rusage_dict
+from util import print_log
+
+# Каждый дочерний процесс порождается заново из процесса-шаблона
+ISOLATION_FORK = 'fork'
+# Каждый дочерний процесс запускается как новый интерпретатор (python3 tester.py),
+# код решения передается ему через stdin
+ISOLATION_PROCESS = 'process'
+
+# Пауза перед повторным запуском процесса-шаблона в секундах, удваивается после каждой неудачи
+REPLACE_RETRY_DELAY = 1
+MAX_REPLACE_RETRY_DELAY = 60
+
+# Заголовок сообщения: длина JSON-тела сообщения в байтах
+_HEADER = struct.Struct('!I')
+
+
+
+def _send_msg(sock, obj, fds=()):
+    """Отправляет в сокет сообщение в формате JSON, при необходимости вместе с дескрипторами."""
+    data = json.dumps(obj).encode()
+    data = _HEADER.pack(len(data)) + data
+    sent = 0
+    if fds:
+        sent = socket.send_fds(sock, [data], list(fds))
+    sock.sendall(data[sent:])
+
+
+def _recv_exactly(sock, size, maxfds=0):
+    """Читает из сокета ровно size байт. Возвращает (None, fds), если сокет закрыт."""
+    data = b''
+    fds = []
+    while len(data) < size:
+        if maxfds:
+            chunk, new_fds, _, _ = socket.recv_fds(sock, size - len(data), maxfds)
+            fds.extend(new_fds)
+        else:
+            chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None, fds
+        data += chunk
+    return data, fds
+
+
+def _recv_msg(sock, maxfds=0):
+    """Получает из сокета сообщение, отправленное `_send_msg`. Возвращает (obj, fds)."""
+    header, fds = _recv_exactly(sock, _HEADER.size, maxfds)
+    if header is None:
+        return None, fds
+    data, _ = _recv_exactly(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        return None, fds
+    return json.loads(data.decode()), fds
+
+
+class _TesterRun:
+    """
+    Чтение вывода запущенного тестировщика по мере его появления.
+
+    Вывод stdout отдается генератором read_output() частями, как только
+    тестировщик его записал, а stderr накапливается в атрибуте stderr.
+    Если результат уже известен, чтение можно прервать и вызвать kill().
+
+    Если задан output_limit, при выводе большего числа байт в stdout
+    выбрасывается OutputLimitExceeded, а stderr сохраняется не длиннее output_limit.
+
+    После завершения процесса атрибут usage содержит использованные ресурсы:
+    {'wall_time': (float), 'cpu_time': (float), 'max_rss': (int, КБ)}.
+    Атрибут lost равен True, если код возврата получить не удалось, например,
+    процесс-шаблон завершился во время тестирования.
+    """
+    def __init__(self, stdout, stderr, output_limit=None):
+        self.args = ['tester.py']
+        self.returncode = None
+        self.lost = False
+        self.usage = None
+        self._started = time.monotonic()
+        self._stdout = stdout
+        self._stderr = stderr
+        self._stderr_chunks = []
+        self._open = [stdout, stderr]
+        self._output_limit = output_limit
+        self._stdout_size = 0
+        self._stderr_size = 0
+
+    @property
+    def stderr(self):
+        return b''.join(self._stderr_chunks)
+
+    def read_output(self, timeout=None):
+        """
+        Генератор, возвращающий части stdout тестировщика до его завершения.
+
+        Выбрасывает subprocess.TimeoutExpired, если процесс не завершился
+        за timeout секунд.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            while self._pending():
+                remaining = self._remaining(deadline, timeout)
+                for fd in self._pending():
+                    selector.register(fd, selectors.EVENT_READ)
+                try:
+                    ready = selector.select(remaining)
+                finally:
+                    for fd in list(selector.get_map()):
+                        selector.unregister(fd)
+                for key, _ in ready:
+                    data = self._on_readable(key.fd)
+                    if data:
+                        yield data
+        self._wait_exit(self._remaining(deadline, timeout))
+
+    async def read_output_async(self, timeout=None):
+        """То же, что read_output(), но ожидание не блокирует цикл событий asyncio."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending():
+            remaining = self._remaining(deadline, timeout)
+            ready = loop.create_future()
+            fds = self._pending()
+            for fd in fds:
+                loop.add_reader(fd, _set_ready, ready, fd)
+            try:
+                fd = await asyncio.wait_for(ready, remaining)
+            except asyncio.TimeoutError:
+                raise subprocess.TimeoutExpired(self.args, timeout) from None
+            finally:
+                for pending_fd in fds:
+                    loop.remove_reader(pending_fd)
+            data = self._on_readable(fd)
+            if data:
+                yield data
+        while not self._exited():
+            self._remaining(deadline, timeout)
+            await asyncio.sleep(0.005)
+
+    def communicate(self, timeout=None):
+        """Читает stdout и stderr тестировщика до его завершения, как subprocess.Popen."""
+        out = b''.join(self.read_output(timeout))
+        return out, self.stderr
+
+    def _remaining(self, deadline, timeout):
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return remaining
+
+    def _pending(self):
+        # Дескрипторы, от которых еще ожидаются данные
+        return list(self._open)
+
+    def _on_readable(self, fd):
+        # Возвращает прочитанные данные stdout или None
+        data = os.read(fd, 65536)
+        limit = self._output_limit
+        if not data:
+            self._close_fd(fd)
+        elif fd == self._stderr:
+            if limit is None or self._stderr_size < limit:
+                self._stderr_chunks.append(data if limit is None else data[:limit - self._stderr_size])
+            self._stderr_size += len(data)
+        else:
+            self._stdout_size += len(data)
+            if limit is not None and self._stdout_size > limit:
+                raise OutputLimitExceeded(limit)
+            return data
+        return None
+
+    def _account(self, rusage=None):
+        # Запоминает ресурсы, использованные завершившимся процессом
+        self.usage = {'wall_time': time.monotonic() - self._started,
+                      'cpu_time': None,
+                      'max_rss': None}
+        if rusage is not None:
+            self.usage.update(rusage)
+
+    def _close_fd(self, fd):
+        os.close(fd)
+        self._open.remove(fd)
+
+    def _close_pipes(self):
+        for fd in list(self._open):
+            self._close_fd(fd)
+
+    def _exited(self):
+        return True
+
+    def _wait_exit(self, timeout):
+        pass
+
+
+class TesterProcess(_TesterRun):
+    """
+    Дочерний процесс тестировщика, порожденный процессом-шаблоном.
+
+    Кроме каналов вывода ожидается сообщение шаблона с кодом возврата,
+    после которого шаблон возвращается в пул.
+    """
+    def __init__(self, pool, worker, pid, stdout, stderr):
+        super().__init__(stdout, stderr, pool.limits.output_bytes)
+        self.args = ['tester.py', 'pid {}'.format(pid)]
+        self.pid = pid
+        self._pool = pool
+        self._worker = worker
+
+    def kill(self):
+        """Завершает дочерний процесс вместе со всеми порожденными им процессами."""
+        # После получения кода возврата процесс уже ожидан шаблоном, и номер его
+        # группы может принадлежать другому процессу. Оставшиеся в группе процессы
+        # шаблон завершает сам перед ожиданием (см. _wait_child())
+        if self._worker is not None:
+            _kill_group(self.pid)
+        self._close_pipes()
+        if self._worker is not None:
+            self._finish()
+
+    def _pending(self):
+        # Пока не получен код возврата, ожидаем и сообщение от процесса-шаблона
+        if self._worker is None:
+            return list(self._open)
+        return self._open + [self._worker.sock.fileno()]
+
+    def _on_readable(self, fd):
+        if fd in self._open:
+            return super()._on_readable(fd)
+        self._finish()
+        return None
+
+    def _finish(self):
+        # Получаем от процесса-шаблона код возврата и возвращаем шаблон в пул
+        worker, self._worker = self._worker, None
+        try:
+            reply, _ = _recv_msg(worker.sock)
+        except OSError:
+            reply = None
+        if reply is None:
+            self.lost = True
+            self._account()
+            self._pool._release(worker, healthy=False)
+        else:
+            self.returncode = reply['status']
+            self._account(reply.get('usage'))
+            self._pool._release(worker)
+
+
+class _PipeProcess(_TesterRun):
+    """Процесс python3 tester.py, получающий код решения через stdin."""
+    def __init__(self, problem_name, source, limits):
+        # Отдельная сессия позволяет завершить тестировщик вместе с порожденными им процессами
+        self.process = subprocess.Popen(['python3', 'tester.py', problem_name],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        env=limits.environ(),
+                                        start_new_session=True)
+        super().__init__(self.process.stdout.fileno(), self.process.stderr.fileno(),
+                         limits.output_bytes)
+        self.pid = self.process.pid
+        self._pipes = {pipe.fileno(): pipe for pipe in (self.process.stdout, self.process.stderr)}
+        try:
+            # Тестировщик сначала читает весь код из stdin, поэтому запись не блокируется надолго
+            self.process.stdin.write(source.encode())
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+    def kill(self):
+        """Завершает тестировщик вместе со всеми порожденными им процессами."""
+        # Если код возврата уже получен, группа процесса завершена в _reap()
+        if self.returncode is None:
+            _kill_group(self.pid)
+        self._close_pipes()
+        if self.returncode is None:
+            self._reap(0)
+
+    def _close_fd(self, fd):
+        # Каналы принадлежат объекту Popen и закрываются через него
+        self._pipes.pop(fd).close()
+        self._open.remove(fd)
+
+    def _exited(self):
+        return self.returncode is not None or self._reap(os.WNOHANG)
+
+    def _wait_exit(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._exited():
+            self._remaining(deadline, timeout)
+            time.sleep(0.005)
+
+    def _reap(self, options):
+        # Ожидает процесс при помощи wait4(), чтобы получить использованные им ресурсы.
+        # Сначала завершение только проверяется (WNOWAIT): пока процесс не ожидан, номер
+        # его группы не может достаться другому процессу, и оставшиеся в ней порожденные
+        # процессы завершаются. Код возврата передается объекту Popen, чтобы он не
+        # ожидал процесс повторно
+        if os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT | options) is None:
+            return False
+        _kill_group(self.pid)
+        _, status, rusage = os.wait4(self.pid, 0)
+        self.returncode = self.process.returncode = os.waitstatus_to_exitcode(status)
+        self._account(rusage_dict(rusage))
+        return True
+
+
+def _kill_group(pgid):
+    # Завершает все процессы группы, если они еще есть
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _kill_started(starting):
+    # Завершает тестировщик, запущенный для отмененного запроса
+    if not starting.cancelled() and starting.exception() is None:
+        starting.result().kill()
+
+
+def _set_ready(future, fd):
+    if not future.done():
+        future.set_result(fd)
+
+
+class _Worker:
+    """Процесс-шаблон тестировщика и сокет для связи с ним."""
+    def __init__(self, generation=0):
+        parent_sock, child_sock = socket.socketpair()
+        self.process = subprocess.Popen(['python3', 'pool.py', str(child_sock.fileno())],
+                                        pass_fds=(child_sock.fileno(),),
+                                        stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.DEVNULL)
+        child_sock.close()
+        self.sock = parent_sock
+        self.jobs = 0
+        # Шаблоны старших поколений загрузили устаревшие модули заданий
+        self.generation = generation
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        # Процесс-шаблон завершается сам, когда сокет закрывается
+        self.sock.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class TesterPool:
+    """
+    Пул процессов-шаблонов тестировщика.
+
+    Аргументы:
+        size (int): количество процессов-шаблонов, по умолчанию число ядер.
+                    Одновременно может выполняться не больше size тестирований.
+        max_jobs (int): после скольких порожденных процессов шаблон перезапускается.
+        isolation (str): ISOLATION_FORK - каждое решение выполняется в процессе,
+                         порожденном от шаблона при помощи fork();
+                         ISOLATION_PROCESS - каждое решение выполняется в новом
+                         интерпретаторе, как без пула.
+        limits (ResourceLimits): ограничения ресурсов для каждого решения,
+                                 по умолчанию ResourceLimits().
+    """
+    def __init__(self, size=None, max_jobs=100, isolation=ISOLATION_FORK, limits=None):
+        if isolation not in (ISOLATION_FORK, ISOLATION_PROCESS):
+            raise ValueError('Неизвестный режим изоляции: {}'.format(isolation))
+        if isolation == ISOLATION_FORK and not (hasattr(os, 'fork') and hasattr(socket, 'send_fds')):
+            print_log('fork() недоступен, пул тестировщиков работает в режиме {}'
+                      .format(ISOLATION_PROCESS))
+            isolation = ISOLATION_PROCESS
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.isolation = isolation
+        self.limits = limits or ResourceLimits()
+        self._idle = queue.Queue()
+        self._generation = 0
+
+    def start(self):
+        """Запускает процессы-шаблоны."""
+        if self.isolation == ISOLATION_FORK:
+            for _ in range(self.size):
+                self._idle.put(_Worker())
+        print_log('Пул тестировщиков запущен: {} x {}'.format(self.size, self.isolation))
+
+    def recycle(self):
+        """
+        Перезапускает все процессы-шаблоны, например после изменения файла задания.
+        Свободные шаблоны заменяются сразу, занятые - после завершения тестирования.
+        """
+        if self.isolation != ISOLATION_FORK:
+            return
+        self._generation += 1
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            threading.Thread(target=self._replace, args=(worker,), daemon=True).start()
+
+    def close(self):
+        """Останавливает все свободные процессы-шаблоны."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def spawn(self, problem_name, source):
+        """
+        Запускает тестировщик для кода source задания problem_name.
+
+        Возвращает объект с генератором read_output(timeout), возвращающим
+        stdout тестировщика по мере его появления, атрибутом stderr и методом kill().
+        """
+        if self.isolation == ISOLATION_PROCESS:
+            return _PipeProcess(problem_name, source, self.limits)
+
+        worker = self._idle.get()
+        pipes = self._send_job(worker, problem_name, source)
+        return self._accept_job(worker, pipes)
+
+    async def spawn_async(self, problem_name, source):
+        """
+        Асинхронная версия spawn() для сервера на asyncio.
+
+        Возвращает тот же объект, что spawn(), вывод которого читается
+        асинхронным генератором read_output_async(timeout).
+        """
+        loop = asyncio.get_running_loop()
+        if self.isolation == ISOLATION_PROCESS:
+            # Запуск интерпретатора и запись кода в stdin блокируют поток, поэтому
+            # выполняются вне цикла событий
+            starting = loop.run_in_executor(None, _PipeProcess, problem_name, source, self.limits)
+            try:
+                return await asyncio.shield(starting)
+            except asyncio.CancelledError:
+                # Запрос отменен, а тестировщик все равно будет запущен
+                starting.add_done_callback(_kill_started)
+                raise
+
+        try:
+            worker = self._idle.get_nowait()
+        except queue.Empty:
+            # Все шаблоны заняты, ждем освобождения в отдельном потоке
+            waiting = loop.run_in_executor(None, self._idle.get)
+            try:
+                worker = await asyncio.shield(waiting)
+            except asyncio.CancelledError:
+                # Поток все равно получит шаблон, его нужно вернуть в пул
+                waiting.add_done_callback(self._return_idle)
+                raise
+        pipes = self._send_job(worker, problem_name, source)
+
+        # Шаблон может еще загружаться после перезапуска, поэтому ответ
+        # с pid дочернего процесса ожидаем без блокировки цикла событий
+        ready = loop.create_future()
+        fd = worker.sock.fileno()
+        loop.add_reader(fd, _set_ready, ready, fd)
+        try:
+            await ready
+        except asyncio.CancelledError:
+            self._abandon_job(worker, pipes)
+            raise
+        finally:
+            loop.remove_reader(fd)
+        return self._accept_job(worker, pipes)
+
+    def _return_idle(self, waiting):
+        # Возвращает в пул шаблон, полученный для отмененного запроса
+        if not waiting.cancelled() and waiting.exception() is None:
+            self._idle.put(waiting.result())
+
+    def _abandon_job(self, worker, pipes):
+        # Запрос отменен, когда задание уже передано шаблону. В отдельном потоке
+        # дожидаемся pid дочернего процесса, завершаем его и возвращаем шаблон в пул
+        def abandon():
+            try:
+                process = self._accept_job(worker, pipes)
+            except RuntimeError:
+                return
+            process.kill()
+
+        threading.Thread(target=abandon, daemon=True).start()
+
+    def _send_job(self, worker, problem_name, source):
+        # Передает задание шаблону и возвращает дескрипторы для чтения stdout и stderr
+        out_read, out_write = os.pipe()
+        err_read, err_write = os.pipe()
+        try:
+            _send_msg(worker.sock, {'problem': problem_name, 'code': source,
+                                    'limits': self.limits.as_dict()},
+                      fds=(out_write, err_write))
+        except OSError:
+            pass
+        finally:
+            os.close(out_write)
+            os.close(err_write)
+        return out_read, err_read
+
+    def _accept_job(self, worker, pipes):
+        # Получает от шаблона pid порожденного процесса
+        try:
+            reply, _ = _recv_msg(worker.sock)
+        except OSError:
+            reply = None
+
+        if reply is None:
+            for fd in pipes:
+                os.close(fd)
+            self._release(worker, healthy=False)
+            raise RuntimeError('Процесс-шаблон тестировщика не отвечает')
+        return TesterProcess(self, worker, reply['pid'], *pipes)
+
+    def _release(self, worker, healthy=True):
+        worker.jobs += 1
+        if (healthy and worker.jobs < self.max_jobs and worker.alive()
+                and worker.generation == self._generation):
+            self._idle.put(worker)
+        else:
+            # Запуск нового шаблона занимает время, поэтому выполняется в фоне
+            threading.Thread(target=self._replace, args=(worker,), daemon=True).start()
+
+    def _replace(self, worker):
+        worker.close()
+        # Если шаблон не удалось запустить, пул не должен навсегда уменьшиться на один шаблон
+        delay = REPLACE_RETRY_DELAY
+        while True:
+            try:
+                self._idle.put(_Worker(self._generation))
+                return
+            except OSError as err:
+                print_log('Не удалось запустить процесс-шаблон тестировщика, повтор через '
+                          '{} сек.: {}'.format(delay, err))
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_REPLACE_RETRY_DELAY)
+
+
+def _preload():
+    """Импортирует модули, которые понадобятся каждому дочернему процессу."""
+    importlib.import_module('tester')
+    importlib.import_module('testing_tools')
+    for path in sorted(glob.glob(os.path.join('problems', '*.py'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            module = importlib.import_module('problems.{}'.format(name))
+            testsets.preload(module)
+        except Exception:
+            print_log('Не удалось загрузить задание {}: {}'.format(name, traceback.format_exc()))
+
+
+def _run_child(sock, job, fds):
+    """Выполняет тестирование в дочернем процессе. Никогда не возвращает управление."""
+    code = 1
+    try:
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        sock.close()
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for fd in fds:
+            os.close(fd)
+        ResourceLimits.from_dict(job['limits']).apply()
+        # Иначе все дочерние процессы получат одинаковые случайные тестовые значения
+        random.seed()
+
+        tester = sys.modules['tester']
+        protocol.emit({'summary': tester.main(job['problem'], job['code'])})
+        code = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _wait_child(sock, pid):
+    """
+    Ожидает завершения дочернего процесса и возвращает его статус
+    и использованные им ресурсы.
+
+    Пока дочерний процесс работает, грейдер ничего не пишет в сокет, поэтому
+    готовность сокета к чтению означает, что грейдер завершился. В этом случае
+    дочерний процесс останавливается, чтобы не остаться работать без присмотра.
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        pidfd = None
+    try:
+        while True:
+            # Процесс ожидается только после завершения его группы: пока он не ожидан,
+            # номер группы не может достаться другому процессу
+            if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+                _kill_group(pid)
+                return os.wait4(pid, 0)[1:]
+            watched = [sock] if pidfd is None else [sock, pidfd]
+            readable, _, _ = select.select(watched, [], [], 0.05 if pidfd is None else None)
+            if sock in readable:
+                _kill_group(pid)
+                return os.wait4(pid, 0)[1:]
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def _worker_main(fd):
+    """Основной цикл процесса-шаблона."""
+    # Остановкой шаблонов управляет грейдер, закрывая сокет
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock = socket.socket(fileno=fd)
+    _preload()
+    # Объекты шаблона не будут изменяться, поэтому исключаем их из сборки мусора,
+    # чтобы дочерние процессы не копировали страницы памяти при обходе сборщиком
+    gc.freeze()
+
+    while True:
+        job, fds = _recv_msg(sock, maxfds=2)
+        if job is None:
+            break
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            _run_child(sock, job, fds)
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass
+        for child_fd in fds:
+            os.close(child_fd)
+        try:
+            _send_msg(sock, {'pid': pid})
+            status, rusage = _wait_child(sock, pid)
+            _send_msg(sock, {'status': os.waitstatus_to_exitcode(status),
+                             'usage': rusage_dict(rusage)})
+        except OSError:
+            # Грейдер завершился, не дождавшись результата
+            break
+
+
+if __name__ == '__main__':
+    _worker_main(int(sys.argv[1]))
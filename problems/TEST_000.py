@@ -1,22 +1,39 @@
-import random
 import testing_tools as tt
+import testsets
 
 
-def check_inout(code):
-    # Объявляем корректное решение
-    def solution(user_in):
-        total_sec = int(user_in)
-        hours = total_sec // 3600
-        minutes = (total_sec // 60) % 60
-        seconds = total_sec % 60
-        return '{}:{}:{}'.format(hours, minutes, seconds)
-
-    # Создаем тестовые значения
+# Объявляем корректное решение
+def solution(user_in):
+    total_sec = int(user_in)
+    hours = total_sec // 3600
+    minutes = (total_sec // 60) % 60
+    seconds = total_sec % 60
+    return '{}:{}:{}'.format(hours, minutes, seconds)
+
+
+# Создаем тестовые значения: 2 заранее заданных и 8 сгенерированных
+def generate(rng):
     test_values = ['0', '1']
     while len(test_values) < 10:
-        new = str(random.randint(0, 86000))
+        new = str(rng.randint(0, 86000))
         if new not in test_values:
             test_values.append(new)
+    return test_values
+
+
+# Эталонное решение, по времени оценки которого назначается ограничение времени
+REFERENCE_SOLUTION = '''
+s = int(input())
+print('{}:{}:{}'.format(s // 3600, (s // 60) % 60, s % 60))
+'''
+
+
+# Тестовые значения и правильные ответы вычисляются один раз при загрузке задания
+TESTS = testsets.TestSet(generate, solution)
+
+
+def check_inout(code):
+    tests = TESTS.load()
 
     # Сравниваем код решения пользователя с корректным решением
-    return tt.test_input_print(code=code, values=test_values, solution=solution)
+    return tt.test_input_print(code=code, values=tests.values, expected=tests.expected)
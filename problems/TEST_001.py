@@ -1,24 +1,40 @@
-import random
 import testing_tools as tt
+import testsets
 
 
-def check(code):
-    # Провеяем создал ли пользователь функцию "sum"
-    try:
-        function = code.sum
-    except AttributeError:
-        return {'correct': False, 'error': 'function ({}) is not defined.'.format('sum')}
+# Функция "solution" является корректным решением
+def solution(x, y):
+    return x + y
 
-    # Создаем функцию "solution", которая является корректным решением
-    def solution(x, y):
-        return x + y
 
-    # Используем 5 заранее заданных и 5 сгенерированных тестовых значений
+# Используем 5 заранее заданных и 5 сгенерированных тестовых значений
+def generate(rng):
     test_values = [(0, 0), (0, 1), (1, 0), (-1, 0), (0, -2)]
     while len(test_values) < 10:
-        new = (random.randint(-1000, 1001), random.randint(-1000, 1001))
+        new = (rng.randint(-1000, 1001), rng.randint(-1000, 1001))
         if new not in test_values:
             test_values.append(new)
+    return test_values
+
+
+# Эталонное решение, по времени оценки которого назначается ограничение времени
+REFERENCE_SOLUTION = '''
+def sum(x, y):
+    return x + y
+'''
+
+
+# Тестовые значения и правильные ответы вычисляются один раз при загрузке задания
+TESTS = testsets.TestSet(generate, solution, unpack=True)
+
+
+def check(code):
+    # Провеяем создал ли пользователь функцию "sum"
+    try:
+        function = code.sum
+    except AttributeError:
+        return {'correct': False, 'error': 'function ({}) is not defined.'.format('sum')}
 
     # Сравниваем пользовательский код и корректное решение
-    return tt.test_function(function=function, values=test_values, solution=solution)
+    tests = TESTS.load()
+    return tt.test_function(function=function, values=tests.values, expected=tests.expected)
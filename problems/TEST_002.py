@@ -1,5 +1,8 @@
 import testing_tools as tt
 
+# Эталонное решение, по времени оценки которого назначается ограничение времени
+REFERENCE_SOLUTION = 'answer = [1, 2, 3, 4, 5]'
+
 def check(code):
     # Проверяем объявил ли пользователь переменную "answer"
     try:
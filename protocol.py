@@ -0,0 +1,111 @@
+"""
+Формат вывода тестировщика.
+
+Тестировщик пишет в stdout записи JSON, по одной на строку, по мере
+выполнения тестов, а не один результат в конце работы:
+
+{"cases": [offset, count]}       будет выполнено count тестов с номерами от offset
+{"case": index, "result": {...}} результат одного теста
+{"timings": {stage: seconds}}    время этапов работы тестировщика (см. timing.py)
+{"summary": result}              итоговый результат, как его вернул check()
+
+Грейдер читает записи по мере появления и может вернуть пользователю
+результаты уже выполненных тестов, даже если тестирование не уложилось
+во время или тестировщик упал. Итоговый результат всегда имеет приоритет
+над отдельными записями, так как функция check() задания может изменить
+или объединить результаты тестов.
+"""
+
+import json
+import sys
+
+# Описание теста, который не успел выполниться до прерывания тестирования
+NOT_RUN = 'Test Case {} не выполнен: тестирование было прервано'
+
+
+def encode(record):
+    """Возвращает запись в виде строки JSON без перевода строки."""
+    # Результаты пользовательских функций могут не сериализоваться в JSON
+    return json.dumps(record, default=repr)
+
+
+def emit(record):
+    """Пишет запись в настоящий stdout тестировщика и сразу отправляет ее грейдеру."""
+    stream = sys.__stdout__
+    stream.write(encode(record) + '\n')
+    stream.flush()
+
+
+class ResultStream:
+    """
+    Собирает записи тестировщика из частей его stdout.
+
+    Атрибуты:
+        summary: итоговый результат или None, если он еще не получен.
+        cases (dict): номер теста -> результат уже выполненных тестов.
+        planned (int): количество объявленных тестов.
+        timings (dict): этап -> время работы тестировщика на этом этапе в секундах.
+    """
+    def __init__(self):
+        self.summary = None
+        self.cases = {}
+        self.planned = 0
+        self.timings = {}
+        self._buffer = b''
+
+    def feed(self, data):
+        """
+        Добавляет очередную часть stdout.
+
+        Возвращает True, если получен итоговый результат.
+        """
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                self._record(json.loads(line.decode('utf-8')))
+        return self.summary is not None
+
+    def close(self):
+        """
+        Разбирает оставшиеся данные после завершения тестировщика.
+
+        Выбрасывает JSONDecodeError, если вывод поврежден.
+        """
+        data, self._buffer = self._buffer, b''
+        if data.strip():
+            self._record(json.loads(data.decode('utf-8')))
+        return self.summary is not None
+
+    def _record(self, record):
+        if isinstance(record, dict) and 'case' in record:
+            self.cases[record['case']] = record['result']
+        elif isinstance(record, dict) and 'cases' in record:
+            offset, count = record['cases']
+            self.planned = max(self.planned, offset + count)
+        elif isinstance(record, dict) and 'timings' in record:
+            self.timings.update(record['timings'])
+        elif isinstance(record, dict) and 'summary' in record:
+            self.summary = record['summary']
+        else:
+            # Вывод тестировщика старого формата: один результат без обертки
+            self.summary = record
+
+    def partial(self, error):
+        """
+        Результаты тестов, выполненных до прерывания тестирования.
+
+        Тесты, которые были объявлены, но не выполнены, отмечаются как
+        непройденные, а в конец списка добавляется error - причина прерывания.
+        """
+        result = []
+        for i in range(max(self.planned, max(self.cases, default=-1) + 1)):
+            if i in self.cases:
+                result.append(self.cases[i])
+            else:
+                result.append({'correct': False,
+                               'function': NOT_RUN.format(i + 1),
+                               'result': '',
+                               'expected': ''})
+        result.append(error)
+        return result
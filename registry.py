@@ -0,0 +1,149 @@
+"""
+Реестр заданий из каталога problems.
+
+При запуске грейдера все модули заданий загружаются и проверяются: модуль
+должен объявлять функцию check или check_inout. Благодаря этому решение
+для несуществующего или сломанного задания отклоняется сразу, до запуска
+тестировщика, а ошибка в файле задания видна в логе при старте.
+
+Если файл задания изменился, он загружается заново при следующем запросе
+к этому заданию, без перезапуска грейдера.
+"""
+
+import glob
+import os
+import threading
+import traceback
+import types
+
+import testsets
+from util import print_log
+
+# Каталог с модулями заданий
+PROBLEMS_DIRECTORY = 'problems'
+
+
+class Problem:
+    """
+    Загруженное задание.
+
+    Атрибуты:
+        name (str): название задания
+        stamp (tuple): время изменения и размер файла при загрузке
+        module (module): модуль задания или None, если его не удалось загрузить
+        error (str): причина, по которой задание не может проверять решения, или None
+        time_limit (float): ограничение времени оценки решения, назначенное
+                            калибровкой (см. calibration.py), или None
+    """
+    def __init__(self, name, stamp, module=None, error=None):
+        self.name = name
+        self.stamp = stamp
+        self.module = module
+        self.error = error
+        self.time_limit = None
+
+    @property
+    def valid(self):
+        return self.error is None
+
+
+class ProblemRegistry:
+    """
+    Загруженные и проверенные задания.
+
+    Аргументы:
+        directory (str): каталог с модулями заданий.
+        on_change (function): вызывается с названием задания, если файл
+                              загруженного задания изменился или был удален.
+    """
+    def __init__(self, directory=PROBLEMS_DIRECTORY, on_change=None):
+        self.directory = directory
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._problems = {}
+
+    def scan(self):
+        """Загружает все задания каталога. Возвращает количество корректных заданий."""
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.py'))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name.isidentifier():
+                self.get(name)
+        with self._lock:
+            problems = list(self._problems.values())
+        broken = [problem.name for problem in problems if not problem.valid]
+        print_log('Загружено заданий: {}, с ошибками: {}{}'.format(
+            len(problems) - len(broken), len(broken),
+            ' ({})'.format(', '.join(broken)) if broken else ''))
+        return len(problems) - len(broken)
+
+    def names(self):
+        """Названия всех загруженных заданий."""
+        with self._lock:
+            return sorted(self._problems)
+
+    def get(self, name):
+        """
+        Возвращает задание name или None, если такого задания нет.
+
+        Если файл задания изменился после загрузки, задание загружается заново.
+        """
+        if not isinstance(name, str) or not name.isidentifier():
+            return None
+        path = os.path.join(self.directory, '{}.py'.format(name))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stamp = None
+        else:
+            stamp = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            problem = self._problems.get(name)
+        if problem is not None and problem.stamp == stamp:
+            return problem
+
+        if stamp is None:
+            # Файл задания удален
+            with self._lock:
+                removed = self._problems.pop(name, None)
+            if removed is not None:
+                print_log('Задание {} удалено'.format(name))
+                self._changed(name)
+            return None
+
+        loaded = self._load(name, path, stamp)
+        with self._lock:
+            self._problems[name] = loaded
+        if problem is not None:
+            print_log('Задание {} загружено заново'.format(name))
+            self._changed(name)
+        if not loaded.valid:
+            print_log('Задание {} не может проверять решения: {}'.format(name, loaded.error))
+        return loaded
+
+    def _load(self, name, path, stamp):
+        # Загружает модуль задания, не добавляя его в sys.modules
+        try:
+            with open(path, 'rb') as f:
+                code = compile(f.read(), path, 'exec')
+            module = types.ModuleType('problems.{}'.format(name))
+            module.__file__ = path
+            exec(code, module.__dict__)
+        except (Exception, SystemExit):
+            # Вызов exit() в модуле задания не должен останавливать грейдер
+            return Problem(name, stamp, error=traceback.format_exc(limit=0).strip())
+
+        if not (hasattr(module, 'check') or hasattr(module, 'check_inout')):
+            return Problem(name, stamp, module, 'не объявлена функция check или check_inout')
+
+        # Наборы тестов вычисляются один раз, до первого тестирования
+        try:
+            testsets.prepare(module)
+        except Exception:
+            return Problem(name, stamp, module, 'не удалось построить набор тестов: {}'.format(
+                traceback.format_exc(limit=0).strip()))
+        return Problem(name, stamp, module)
+
+    def _changed(self, name):
+        if self.on_change is not None:
+            self.on_change(name)
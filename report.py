@@ -0,0 +1,107 @@
+"""
+HTML отчет с результатами тестов для поля msg ответа XQueue.
+
+Шаблоны разбираются один раз при импорте модуля, а отчет собирается
+одним объединением частей. Все значения экранируются, каждое поле
+обрезается до FIELD_LIMIT байт, а весь отчет - до MESSAGE_LIMIT байт
+(размеры считаются в кодировке UTF-8 после экранирования), поэтому размер
+ответа не зависит от того, сколько напечатало решение пользователя.
+"""
+
+from html import escape
+
+# Максимальный размер одного поля теста (описание, вывод, ожидаемый вывод, ошибка) в байтах
+FIELD_LIMIT = 10000
+
+# Максимальный размер всего отчета в байтах
+MESSAGE_LIMIT = 200000
+
+_START = ('<div class="test"><header>Test results</header><section>'
+          '<div class="shortform">{}'
+          '<a href="#" class="full full-top">See full test results</a></div>'
+          '<div class="longform" style="display: none;">').format
+
+_END = '</div></section></div>'
+
+_CORRECT = ('<div class="result-output result-correct"><h4>{}</h4><pre>{}</pre>'
+            '<dl><dt>Output:</dt><dd class="result-actual-output"><pre>{}</pre></dd></dl>'
+            '</div>').format
+
+_CORRECT_HIDDEN = '<div class="result-output result-correct"><h4>{}</h4></div>'.format
+
+_WRONG = ('<div class="result-output result-incorrect"><h4>{}</h4><pre>{}</pre>'
+          '<dl><dt>Your output:</dt><dd class="result-actual-output"><pre>{}</pre></dd>'
+          '<dt>Correct output:</dt><dd><pre>{}</pre></dd></dl>'
+          '</div>').format
+
+_WRONG_HIDDEN = '<div class="result-output result-incorrect"><h4>{}</h4></div>'.format
+
+_FATAL = ('<div class="result-output result-incorrect"><h4>Error</h4>'
+          '<dl><dt>Message:</dt><dd class="result-actual-output"><pre>{}</pre></dd></dl>'
+          '</div>').format
+
+_OMITTED = ('<div class="result-output result-incorrect"><h4>Отчет сокращен</h4>'
+            '<pre>Результаты еще {} тестов не показаны</pre></div>').format
+
+
+def field(value, limit=None):
+    """
+    Текст поля теста, экранированный для HTML и обрезанный до limit байт
+    в кодировке UTF-8. Обрезка не разрывает символы и HTML-сущности.
+    """
+    limit = FIELD_LIMIT if limit is None else limit
+    text = escape(value if isinstance(value, str) else str(value), quote=False)
+    size = _size(text)
+    if size <= limit:
+        return text
+    kept = text.encode('utf-8')[:limit].decode('utf-8', 'ignore')
+    entity = kept.rfind('&')
+    if entity != -1 and ';' not in kept[entity:]:
+        kept = kept[:entity]
+    return '{}… (еще {} байт)'.format(kept, size - _size(kept))
+
+
+def _size(text):
+    # Размер текста в байтах в кодировке UTF-8. Текст из символов ASCII не кодируется
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+def render(result, hide_answer):
+    """
+    Возвращает HTML отчет по списку результатов тестов.
+
+    Аргументы:
+        result (list): непустой список словарей в формате create_response()
+        hide_answer (bool): скрывать вывод и ожидаемый результат тестов
+    """
+    if any('error' in res for res in result):
+        status = 'ERROR'
+    elif all(res['correct'] for res in result):
+        status = 'CORRECT'
+    else:
+        status = 'INCORRECT'
+
+    parts = [_START(status)]
+    size = _size(parts[0]) + _size(_END)
+    for i, res in enumerate(result):
+        if 'error' in res:
+            part = _FATAL(field(res['error']))
+        else:
+            name = 'Test Case {}'.format(i + 1)
+            if hide_answer:
+                part = _CORRECT_HIDDEN(name) if res['correct'] else _WRONG_HIDDEN(name)
+            elif res['correct']:
+                part = _CORRECT(name, field(res.get('function', '')), field(res.get('result', '')))
+            else:
+                part = _WRONG(name, field(res.get('function', '')), field(res.get('result', '')),
+                              field(res.get('expected', '')))
+
+        part_size = _size(part)
+        if size + part_size > MESSAGE_LIMIT:
+            parts.append(_OMITTED(len(result) - i))
+            break
+        parts.append(part)
+        size += part_size
+
+    parts.append(_END)
+    return ''.join(parts)
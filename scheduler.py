@@ -0,0 +1,344 @@
+"""
+Планировщик оценки решений.
+
+Ограничивает количество одновременно оцениваемых решений числом слотов,
+а остальные решения ставит в очередь ограниченной длины. Если очередь
+заполнена, решение сразу отклоняется, чтобы грейдер мог ответить XQueue
+кодом 503 и попросить повторить запрос позже, вместо того чтобы запускать
+сотни тестировщиков одновременно.
+
+Ожидающие решения разделены на очереди (LANES) по приоритету:
+    interactive - решения студентов для заданий, которые оцениваются быстро
+    heavy       - решения студентов для заданий, оценка которых в среднем
+                  дольше HEAVY_TIME секунд
+    bulk        - повторная оценка (batch.py) и калибровка заданий
+Освободившийся слот получает очередь с наибольшим приоритетом, а в ней -
+решение задания с наименьшим средним временем оценки (shortest job first).
+Среднее время оценки каждого задания планировщик вычисляет сам по уже
+оцененным решениям, а после перезапуска начинает с времени, переданного
+в seed() (грейдер берет его из калибровки и хранилища решений). Пока в очередях с большим приоритетом есть ожидающие
+решения, каждая очередь может занимать не больше своей доли слотов, поэтому
+поток медленных решений или повторная оценка не занимают все слоты. Если
+решений с большим приоритетом нет, очередь занимает и свободные слоты сверх
+своей доли, например, повторная оценка без решений студентов использует все
+слоты. Решение, ожидающее дольше STARVATION_TIME секунд, получает слот
+раньше остальных, поэтому решения из очередей с низким приоритетом тоже
+оцениваются.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+INTERACTIVE = 'interactive'
+HEAVY = 'heavy'
+BULK = 'bulk'
+
+# Очереди в порядке приоритета и доля слотов, которую может занимать каждая из них,
+# пока в очередях с большим приоритетом есть ожидающие решения
+LANES = ((INTERACTIVE, 1.0), (HEAVY, 0.5), (BULK, 0.5))
+
+# Решения задания, которое в среднем оценивается дольше HEAVY_TIME секунд, попадают в очередь heavy
+HEAVY_TIME = 1.0
+
+# Решение, ожидающее слот дольше STARVATION_TIME секунд, получает слот вне очереди
+STARVATION_TIME = 5.0
+
+# Вес нового времени оценки в скользящем среднем времени оценки задания
+SERVICE_TIME_WEIGHT = 0.2
+
+
+class QueueFull(Exception):
+    """Выбрасывается, когда очередь ожидания планировщика заполнена."""
+    def __init__(self, retry_after):
+        super().__init__('Очередь оценки заполнена, повторите через {} сек.'.format(retry_after))
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    Решение, ожидающее слот или занимающее его.
+
+    Атрибуты:
+        lane (str): очередь решения
+        problem_name (str): задание решения или None
+        wait (float): время ожидания слота в секундах
+    """
+    def __init__(self, lane, problem_name, estimate, number):
+        self.lane = lane
+        self.problem_name = problem_name
+        self.estimate = estimate
+        self.number = number
+        self.enqueued = time.monotonic()
+        self.wait = 0.0
+        self.wake = None
+        self.admitted = False
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.estimate, self.number) < (other.estimate, other.number)
+
+
+class _Lane:
+    # Ожидающие решения одной очереди: куча по среднему времени оценки
+    # и очередь в порядке поступления для защиты от голодания.
+    # Из обеих структур решения удаляются лениво
+    def __init__(self, name, cap):
+        self.name = name
+        self.cap = cap
+        self.heap = []
+        self.arrivals = deque()
+        self.queued = 0
+        self.running = 0
+
+    def push(self, ticket):
+        heapq.heappush(self.heap, ticket)
+        self.arrivals.append(ticket)
+        self.queued += 1
+
+    def oldest(self):
+        while self.arrivals and not self._waiting(self.arrivals[0]):
+            self.arrivals.popleft()
+        return self.arrivals[0] if self.arrivals else None
+
+    def shortest(self):
+        while self.heap and not self._waiting(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    @staticmethod
+    def _waiting(ticket):
+        return not (ticket.admitted or ticket.cancelled)
+
+
+class GradingScheduler:
+    """
+    Планировщик с фиксированным числом слотов, очередями с приоритетами
+    и ограниченной общей длиной очередей.
+
+    Аргументы:
+        slots (int): количество одновременно оцениваемых решений,
+                     по умолчанию равно числу ядер.
+        max_queue (int): максимальное количество решений, ожидающих слот,
+                         по умолчанию в четыре раза больше числа слотов.
+    """
+    def __init__(self, slots=None, max_queue=None):
+        self.slots = slots or os.cpu_count() or 1
+        self.max_queue = self.slots * 4 if max_queue is None else max_queue
+        self._lock = threading.Lock()
+        self._lanes = {name: _Lane(name, max(1, math.ceil(self.slots * share)))
+                       for name, share in LANES}
+        self._queued = 0
+        self._running = 0
+        self._numbers = itertools.count()
+        # Скользящее среднее времени оценки решений каждого задания
+        self._estimates = {}
+
+        # Статистика
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_service = 0.0
+        self.completed = 0
+
+    def lane(self, problem_name=None, regrade=False):
+        """Очередь для решения задания problem_name, regrade - повторная оценка."""
+        if regrade:
+            return BULK
+        if self._estimates.get(problem_name, 0.0) > HEAVY_TIME:
+            return HEAVY
+        return INTERACTIVE
+
+    def seed(self, estimates):
+        """
+        Задает начальное среднее время оценки заданий в секундах, например по
+        истории оценок до перезапуска. Уже известные средние не изменяются.
+        """
+        with self._lock:
+            for problem_name, seconds in estimates.items():
+                self._estimates.setdefault(problem_name, seconds)
+
+    def estimate(self, problem_name):
+        """Среднее время оценки решения задания в секундах или None, если оно неизвестно."""
+        with self._lock:
+            return self._estimates.get(problem_name)
+
+    def acquire(self, problem_name=None, lane=None):
+        """
+        Занимает слот, при необходимости ожидая в очереди.
+
+        Аргументы:
+            problem_name (str): задание решения, по нему выбирается очередь
+                                и порядок в ней
+            lane (str): очередь решения, по умолчанию lane(problem_name)
+
+        Возвращает:
+            ticket (Ticket): занятый слот, передается в release()
+        Выбрасывает:
+            QueueFull: если все слоты заняты и очередь заполнена.
+        """
+        event = threading.Event()
+        ticket = self._enqueue(problem_name, lane, event.set)
+        if not ticket.admitted:
+            # Слот передается ожидающему напрямую в release()
+            event.wait()
+        return self._admit(ticket)
+
+    async def acquire_async(self, problem_name=None, lane=None):
+        """То же, что acquire(), но ожидание в очереди не блокирует цикл событий asyncio."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(_set_result, future)
+
+        ticket = self._enqueue(problem_name, lane, wake)
+        if not ticket.admitted:
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Если слот уже был передан этому запросу, возвращаем его
+                with self._lock:
+                    handed = ticket.admitted
+                    if not handed:
+                        ticket.cancelled = True
+                        self._lanes[ticket.lane].queued -= 1
+                        self._queued -= 1
+                if handed:
+                    self.release(ticket)
+                raise
+        return self._admit(ticket)
+
+    def _enqueue(self, problem_name, lane, wake):
+        # Ставит решение в очередь и раздает свободные слоты. Если слот
+        # достался решению сразу, у возвращаемого билета admitted равен True
+        with self._lock:
+            lane = lane or self.lane(problem_name)
+            ticket = Ticket(lane, problem_name, self._estimates.get(problem_name, 0.0),
+                            next(self._numbers))
+            ticket.wake = wake
+            if self._queued >= self.max_queue and not self._can_start(lane):
+                self.rejected += 1
+                raise QueueFull(self._retry_after())
+            self._lanes[lane].push(ticket)
+            self._queued += 1
+            self._dispatch(ticket)
+            return ticket
+
+    def _can_start(self, lane):
+        return self._running < self.slots and self._has_room(self._lanes[lane])
+
+    def _has_room(self, lane):
+        # Доля слотов ограничивает очередь, только пока в очередях с большим
+        # приоритетом есть ожидающие решения, иначе очередь занимает свободные слоты
+        if lane.running < lane.cap:
+            return True
+        for other in self._lanes.values():
+            if other is lane:
+                return True
+            if other.queued:
+                return False
+        return True
+
+    def _dispatch(self, current=None):
+        # Вызывается под self._lock. Передает свободные слоты ожидающим решениям.
+        # Решению current слот передается без вызова wake(), оно еще не ожидает
+        while self._running < self.slots:
+            ticket = self._next()
+            if ticket is None:
+                break
+            lane = self._lanes[ticket.lane]
+            ticket.admitted = True
+            lane.queued -= 1
+            lane.running += 1
+            self._queued -= 1
+            self._running += 1
+            if ticket is not current:
+                ticket.wake()
+
+    def _next(self):
+        # Следующее решение: ожидающее дольше STARVATION_TIME, иначе самое
+        # короткое из очереди с наибольшим приоритетом, у которой есть свободные слоты
+        lanes = [lane for lane in self._lanes.values() if lane.queued and self._has_room(lane)]
+        if not lanes:
+            return None
+        now = time.monotonic()
+        starving = [ticket for ticket in (lane.oldest() for lane in lanes)
+                    if now - ticket.enqueued > STARVATION_TIME]
+        if starving:
+            return min(starving, key=lambda ticket: ticket.enqueued)
+        return lanes[0].shortest()
+
+    def _admit(self, ticket):
+        ticket.wait = time.monotonic() - ticket.enqueued
+        with self._lock:
+            self.admitted += 1
+            self.total_wait += ticket.wait
+            self.max_wait = max(self.max_wait, ticket.wait)
+        return ticket
+
+    def release(self, ticket, service_time=None):
+        """Освобождает слот решения ticket и передает свободные слоты ожидающим решениям."""
+        with self._lock:
+            if service_time is not None:
+                self.completed += 1
+                self.total_service += service_time
+                if ticket.problem_name is not None:
+                    previous = self._estimates.get(ticket.problem_name)
+                    self._estimates[ticket.problem_name] = service_time if previous is None else (
+                        previous + SERVICE_TIME_WEIGHT * (service_time - previous))
+            self._lanes[ticket.lane].running -= 1
+            self._running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, problem_name=None, lane=None):
+        """Контекстный менеджер, занимающий слот на время оценки. Возвращает время ожидания."""
+        ticket = self.acquire(problem_name, lane)
+        start = time.monotonic()
+        try:
+            yield ticket.wait
+        finally:
+            self.release(ticket, time.monotonic() - start)
+
+    @asynccontextmanager
+    async def async_slot(self, problem_name=None, lane=None):
+        """Асинхронная версия slot()."""
+        ticket = await self.acquire_async(problem_name, lane)
+        start = time.monotonic()
+        try:
+            yield ticket.wait
+        finally:
+            self.release(ticket, time.monotonic() - start)
+
+    def _retry_after(self):
+        # Оценка времени, через которое в очереди освободится место
+        average = self.total_service / self.completed if self.completed else 1.0
+        return max(1, math.ceil(average * (self._queued + 1) / self.slots))
+
+    def stats(self):
+        """Возвращает словарь со статистикой планировщика."""
+        with self._lock:
+            return {'slots': self.slots,
+                    'running': self._running,
+                    'queued': self._queued,
+                    'max_queue': self.max_queue,
+                    'admitted': self.admitted,
+                    'rejected': self.rejected,
+                    'wait_avg': self.total_wait / self.admitted if self.admitted else 0.0,
+                    'wait_max': self.max_wait,
+                    'lanes': {name: {'running': lane.running, 'queued': lane.queued,
+                                     'cap': lane.cap}
+                              for name, lane in self._lanes.items()}}
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(None)
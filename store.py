@@ -0,0 +1,311 @@
+"""
+Хранилище оцененных решений.
+
+Каждое оцененное решение дописывается в базу SQLite: задание, анонимный
+идентификатор студента, код и его хэш (cache.code_digest), версия файла
+задания на момент оценки, ответ XQueue, признак завершенного тестирования
+и время этапов обработки запроса (timing.py).
+Записи только добавляются и никогда не изменяются.
+
+Запись не задерживает ответ XQueue: решения помещаются в очередь, которую
+разбирает фоновый поток, записывая накопившиеся решения одной транзакцией.
+Если очередь заполнена, решение не сохраняется, а количество пропущенных
+решений выводится в лог.
+
+Хранилище используется для:
+    - поиска решений по студенту, заданию и хэшу кода;
+    - заполнения кэша результатов после перезапуска грейдера (warm_cache),
+      только ответами на решения, тестирование которых завершилось;
+    - повторной оценки и нагрузочного тестирования на реальных решениях:
+      решения выгружаются в формате batch.py и local_xqueue.py.
+
+Запуск:
+    python3 store.py submissions.db find --user <id> --problem TEST_001
+    python3 store.py submissions.db export --problem TEST_001 -o TEST_001.jsonl
+"""
+
+import argparse
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from cache import ProblemInfo, code_digest
+from util import print_log
+
+# Источники решений
+SOURCE_XQUEUE = 'xqueue'
+SOURCE_REGRADE = 'regrade'
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS submissions ('
+    'id INTEGER PRIMARY KEY, time REAL, problem TEXT, user TEXT, code_hash TEXT, '
+    'code TEXT, hide_answer INTEGER, version TEXT, correct INTEGER, score REAL, '
+    'response TEXT, timings TEXT, source TEXT, complete INTEGER)',
+    'CREATE INDEX IF NOT EXISTS submissions_user ON submissions (user, problem)',
+    'CREATE INDEX IF NOT EXISTS submissions_problem ON submissions (problem)',
+    'CREATE INDEX IF NOT EXISTS submissions_code ON submissions (code_hash)',
+)
+
+_COLUMNS = ('id', 'time', 'problem', 'user', 'code_hash', 'code', 'hide_answer', 'version',
+            'correct', 'score', 'response', 'timings', 'source', 'complete')
+
+
+class SubmissionStore:
+    """
+    Хранилище оцененных решений в файле SQLite.
+
+    Аргументы:
+        path (str): файл базы данных
+        max_queue (int): количество решений, ожидающих записи
+    """
+    def __init__(self, path, max_queue=10000):
+        self.path = path
+        self.problems = ProblemInfo()
+        self._queue = queue.Queue(max_queue)
+        self._stats_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+
+        # Чтение из других потоков не блокируется записью благодаря журналу WAL
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        # В базах, созданных до появления столбца complete, старые решения не используются для кэша
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(submissions)')]
+        if 'complete' not in columns:
+            self._db.execute('ALTER TABLE submissions ADD COLUMN complete INTEGER DEFAULT 0')
+        self._db.commit()
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._write_loop, name='submission-store',
+                                        daemon=True)
+        self._thread.start()
+
+    def record(self, problem_name, user, student_response, hide_answer, response, complete,
+               timings=None, source=SOURCE_XQUEUE):
+        """
+        Ставит оцененное решение в очередь на запись. Не блокирует вызывающий поток.
+
+        Аргументы:
+            problem_name (str), user (str), student_response (str), hide_answer (bool):
+                поля решения, как их возвращает grader.parse_request()
+            response (dict): ответ XQueue
+            complete (bool): завершилось ли тестирование (результат можно кэшировать)
+            timings (dict): время этапов обработки запроса в миллисекундах
+            source (str): SOURCE_XQUEUE или SOURCE_REGRADE
+        """
+        # Версия задания определяется сейчас: к моменту записи файл задания мог измениться.
+        # Хэш кода и JSON вычисляются фоновым потоком
+        version, _ = self.problems.get(problem_name)
+        item = (time.time(), problem_name, user, student_response, hide_answer, version,
+                response, complete, timings, source)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Ожидает записи всех решений, поставленных в очередь."""
+        self._queue.join()
+
+    def close(self):
+        """Дописывает оставшиеся решения и закрывает базу."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._db.close()
+        if self.dropped:
+            print_log('Решений, не сохраненных из-за переполнения очереди: {}'.format(self.dropped))
+
+    def _write_loop(self):
+        # Соединение для записи используется только этим потоком
+        db = sqlite3.connect(self.path)
+        try:
+            while True:
+                items = [self._queue.get()]
+                while len(items) < 1000:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in items
+                try:
+                    rows_to_write = [self._row(*item) for item in items if item is not None]
+                    db.executemany('INSERT INTO submissions ({}) VALUES ({})'.format(
+                        ', '.join(_COLUMNS[1:]), ', '.join('?' * (len(_COLUMNS) - 1))),
+                        rows_to_write)
+                    db.commit()
+                    with self._stats_lock:
+                        self.written += len(rows_to_write)
+                except (sqlite3.Error, OSError, TypeError, ValueError) as err:
+                    print_log('Не удалось сохранить решения ({}): {}'.format(len(items), err))
+                for _ in items:
+                    self._queue.task_done()
+                if stop:
+                    return
+        finally:
+            db.close()
+
+    def _row(self, recorded, problem_name, user, student_response, hide_answer, version,
+             response, complete, timings, source):
+        return (recorded, problem_name, user, code_digest(student_response), student_response,
+                int(bool(hide_answer)), version, int(bool(response.get('correct'))),
+                response.get('score'), json.dumps(response, ensure_ascii=False),
+                json.dumps(timings or {}), source, int(bool(complete)))
+
+    def find(self, user=None, problem_name=None, code_hash=None, correct=None, limit=100):
+        """
+        Последние решения, удовлетворяющие всем заданным условиям, от новых к старым.
+
+        Возвращает:
+            list: решения в виде словарей, response и timings разобраны из JSON
+        """
+        conditions, values = [], []
+        for column, value in (('user', user), ('problem', problem_name),
+                              ('code_hash', code_hash), ('correct', correct)):
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                values.append(int(value) if column == 'correct' else value)
+        query = 'SELECT {} FROM submissions{} ORDER BY id DESC'.format(
+            ', '.join(_COLUMNS), ' WHERE ' + ' AND '.join(conditions) if conditions else '')
+        if limit is not None:
+            query += ' LIMIT {:d}'.format(limit)
+        with self._lock:
+            rows = self._db.execute(query, values).fetchall()
+        return [_submission(row) for row in rows]
+
+    def submissions(self, problem_name=None, since=None, source=None):
+        """
+        Решения в порядке записи. При необходимости только решения задания
+        problem_name, записанные не раньше времени since, из источника source.
+        """
+        conditions, values = [], []
+        for condition, value in (('problem = ?', problem_name), ('time >= ?', since),
+                                 ('source = ?', source)):
+            if value is not None:
+                conditions.append(condition)
+                values.append(value)
+        query = 'SELECT {} FROM submissions{} ORDER BY id'.format(
+            ', '.join(_COLUMNS), ' WHERE ' + ' AND '.join(conditions) if conditions else '')
+        with self._lock:
+            rows = self._db.execute(query, values).fetchall()
+        for row in rows:
+            yield _submission(row)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM submissions').fetchone()[0]
+
+    def service_times(self, limit=1000):
+        """
+        Среднее время работы тестировщика (этапы spawn и tester) в секундах
+        по заданиям среди последних limit решений. Решения, ответ на которые
+        взят из кэша, не учитываются.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT problem, timings FROM submissions ORDER BY id DESC '
+                                    'LIMIT ?', (limit,)).fetchall()
+        totals = {}
+        for problem_name, timings in rows:
+            timings = json.loads(timings)
+            if 'tester' not in timings:
+                continue
+            total, count = totals.get(problem_name, (0.0, 0))
+            totals[problem_name] = (total + (timings['tester'] + timings.get('spawn', 0)) / 1000,
+                                    count + 1)
+        return {problem_name: total / count for problem_name, (total, count) in totals.items()}
+
+    def warm_cache(self, result_cache, limit=None):
+        """
+        Заполняет кэш результатов ответами на последние решения. Используются
+        только завершенные тестирования решений текущих версий заданий, которые
+        разрешают кэширование.
+
+        Возвращает:
+            int: количество ответов, добавленных в кэш
+        """
+        limit = result_cache.max_entries if limit is None else limit
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT problem, code, hide_answer, version, response FROM submissions '
+                'WHERE source = ? AND complete = 1 ORDER BY id DESC', (SOURCE_XQUEUE,))
+            rows = rows.fetchmany(limit * 4)
+        responses = {}
+        # Старые ответы добавляются первыми, чтобы новые дольше оставались в LRU
+        for problem_name, code, hide_answer, version, response in reversed(rows):
+            if version is None or result_cache.problems.get(problem_name)[0] != version:
+                continue
+            key = result_cache.key(problem_name, code, hide_answer)
+            if key is not None:
+                responses.pop(key, None)
+                responses[key] = response
+        for key, response in list(responses.items())[-limit:]:
+            result_cache.put(key, json.loads(response))
+        return min(len(responses), limit)
+
+
+def _submission(row):
+    submission = dict(zip(_COLUMNS, row))
+    submission['hide_answer'] = bool(submission['hide_answer'])
+    submission['correct'] = bool(submission['correct'])
+    submission['complete'] = bool(submission['complete'])
+    submission['response'] = json.loads(submission['response'])
+    submission['timings'] = json.loads(submission['timings'])
+    return submission
+
+
+def batch_line(submission):
+    """Строка для batch.py и local_xqueue.py с решением из хранилища."""
+    return json.dumps({'id': str(submission['id']), 'problem_name': submission['problem'],
+                       'student_response': submission['code'],
+                       'hide_answer': submission['hide_answer'],
+                       'user': submission['user']}, ensure_ascii=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Хранилище оцененных решений')
+    parser.add_argument('database', help='файл базы данных')
+    commands = parser.add_subparsers(dest='command', required=True)
+    find = commands.add_parser('find', help='найти решения')
+    find.add_argument('--user')
+    find.add_argument('--problem')
+    find.add_argument('--code-hash')
+    find.add_argument('--limit', type=int, default=20)
+    export = commands.add_parser('export', help='выгрузить решения в формате batch.py')
+    export.add_argument('--problem')
+    export.add_argument('--since', type=float, help='время записи, секунды с начала эпохи')
+    export.add_argument('--source', choices=(SOURCE_XQUEUE, SOURCE_REGRADE))
+    export.add_argument('-o', '--output', help='файл для решений, по умолчанию stdout')
+    args = parser.parse_args(argv)
+
+    submission_store = SubmissionStore(args.database)
+    try:
+        if args.command == 'find':
+            for submission in submission_store.find(args.user, args.problem, args.code_hash,
+                                                    limit=args.limit):
+                print(json.dumps({name: submission[name] for name in (
+                    'id', 'time', 'problem', 'user', 'code_hash', 'version', 'correct', 'score',
+                    'complete', 'source', 'timings')}, ensure_ascii=False))
+        else:
+            output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+            try:
+                for submission in submission_store.submissions(args.problem, args.since,
+                                                               args.source):
+                    output.write(batch_line(submission) + '\n')
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+    finally:
+        submission_store.close()
+
+
+if __name__ == '__main__':
+    main()
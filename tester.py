@@ -25,25 +25,40 @@ def check_inout(code):
 {'correct': (bool), 'function': (str), 'result': (str), 'expected': (str)}
 {'correct': False, 'error': (str)}
 
+Модуль задания может также объявить ограничения для тестов:
+CASE_TIME_LIMIT = 2    # ограничение времени одного теста в секундах
+FAIL_FAST = True       # прекратить тестирование после первого непройденного теста
+OUTPUT_LIMIT = 10000   # максимальный размер вывода кода пользователя в байтах (UTF-8)
+
+Код пользователя передается тестировщику через stdin (или в сообщении
+процессу-шаблону из pool.py) и загружается как модуль прямо из строки,
+без временных файлов на диске.
+
+Результаты тестов отправляются грейдеру через stdout по мере выполнения
+в формате, описанном в protocol.py.
 """
 import importlib
 import sys
-import json
 import re
+import time
 import traceback
-from io import StringIO
+import types
+
+import protocol
+import testing_tools
+from limits import ResourceLimits
 
 
 class StdToString:
-    """Перенаправляет stdout и stderr в строковые переменные."""
+    """Перенаправляет stdout и stderr в строковые переменные ограниченного размера."""
     def __enter__(self):
         """Перенаправляет stdout и stderr в строковые переменные.
         Возвращает:
-            new_stdout (StringIO): Перенаправленный stdout
-            new_stderr (StringIO): Перенаправленный stderr
+            new_stdout (OutputBuffer): Перенаправленный stdout
+            new_stderr (OutputBuffer): Перенаправленный stderr
         """
-        new_stdout = StringIO()
-        new_stderr = StringIO()
+        new_stdout = testing_tools.OutputBuffer()
+        new_stderr = testing_tools.OutputBuffer()
         sys.stdout = new_stdout
         sys.stderr = new_stderr
         return (new_stdout, new_stderr)
@@ -53,10 +68,36 @@ class StdToString:
         sys.stderr = sys.__stderr__
 
 
-def main():
+def load_usercode(source):
+    """
+    Создает модуль из кода пользователя, не сохраняя его на диск.
+
+    Аргументы:
+        source (str): код пользователя.
+
+    Возвращает:
+        module (module): модуль, в пространстве имен которого выполнен код.
+    """
+    module = types.ModuleType('usercode')
+    module.__file__ = 'Usercode'
+    exec(compile(source, 'Usercode', 'exec'), module.__dict__)
+    return module
+
+
+def main(problem, source):
+    """
+    Тестирует код пользователя решением задания problem.
+
+    Аргументы:
+        problem (str): название задания, модуль problems.<problem>
+        source (str): код пользователя
+
+    Возвращает:
+        result (list или dict): результаты тестов
+    """
     with StdToString():
         # Загрузка решения
-        problem = str(sys.argv[1])
+        started = time.monotonic()
         try:
             solution = importlib.import_module('problems.{}'.format(problem))
         except ModuleNotFoundError:
@@ -64,29 +105,32 @@ def main():
                                                  .format(problem)}
             return result
 
+        # Время этапов передается грейдеру до итогового результата
+        protocol.emit({'timings': {'import': time.monotonic() - started}})
+        started = time.monotonic()
+
+        testing_tools.configure(time_limit=getattr(solution, 'CASE_TIME_LIMIT', None),
+                                fail_fast=getattr(solution, 'FAIL_FAST', False),
+                                reporter=protocol.emit,
+                                output_limit=getattr(solution, 'OUTPUT_LIMIT',
+                                                     testing_tools.OUTPUT_LIMIT))
+
         # Этот try используется для вылавливания исключений в пользовательском коде
         # при его импорте или при его запуске при помощи grading_function(code)
         try:
-            # Импортируем пльзовтаельский код
+            # Передаем пльзовтаельский код
             # Либо как модуль либо как строку (string)
             # Строка (string) используется для перенаправления input() 
             # в пользовательскуом коде перед его оценкой
-            usercode = str(sys.argv[2]).split('.')[0]
             if hasattr(solution, 'check_inout'):
                 grading_function = solution.check_inout
-                with open(('tmp/{}.py'.format(usercode)), 'r') as f:
-                    code = f.read()
+                code = source
 
             elif hasattr(solution, 'check'):
                 grading_function = solution.check
-                try:
-                    code = importlib.import_module('tmp.{}'.format(usercode))
-                # Обрабатывает ошибки в пользовательском коде при его импорте
-                except ModuleNotFoundError:
-                    result = {'correct': False,
-                              'error': 'Ошибка при загрузке пользовательского кода. '
-                                       'Попробуйте снова.'}
-                    return result
+                # Код модуля выполняется при загрузке, поэтому он тоже ограничен по времени
+                with testing_tools.time_limit(testing_tools.CASE_TIME_LIMIT):
+                    code = load_usercode(source)
 
             else:
                 # Происходит в случае некоррктного написания файла правильного решения
@@ -103,6 +147,14 @@ def main():
             result = {'correct': False,
                       'error': 'EOFError: Добавлено больше `input()` чем требовалось'}
 
+        except testing_tools.OutputOverflow as err:
+            result = {'correct': False, 'error': 'Вывод пользовательского кода: {}'.format(err)}
+
+        except testing_tools.CaseTimeout:
+            result = {'correct': False,
+                      'error': 'Превышено ограничение времени {} сек. при загрузке кода. '
+                               'Проверьте код на бесконечный цикл.'.format(testing_tools.CASE_TIME_LIMIT)}
+
         except SyntaxError as err:
             # Возникает при синтаксических ошибках в пользовательском коде
             message = traceback.format_exc(limit=0)
@@ -112,11 +164,16 @@ def main():
         except BaseException:
             # Оставшиеся неперехваченные исключения
             result = {'correct': False, 'error': traceback.format_exc(limit=0)}
+        protocol.emit({'timings': {'check': time.monotonic() - started}})
         return result
 
 
 if __name__ == '__main__':
-    # Возвращает результат. Так как используется print() grader.py может считать
-    # его из stdout. Во время исполнения stdout и stderr были перенаправлены, поэтому
-    # это единственное, что будет в них напечатано
-    print(json.dumps(main()))
+    # Код пользователя передается через stdin, название задания - аргументом.
+    # Результаты пишутся в stdout, откуда их читает grader.py. Во время исполнения
+    # stdout и stderr были перенаправлены, поэтому кроме записей protocol.py
+    # в них ничего не будет напечатано
+    limits = ResourceLimits.from_env()
+    if limits is not None:
+        limits.apply()
+    protocol.emit({'summary': main(sys.argv[1], sys.stdin.read())})
@@ -6,13 +6,53 @@
 {'correct': (bool), 'function': (str), 'result': (str), 'expected': (str)}
 {'correct': False, 'error': (str)}
 """
+import builtins
+import io
+import numbers
+import os
+import pickle
+import selectors
+import signal
+import struct
 import sys
 import traceback
+from contextlib import contextmanager
+from functools import partial
+from itertools import zip_longest
 
 from util import print_log
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def test_function(function=None, values=None, solution=None, expected=None):
+# Ограничение времени одного теста в секундах, None - без ограничения.
+# Устанавливается тестировщиком из атрибута CASE_TIME_LIMIT модуля задания
+CASE_TIME_LIMIT = None
+
+# Прекращать тестирование после первого непройденного теста.
+# Устанавливается тестировщиком из атрибута FAIL_FAST модуля задания
+FAIL_FAST = False
+
+# Максимальный размер вывода пользовательского кода в байтах (в кодировке UTF-8).
+# Устанавливается тестировщиком из атрибута OUTPUT_LIMIT модуля задания
+OUTPUT_LIMIT = 1000000
+
+# Сколько символов вывода пользовательского кода показывается в результате теста
+RESULT_PREVIEW = 10000
+
+# Функция, которой передаются записи о ходе тестирования (см. protocol.py).
+# Устанавливается тестировщиком, None - записи не передаются
+REPORTER = None
+
+# Номер первого теста следующего вызова run_cases(). Задание может вызвать
+# несколько вспомогательных функций подряд, нумерация тестов у них общая
+_case_offset = 0
+
+
+def test_function(function=None, values=None, solution=None, expected=None, workers=1,
+                  rtol=0.0, atol=0.0, vectorized=False, groups=10, worst=3):
     """
     Сравнивает пользовательскую функцию с функцией, написанной преподователем
     или с заданным списком ожидаемых результатов вывода
@@ -27,6 +67,17 @@ def test_function(function=None, values=None, solution=None, expected=None):
                              вызове `solution(val)`
         expected (list): список ожидаемых результатов работы функции.
         show_expected (bool): флаг скрытия корректного ответа при выводе в See Full Output
+        workers (int): количество процессов, между которыми распределяются тесты.
+                       По умолчанию все тесты выполняются в текущем процессе.
+        rtol, atol (float): допустимая относительная и абсолютная погрешность
+                            при сравнении чисел (см. values_close). По умолчанию
+                            результаты должны совпадать точно.
+        vectorized (bool): пакетный режим для числовых заданий. `function(values)`
+                           и `solution(values)` вызываются один раз для всего массива
+                           значений и возвращают массив результатов той же длины,
+                           который сравнивается поэлементно. Значения разбиваются
+                           на `groups` тестов, в каждом из которых показываются
+                           `worst` наибольших расхождений.
 
     Замечание:
         Вы должны определить при вызове либо только `solution` либо только `expected`.
@@ -43,12 +94,14 @@ def test_function(function=None, values=None, solution=None, expected=None):
                   "только либо 'solution' или только либо 'expected'!"
                   "'expected' будет проигнорирован.")
 
-    result = []
-    for i, val in enumerate(values):
+    if vectorized:
+        return _test_vectorized(function, values, solution, expected, rtol, atol, groups, worst)
+
+    def run_case(i, val):
         try:
             iter(val)
         except TypeError:
-            val = list(val)
+            val = [val]
         else:
             if isinstance(val, str):
                 val = [val]
@@ -65,20 +118,168 @@ def test_function(function=None, values=None, solution=None, expected=None):
         else:
             out['expected'] = expected[i]
 
-        # Получаем пользовательское решение
+        # Получаем пользовательское решение. Вывод функции не проверяется,
+        # но ограничен по размеру отдельно для каждого теста
+        stdout, sys.stdout = sys.stdout, OutputBuffer()
         try:
             out['result'] = function(*val)
+        except OutputOverflow as err:
+            out['result'] = str(err)
+            out['correct'] = False
         except Exception as err:
             out['result'] = '{}: {}'.format(type(err).__name__, str(err))
             out['correct'] = False
         else:
-            out['correct'] = bool(out['result'] == out['expected'])
+            out['correct'] = values_close(out['result'], out['expected'], rtol, atol)
+        finally:
+            sys.stdout = stdout
 
-        result.append(out)
-    return result
+        return out
+
+    return run_cases([partial(run_case, i, val) for i, val in enumerate(values)], workers)
+
+
+def _test_vectorized(function, values, solution, expected, rtol, atol, groups, worst):
+    """
+    Пакетный режим test_function(). Пользовательская функция вызывается
+    один раз для всех значений, а результаты сводятся в groups тестов.
+    Ограничение времени вызова - CASE_TIME_LIMIT на каждый тест.
+    """
+    if numpy is None or not isinstance(values, numpy.ndarray):
+        values = list(values)
+    count = len(values)
+    groups = max(1, min(groups, count))
+    bounds = [(count * g // groups, count * (g + 1) // groups) for g in range(groups)]
+
+    if solution is not None:
+        expected = solution(values)
+
+    # Вызываем пользовательскую функцию для всего массива значений
+    error = None
+    limit = CASE_TIME_LIMIT and CASE_TIME_LIMIT * groups
+    stdout, sys.stdout = sys.stdout, OutputBuffer()
+    try:
+        with time_limit(limit):
+            result = function(values)
+    except CaseTimeout:
+        error = 'превышено ограничение времени {} сек. Проверьте код на бесконечный цикл.'.format(limit)
+    except OutputOverflow as err:
+        error = str(err)
+    except Exception as err:
+        error = '{}: {}'.format(type(err).__name__, str(err))
+    finally:
+        sys.stdout = stdout
+
+    if error is None:
+        try:
+            matches = compare_elements(result, expected, rtol, atol)
+        except ValueError as err:
+            error = str(err)
+
+    def group_case(start, stop):
+        out = {'function': '{}(values[{}:{}])'.format(function.__name__, start, stop)}
+        if error is not None:
+            out.update(correct=False, result=error, expected='{} значений'.format(stop - start))
+            return out
+        wrong = [i for i in range(start, stop) if not matches[i][0]]
+        out['correct'] = not wrong
+        out['function'] += ': совпало {} из {}'.format(stop - start - len(wrong), stop - start)
+        if not wrong:
+            out['result'] = out['expected'] = 'все значения совпали'
+            return out
+        # Наибольшие расхождения, нечисловые результаты считаются самыми далекими
+        wrong.sort(key=lambda i: -matches[i][1])
+        shown = wrong[:worst]
+        out['result'] = '\n'.join('values[{}] = {!r}: {!r}'.format(i, values[i], result[i])
+                                  for i in shown)
+        out['expected'] = '\n'.join('values[{}] = {!r}: {!r}'.format(i, values[i], expected[i])
+                                    for i in shown)
+        if len(wrong) > len(shown):
+            out['result'] += '\n... еще {} расхождений'.format(len(wrong) - len(shown))
+        return out
+
+    return run_cases([partial(group_case, start, stop) for start, stop in bounds])
+
+
+def values_close(result, expected, rtol=0.0, atol=0.0):
+    """
+    Сравнивает результат с ожидаемым. Числа считаются равными, если
+    |result - expected| <= max(rtol * max(|result|, |expected|), atol),
+    списки и кортежи сравниваются поэлементно, массивы NumPy - целиком
+    (bool(array == array) для них выбрасывает исключение).
+    """
+    if numpy is not None and (isinstance(result, numpy.ndarray) or isinstance(expected, numpy.ndarray)):
+        result, expected = numpy.asarray(result), numpy.asarray(expected)
+        if result.shape != expected.shape:
+            return False
+        if (rtol or atol) and result.dtype.kind in 'biufc' and expected.dtype.kind in 'biufc':
+            return bool(numpy.allclose(result, expected, rtol=rtol, atol=atol))
+        return bool(numpy.array_equal(result, expected))
+    if _is_number(result) and _is_number(expected):
+        if not (rtol or atol):
+            return bool(result == expected)
+        return abs(result - expected) <= max(rtol * max(abs(result), abs(expected)), atol)
+    if isinstance(result, (list, tuple)) and type(result) is type(expected):
+        return len(result) == len(expected) and all(
+            values_close(r, e, rtol, atol) for r, e in zip(result, expected))
+    try:
+        return bool(result == expected)
+    except (ValueError, TypeError):
+        return False
+
+
+def compare_elements(result, expected, rtol=0.0, atol=0.0):
+    """
+    Поэлементно сравнивает массивы результатов и возвращает список пар
+    (совпадает, расхождение). Расхождение - модуль разности для чисел
+    (наибольший по строке для многомерных массивов) и бесконечность
+    для значений, которые нельзя вычесть.
+
+    Выбрасывает:
+        ValueError: если результат не массив той же длины, что ожидаемый
+    """
+    if numpy is not None and isinstance(expected, numpy.ndarray):
+        try:
+            result = numpy.asarray(result, dtype=expected.dtype)
+        except (ValueError, TypeError):
+            raise ValueError('функция должна вернуть массив из {} значений'.format(len(expected)))
+        if result.shape != expected.shape:
+            raise ValueError('функция вернула массив формы {}, ожидалась форма {}'.format(
+                result.shape, expected.shape))
+        if expected.dtype.kind not in 'biufc':
+            equal = result == expected
+            return [(bool(numpy.all(e)), 0.0 if numpy.all(e) else float('inf')) for e in equal]
+        axes = tuple(range(1, expected.ndim))
+        close = numpy.isclose(result, expected, rtol=rtol, atol=atol)
+        difference = numpy.abs(result - expected)
+        if axes:
+            close, difference = close.all(axis=axes), difference.max(axis=axes)
+        difference = numpy.where(numpy.isnan(difference), numpy.inf, difference)
+        return list(zip(close.tolist(), difference.tolist()))
+
+    try:
+        result = list(result)
+    except TypeError:
+        raise ValueError('функция должна вернуть список из {} значений, а вернула {!r}'.format(
+            len(expected), result))
+    if len(result) != len(expected):
+        raise ValueError('функция вернула {} значений, ожидалось {}'.format(len(result), len(expected)))
+    matches = []
+    for r, e in zip(result, expected):
+        close = values_close(r, e, rtol, atol)
+        if close or not (_is_number(r) and _is_number(e)):
+            matches.append((close, 0.0 if close else float('inf')))
+        else:
+            difference = float(abs(r - e))
+            matches.append((close, difference if difference == difference else float('inf')))
+    return matches
 
 
-def test_input_print(code, values, solution=None, expected=None):
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def test_input_print(code, values, solution=None, expected=None, workers=1):
     """
     Тестирует пользовательский код с использованием `input` и `print`
 
@@ -93,6 +294,8 @@ def test_input_print(code, values, solution=None, expected=None):
                              вызове `solution(val)`
         expected (list): список ожидаемых результатов работы функции.
         show_expected (bool): флаг скрытия корректного ответа при выводе в See Full Output
+        workers (int): количество процессов, между которыми распределяются тесты.
+                       По умолчанию все тесты выполняются в текущем процессе.
 
     Замечание:
         Вы должны определить при вызове либо только `solution` либо только `expected`.
@@ -118,9 +321,15 @@ def test_input_print(code, values, solution=None, expected=None):
             # вызов `input()` в пользовательском коде вернет `str(value)`.
             return self.value
 
-    result = []
-    for i, val in enumerate(values):
-        input = Input(val)
+    # Компилируем код один раз, синтаксическая ошибка сообщается сразу для всех тестов
+    try:
+        program = compile(code, 'Usercode', 'exec')
+    except SyntaxError:
+        return {'correct': False, 'error': traceback.format_exc(limit=0)}
+
+    def run_case(i, val):
+        # Каждый тест выполняется в новом пространстве имен
+        namespace = {'__name__': '__main__', '__builtins__': builtins, 'input': Input(val)}
 
         # Создаем текстовую информацию для тестируемого случая
         out = dict()
@@ -132,22 +341,38 @@ def test_input_print(code, values, solution=None, expected=None):
         else:
             out['expected'] = expected[i]
 
-        # Получаем пользовательское решение
+        # Получаем пользовательское решение, вывод каждого теста собирается отдельно
+        output = OutputBuffer()
+        stdout, sys.stdout = sys.stdout, output
         try:
-            sys.stdout.truncate(0)
-            exec(code, locals())
-            # sys.stdout будет перенаправлен в StringIO
-            out['result'] = sys.stdout.getvalue().strip('\u0000\n')
+            exec(program, namespace)
+        except OutputOverflow as err:
+            out['error'] = 'Test Case {}: {}'.format(i + 1, err)
+            out['correct'] = False
+            return out
         except Exception:
             out['error'] = traceback.format_exc(limit=0)
             out['correct'] = False
+            return out
+        finally:
+            sys.stdout = stdout
+
+        if isinstance(out['expected'], str):
+            # Вывод сравнивается по строкам до первого отличия, не собирая его целиком,
+            # а в результат попадает только его начало
+            mismatch = compare_output(output.chunks(), out['expected'])
+            out['correct'] = mismatch is None
+            if mismatch is not None:
+                out['function'] += '\nВывод отличается от ожидаемого в строке {}'.format(mismatch)
         else:
-            out['correct'] = bool(out['result'] == out['expected'])
+            out['correct'] = bool(output.getvalue().strip('\n') == out['expected'])
+        out['result'] = output.preview(RESULT_PREVIEW)
 
-        result.append(out)
-    return result
+        return out
+
+    return run_cases([partial(run_case, i, val) for i, val in enumerate(values)], workers)
 
-def test_variable(answer, expected):
+def test_variable(answer, expected, workers=1):
     """
     Тестирует пользовательский код, в котором вычисленный пользователем ответ сохранен в переменной
 
@@ -155,6 +380,8 @@ def test_variable(answer, expected):
         answer (list): список пользовательских результатов вычислений.
         expected (list): список ожидаемых результатов работы функции.
         show_expected (bool): флаг скрытия корректного ответа при выводе в See Full Output
+        workers (int): количество процессов, между которыми распределяются тесты.
+                       По умолчанию все тесты выполняются в текущем процессе.
 
     Замечание:
         При вызове нобходимо определить `expected`.
@@ -167,8 +394,7 @@ def test_variable(answer, expected):
         print_log("При вызове `testing_tools.test_variable` нужно определить 'expected'!")
         raise ValueError("Ожидался аргумент 'expected'.")
 
-    result = []
-    for i, val in enumerate(expected):
+    def run_case(i, val):
         out = dict()
 
         # Создаем текстовую информацию для тестируемого случая
@@ -184,7 +410,397 @@ def test_variable(answer, expected):
             out['error'] = traceback.format_exc(limit=0)
             out['correct'] = False
         else:
-            out['correct'] = bool(out['result'] == out['expected'])
+            out['correct'] = values_close(out['result'], out['expected'])
+
+        return out
+
+    return run_cases([partial(run_case, i, val) for i, val in enumerate(expected)], workers)
+
+
+def configure(time_limit=None, fail_fast=False, reporter=None, output_limit=OUTPUT_LIMIT):
+    """
+    Устанавливает ограничения для всех тестов текущего задания.
+    Вызывается тестировщиком перед проверкой с атрибутами модуля задания
+    CASE_TIME_LIMIT и FAIL_FAST.
+
+    Аргументы:
+        time_limit (float): ограничение времени одного теста в секундах.
+                            None - без ограничения.
+        fail_fast (bool): прекратить тестирование после первого
+                          непройденного теста.
+        reporter (function): вызывается с записью {'cases': [offset, count]}
+                             перед выполнением тестов и с записью
+                             {'case': index, 'result': out} после каждого теста.
+        output_limit (int): максимальный размер вывода пользовательского кода
+                            в байтах. None - без ограничения.
+    """
+    global CASE_TIME_LIMIT, FAIL_FAST, REPORTER, OUTPUT_LIMIT, _case_offset
+    CASE_TIME_LIMIT = time_limit
+    FAIL_FAST = fail_fast
+    OUTPUT_LIMIT = output_limit
+    REPORTER = reporter
+    _case_offset = 0
+
+
+def run_cases(cases, workers=1):
+    """
+    Выполняет тестовые случаи и возвращает их результаты в исходном порядке.
+
+    Каждый тест ограничен по времени CASE_TIME_LIMIT секундами. Если задан
+    FAIL_FAST, то после первого непройденного теста остальные не выполняются
+    и отмечаются как непройденные.
+
+    Аргументы:
+        cases (list): список функций без аргументов, каждая из которых
+                      выполняет один тест и возвращает словарь с его результатом.
+        workers (int): количество процессов, между которыми распределяются тесты.
+                       Каждый процесс порождается при помощи fork() и получает
+                       копию пользовательского кода, поэтому тесты не влияют
+                       друг на друга через общее состояние.
+
+    Если задан REPORTER, результат каждого теста передается ему сразу после
+    выполнения теста.
+
+    Возвращает:
+        result (list): Список из результатов тестирования.
+    """
+    global _case_offset
+    offset, _case_offset = _case_offset, _case_offset + len(cases)
+    report = None
+    if REPORTER is not None:
+        REPORTER({'cases': [offset, len(cases)]})
+
+        def report(i, raised, value):
+            if not raised:
+                REPORTER({'case': offset + i, 'result': value})
+
+    workers = min(workers or 1, len(cases))
+    if workers <= 1 or not hasattr(os, 'fork'):
+        outcomes = _run_sequence(cases, range(len(cases)), report)
+    else:
+        outcomes = _run_parallel(cases, workers, report)
+
+    result = []
+    stopped = False
+    for i in range(len(cases)):
+        if stopped or i not in outcomes:
+            result.append(_skipped(i))
+            continue
+        raised, value = outcomes[i]
+        if raised:
+            # Исключение выбрасывается так же, как при выполнении без ограничений
+            raise value
+        result.append(value)
+        stopped = FAIL_FAST and not value.get('correct')
+    return result
+
+
+def _run_sequence(cases, indices, report=None):
+    """
+    Выполняет тесты с номерами indices по очереди.
+    После каждого теста вызывается report(i, raised, value), если он задан.
+
+    Возвращает:
+        outcomes (dict): номер теста -> (raised, value), где value - результат
+                         теста или выброшенное им исключение. Выполнение
+                         прекращается после исключения, а при FAIL_FAST -
+                         и после непройденного теста.
+    """
+    outcomes = {}
+    for i in indices:
+        try:
+            with time_limit(CASE_TIME_LIMIT):
+                out = cases[i]()
+        except CaseTimeout:
+            out = {'correct': False,
+                   'error': 'Test Case {}: превышено ограничение времени {} сек. '
+                            'Проверьте код на бесконечный цикл.'.format(i + 1, CASE_TIME_LIMIT)}
+        except BaseException as err:
+            outcomes[i] = (True, err)
+            if report is not None:
+                report(i, True, err)
+            break
+        outcomes[i] = (False, out)
+        if report is not None:
+            report(i, False, out)
+        if FAIL_FAST and not out.get('correct'):
+            break
+    return outcomes
+
+
+def _run_parallel(cases, workers, report=None):
+    """
+    Распределяет тесты между workers порожденными процессами. Возвращает outcomes.
+
+    Процессы передают результат каждого теста сразу после его выполнения,
+    поэтому report(i, raised, value) вызывается по мере готовности тестов.
+    """
+    # Иначе буферизованный вывод попадет в stdout каждого порожденного процесса
+    sys.__stdout__.flush()
+    sys.__stderr__.flush()
+
+    children = {}
+    for worker in range(workers):
+        indices = range(worker, len(cases), workers)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            _run_chunk(cases, indices, write_fd)
+        os.close(write_fd)
+        children[read_fd] = (pid, indices)
+
+    # Читаем результаты всех процессов одновременно, чтобы ни один
+    # из них не заблокировался на записи в заполненный канал
+    outcomes = {}
+    buffers = {fd: b'' for fd in children}
+    with selectors.DefaultSelector() as selector:
+        for fd in children:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    continue
+                buffers[key.fd] += data
+                for i, raised, value in _read_frames(buffers, key.fd):
+                    outcomes[i] = (raised, value)
+                    if report is not None:
+                        report(i, raised, value)
+
+    for fd, (pid, indices) in children.items():
+        _, status = os.waitpid(pid, 0)
+        if status:
+            # Тесты, результаты которых процесс не успел передать
+            for i in indices:
+                if i not in outcomes:
+                    outcomes[i] = (False, {'correct': False,
+                                           'error': 'Процесс, выполнявший тест, завершился аварийно'})
+    return outcomes
+
+
+def _read_frames(buffers, fd):
+    # Возвращает полностью полученные результаты тестов из buffers[fd]
+    frames = []
+    buffer = buffers[fd]
+    while len(buffer) >= 4:
+        size, = struct.unpack('!I', buffer[:4])
+        if len(buffer) < 4 + size:
+            break
+        frames.append(pickle.loads(buffer[4:4 + size]))
+        buffer = buffer[4 + size:]
+    buffers[fd] = buffer
+    return frames
+
+
+def _run_chunk(cases, indices, fd):
+    """Выполняет тесты с номерами indices в порожденном процессе и передает результаты в fd."""
+    code = 1
+    try:
+        with os.fdopen(fd, 'wb') as pipe:
+            def send(i, raised, value):
+                value = _picklable_error(value) if raised else _picklable(value)
+                frame = pickle.dumps((i, raised, value))
+                pipe.write(struct.pack('!I', len(frame)) + frame)
+                pipe.flush()
+
+            _run_sequence(cases, indices, send)
+        code = 0
+    finally:
+        os._exit(code)
+
+
+def _skipped(i):
+    # Результат теста, который не выполнялся из-за FAIL_FAST
+    return {'correct': False,
+            'function': 'Test Case {} не выполнялся, так как предыдущий тест не пройден'.format(i + 1),
+            'result': '',
+            'expected': ''}
+
+
+class OutputOverflow(BaseException):
+    """
+    Выбрасывается при записи в OutputBuffer сверх ограничения.
+    Наследуется от BaseException по той же причине, что и CaseTimeout.
+    """
+    def __init__(self, limit):
+        super().__init__('превышено ограничение размера вывода: {} байт'.format(limit))
+        self.limit = limit
+
+
+class OutputBuffer(io.TextIOBase):
+    """
+    Замена StringIO для перехвата вывода пользовательского кода.
+
+    Текст хранится частями в том виде, в котором он был записан, и не
+    может превысить limit байт в кодировке UTF-8 (если limit не задан -
+    текущее значение OUTPUT_LIMIT). Запись сверх ограничения сохраняет только
+    помещающиеся целые символы и выбрасывает OutputOverflow, поэтому
+    бесконечный цикл с print() не расходует память. len() возвращает размер
+    записанного текста в байтах.
+    """
+    def __init__(self, limit=None):
+        super().__init__()
+        self._limit = limit
+        self._chunks = []
+        self._size = 0
+
+    @property
+    def limit(self):
+        return OUTPUT_LIMIT if self._limit is None else self._limit
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError('string argument expected, got {!r}'.format(type(text).__name__))
+        limit = self.limit
+        # Текст из одних символов ASCII не кодируется: его размер в байтах равен длине
+        size = len(text) if text.isascii() else len(text.encode('utf-8', 'surrogatepass'))
+        if limit is not None and self._size + size > limit:
+            rest = limit - self._size
+            if rest > 0:
+                # Неполный последний символ отбрасывается
+                fitting = text.encode('utf-8', 'surrogatepass')[:rest].decode('utf-8', 'ignore')
+                if fitting:
+                    self._chunks.append(fitting)
+                    self._size += len(fitting.encode('utf-8', 'surrogatepass'))
+            raise OutputOverflow(limit)
+        if text:
+            self._chunks.append(text)
+            self._size += size
+        return len(text)
+
+    def chunks(self):
+        """Записанные части текста без их объединения."""
+        return list(self._chunks)
+
+    def preview(self, limit):
+        """
+        Записанный текст без переводов строк в начале и в конце, как
+        getvalue().strip('\n'), но не длиннее limit символов. Части текста
+        после первых limit символов не объединяются.
+        """
+        parts = []
+        size = 0
+        for number, chunk in enumerate(self._chunks):
+            if not parts:
+                chunk = chunk.lstrip('\n')
+                if not chunk:
+                    continue
+            parts.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                text = ''.join(parts)
+                # Переводы строк в конце текста отбрасываются и не делают его длиннее limit
+                if text[limit:].strip('\n') or any(rest.strip('\n')
+                                                   for rest in self._chunks[number + 1:]):
+                    return text[:limit] + '...'
+                return text.rstrip('\n')
+        return ''.join(parts).rstrip('\n')
+
+    def getvalue(self):
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def __len__(self):
+        return self._size
+
+
+def compare_output(chunks, expected):
+    """
+    Сравнивает текст, записанный частями chunks, с ожидаемым текстом expected
+    так же, как `''.join(chunks).strip('\n') == expected.strip('\n')`, но по строкам,
+    без объединения частей и до первой отличающейся строки.
+
+    Возвращает:
+        None, если тексты совпадают, иначе номер первой отличающейся строки.
+    """
+    lines = zip_longest(_trimmed_lines(chunks), _trimmed_lines([expected]))
+    for number, (line, expected_line) in enumerate(lines, 1):
+        if line != expected_line:
+            return number
+    return None
+
+
+def _trimmed_lines(chunks):
+    # Строки текста без пустых строк в начале и в конце, как после strip('\n')
+    started = False
+    empty = 0
+    for line in _lines(chunks):
+        if not line:
+            empty += started
+            continue
+        for _ in range(empty):
+            yield ''
+        started, empty = True, 0
+        yield line
+
+
+def _lines(chunks):
+    # Строки текста, записанного частями, без разбиения всего текста сразу
+    tail = ''
+    for chunk in chunks:
+        start = 0
+        end = chunk.find('\n')
+        while end != -1:
+            yield tail + chunk[start:end]
+            tail = ''
+            start = end + 1
+            end = chunk.find('\n', start)
+        tail += chunk[start:]
+    yield tail
+
+
+class CaseTimeout(BaseException):
+    """
+    Выбрасывается в тесте, превысившем ограничение времени.
+    Наследуется от BaseException, чтобы его не перехватил `except Exception`
+    в пользовательском коде или в самом тесте.
+    """
+
 
-        result.append(out)
-    return result
\ No newline at end of file
+def _raise_timeout(signum, frame):
+    raise CaseTimeout()
+
+
+@contextmanager
+def time_limit(seconds):
+    """Ограничивает время выполнения блока при помощи SIGALRM."""
+    if not seconds or not hasattr(signal, 'setitimer'):
+        yield
+        return
+    try:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    except ValueError:
+        # Сигналы можно обрабатывать только в главном потоке
+        yield
+        return
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _picklable(out):
+    # Результат пользовательской функции может не сериализоваться,
+    # тогда вместо него передается его строковое представление
+    try:
+        pickle.dumps(out)
+    except Exception:
+        out = {k: v if isinstance(v, (bool, str)) else repr(v) for k, v in out.items()}
+    return out
+
+
+def _picklable_error(err):
+    try:
+        pickle.loads(pickle.dumps(err))
+    except Exception:
+        err = RuntimeError('{}: {}'.format(type(err).__name__, err))
+    return err
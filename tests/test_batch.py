@@ -0,0 +1,26 @@
+"""Продолжение пакетной оценки с контрольной точки."""
+
+import json
+
+from batch import load_checkpoint
+
+
+def test_missing_checkpoint(tmp_path):
+    assert load_checkpoint(str(tmp_path / 'results.jsonl')) == set()
+
+
+def test_partial_line_is_dropped(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    complete = ''.join(json.dumps({'id': str(number), 'result': {}}) + '\n' for number in (1, 2))
+    path.write_bytes(complete.encode() + b'{"id": "3", "res')
+
+    assert load_checkpoint(str(path)) == {'1', '2'}
+    # Новые результаты дописываются с начала строки
+    assert path.read_bytes() == complete.encode()
+
+
+def test_unreadable_lines_are_skipped(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    path.write_text('{"id": "1"}\nnot json\n{"result": {}}\n{"id": "2"}\n')
+    assert load_checkpoint(str(path)) == {'1', '2'}
+    assert path.read_text().endswith('{"id": "2"}\n')
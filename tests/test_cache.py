@@ -0,0 +1,54 @@
+"""Кэш результатов: ключ зависит от версии файла задания и его политики кэширования."""
+
+import os
+
+import pytest
+
+from cache import ResultCache
+
+
+@pytest.fixture
+def problems(tmp_path, monkeypatch):
+    # Кэш ищет файлы заданий в каталоге problems текущей директории
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('problems')
+
+    def write(name, source):
+        with open(os.path.join('problems', '{}.py'.format(name)), 'w') as f:
+            f.write(source)
+    return write
+
+
+def test_problem_change_invalidates_results(problems):
+    problems('P', 'ANSWER = 1\n')
+    cache = ResultCache()
+    key = cache.key('P', 'print(1)', False)
+    cache.put(key, {'correct': True})
+    assert cache.get(cache.key('P', 'print(1)', False)) == {'correct': True}
+
+    problems('P', 'ANSWER = 22\n')
+    new_key = cache.key('P', 'print(1)', False)
+    assert new_key != key
+    assert cache.get(new_key) is None
+
+
+def test_persistent_results_keyed_by_version(problems, tmp_path):
+    problems('P', 'ANSWER = 1\n')
+    path = str(tmp_path / 'cache.db')
+    cache = ResultCache(path=path)
+    cache.put(cache.key('P', 'print(1)', False), {'correct': True})
+    cache.close()
+
+    cache = ResultCache(path=path)
+    assert cache.get(cache.key('P', 'print(1)', False)) == {'correct': True}
+    problems('P', 'ANSWER = 22\n')
+    assert cache.get(cache.key('P', 'print(1)', False)) is None
+    cache.close()
+
+
+def test_uncacheable_problem_bypasses_cache(problems):
+    problems('P', 'CACHE_RESULTS = False\n')
+    cache = ResultCache()
+    assert cache.key('P', 'print(1)', False) is None
+    assert cache.key('missing', 'print(1)', False) is None
+    assert cache.stats()['bypassed'] == 2
@@ -0,0 +1,105 @@
+"""Объединение одновременных одинаковых запросов."""
+
+import asyncio
+import os
+
+import pytest
+
+from coalesce import Coalescer
+
+
+async def _settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_followers_share_leader_result():
+    async def main():
+        coalescer = Coalescer()
+        started = []
+        release = asyncio.Event()
+
+        async def grade():
+            started.append(True)
+            await release.wait()
+            return 'ok'
+
+        tasks = [asyncio.ensure_future(coalescer.run_async('key', grade)) for _ in range(3)]
+        await _settle()
+        release.set()
+        results = await asyncio.gather(*tasks)
+        assert len(started) == 1
+        assert sorted(shared for _, shared in results) == [False, True, True]
+        assert {result for result, _ in results} == {'ok'}
+
+    asyncio.run(main())
+
+
+def test_leader_cancellation_reruns_for_followers():
+    async def main():
+        coalescer = Coalescer()
+        started = []
+        release = asyncio.Event()
+
+        async def grade():
+            started.append(True)
+            await release.wait()
+            return len(started)
+
+        leader = asyncio.ensure_future(coalescer.run_async('key', grade))
+        await _settle()
+        followers = [asyncio.ensure_future(coalescer.run_async('key', grade)) for _ in range(2)]
+        await _settle()
+
+        # Отмена первого запроса не отменяет ожидающие его запросы
+        leader.cancel()
+        await _settle()
+        assert leader.cancelled()
+        assert not any(follower.done() for follower in followers)
+        assert len(started) == 2
+
+        release.set()
+        results = await asyncio.gather(*followers)
+        assert sorted(results) == [(2, False), (2, True)]
+        assert coalescer.stats()['inflight'] == 0
+
+    asyncio.run(main())
+
+
+def test_leader_error_reaches_followers():
+    async def main():
+        coalescer = Coalescer()
+        release = asyncio.Event()
+
+        async def grade():
+            await release.wait()
+            raise RuntimeError('сбой')
+
+        tasks = [asyncio.ensure_future(coalescer.run_async('key', grade)) for _ in range(2)]
+        await _settle()
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    asyncio.run(main())
+
+
+def test_key_changes_with_problem_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('problems')
+    with open('problems/P.py', 'w') as f:
+        f.write('ANSWER = 1\n')
+    coalescer = Coalescer()
+    before = coalescer.key('P', 'print(1)', False)
+    assert coalescer.key('P', 'print(1)', False) == before
+
+    with open('problems/P.py', 'w') as f:
+        f.write('ANSWER = 22\n')
+    assert coalescer.key('P', 'print(1)', False) != before
+
+
+@pytest.mark.parametrize('hide_answer, regrade', [(True, False), (False, True)])
+def test_key_separates_flags(hide_answer, regrade):
+    coalescer = Coalescer()
+    assert (coalescer.key('P', 'print(1)', False) !=
+            coalescer.key('P', 'print(1)', hide_answer, regrade))
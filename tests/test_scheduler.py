@@ -0,0 +1,114 @@
+"""Порядок выдачи слотов планировщиком: приоритет очередей, доли слотов и голодание."""
+
+import asyncio
+
+import scheduler
+from scheduler import BULK, INTERACTIVE, GradingScheduler
+
+
+async def _settle():
+    # Передает управление задачам, получившим слот
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def _queue(grading, lane):
+    task = asyncio.ensure_future(grading.acquire_async(lane=lane))
+    return task
+
+
+def test_lane_borrows_free_slots():
+    grading = GradingScheduler(slots=2)
+    first = grading.acquire(lane=BULK)
+    second = grading.acquire(lane=BULK)
+    # Доля bulk - один слот, но решений с большим приоритетом нет
+    assert grading.stats()['lanes'][BULK]['running'] == 2
+    grading.release(first)
+    grading.release(second)
+
+
+def test_higher_lane_gets_released_slot():
+    async def main():
+        grading = GradingScheduler(slots=1)
+        held = grading.acquire(lane=INTERACTIVE)
+        bulk = _queue(grading, BULK)
+        await _settle()
+        interactive = _queue(grading, INTERACTIVE)
+        await _settle()
+
+        grading.release(held)
+        await _settle()
+        assert interactive.done() and not bulk.done()
+
+        grading.release(interactive.result())
+        await _settle()
+        assert bulk.done()
+        grading.release(bulk.result())
+
+    asyncio.run(main())
+
+
+def test_starving_ticket_jumps_priority(monkeypatch):
+    monkeypatch.setattr(scheduler, 'STARVATION_TIME', 0.0)
+
+    async def main():
+        grading = GradingScheduler(slots=2)
+        held = [grading.acquire(lane=INTERACTIVE), grading.acquire(lane=INTERACTIVE)]
+        bulk = _queue(grading, BULK)
+        await _settle()
+        interactive = _queue(grading, INTERACTIVE)
+        await _settle()
+
+        grading.release(held[0])
+        await _settle()
+        assert bulk.done() and not interactive.done()
+
+        grading.release(held[1])
+        await _settle()
+        assert interactive.done()
+        grading.release(bulk.result())
+        grading.release(interactive.result())
+
+    asyncio.run(main())
+
+
+def test_starving_ticket_respects_lane_share(monkeypatch):
+    monkeypatch.setattr(scheduler, 'STARVATION_TIME', 0.0)
+
+    async def main():
+        grading = GradingScheduler(slots=2)
+        running_bulk = grading.acquire(lane=BULK)
+        held = grading.acquire(lane=INTERACTIVE)
+        bulk = _queue(grading, BULK)
+        await _settle()
+        interactive = _queue(grading, INTERACTIVE)
+        await _settle()
+
+        # bulk уже занимает свою долю, а решение студента ожидает слот
+        grading.release(held)
+        await _settle()
+        assert interactive.done() and not bulk.done()
+
+        grading.release(running_bulk)
+        await _settle()
+        assert bulk.done()
+        grading.release(bulk.result())
+        grading.release(interactive.result())
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def main():
+        grading = GradingScheduler(slots=1)
+        held = grading.acquire()
+        waiter = _queue(grading, INTERACTIVE)
+        await _settle()
+        waiter.cancel()
+        await _settle()
+        assert grading.stats()['queued'] == 0
+
+        grading.release(held)
+        assert grading.stats()['running'] == 0
+
+    asyncio.run(main())
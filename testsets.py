@@ -0,0 +1,192 @@
+"""
+Заранее вычисленные наборы тестов для заданий.
+
+Задание может объявить набор тестов, который строится генератором из
+random.Random с фиксированным seed, вместо того чтобы в каждом тестировании
+заново выбирать случайные значения и вызывать для них правильное решение:
+
+    def generate(rng):
+        return [rng.randint(0, 86000) for _ in range(10)]
+
+    TESTS = testsets.TestSet(generate, solution)
+
+    def check_inout(code):
+        tests = TESTS.load()
+        return tt.test_input_print(code=code, values=tests.values, expected=tests.expected)
+
+Пары (значение, ожидаемый результат) вычисляются один раз для каждого
+задания и seed - грейдером при загрузке задания - и сохраняются в файл
+каталога TESTSET_DIRECTORY. Тестировщики отображают файл в память через
+mmap, поэтому таблица не копируется в каждый процесс, а значения
+распаковываются только при обращении к ним. Имя файла содержит хэш файла
+задания, поэтому после изменения задания таблица строится заново.
+
+Формат файла: MAGIC, количество строк n (8 байт), n + 1 смещений строк
+(по 8 байт) относительно начала данных и данные - строки (значение,
+ожидаемый результат), сериализованные pickle.
+"""
+
+import glob
+import mmap
+import os
+import pickle
+import random
+import struct
+from collections.abc import Sequence
+
+from util import file_version
+
+# Каталог с файлами наборов тестов
+TESTSET_DIRECTORY = 'testsets'
+
+MAGIC = b'TESTSET1'
+
+_HEADER = struct.Struct('<8sQ')
+_OFFSET = struct.Struct('<Q')
+
+
+class Table(Sequence):
+    """
+    Набор тестов, отображенный в память. Элемент - пара (значение, ожидаемый результат).
+
+    Атрибуты:
+        values (Sequence): тестовые значения
+        expected (Sequence): ожидаемые результаты
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError('{} не является файлом набора тестов'.format(path))
+        start = _HEADER.size
+        self._offsets = memoryview(self._map)[start:start + _OFFSET.size * (count + 1)].cast('Q')
+        self._data = start + _OFFSET.size * (count + 1)
+        self.values = _Column(self, 0)
+        self.expected = _Column(self, 1)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('номер теста вне набора')
+        return pickle.loads(self._map[self._data + self._offsets[i]:self._data + self._offsets[i + 1]])
+
+
+class _Column(Sequence):
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __len__(self):
+        return len(self._table)
+
+    def __getitem__(self, i):
+        return self._table[i][self._index]
+
+
+def write_table(path, rows):
+    """Записывает строки (значение, ожидаемый результат) в файл path атомарно."""
+    blobs = [pickle.dumps(tuple(row), protocol=pickle.HIGHEST_PROTOCOL) for row in rows]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(blobs)))
+        f.write(struct.pack('<{}Q'.format(len(offsets)), *offsets))
+        f.writelines(blobs)
+    os.replace(temporary, path)
+
+
+class TestSet:
+    """
+    Набор тестов задания, построенный генератором с фиксированным seed.
+
+    Аргументы:
+        generate (function): generate(rng) возвращает список тестовых значений,
+                             rng - random.Random(seed)
+        solution (function): правильное решение, вызывается для каждого значения
+        seed (int): seed по умолчанию
+        unpack (bool): вызывать solution(*value) вместо solution(value), как
+                       testing_tools.test_function для значений-кортежей
+    """
+    def __init__(self, generate, solution, seed=0, unpack=False):
+        self.generate = generate
+        self.solution = solution
+        self.seed = seed
+        self.unpack = unpack
+        # Файл задания, в котором объявлен генератор
+        self.source = generate.__code__.co_filename
+        self.problem_name = os.path.splitext(os.path.basename(self.source))[0]
+        self._tables = {}
+
+    def build(self, seed=None):
+        """Вычисляет строки набора тестов."""
+        rng = random.Random(self.seed if seed is None else seed)
+        rows = []
+        for value in self.generate(rng):
+            expected = self.solution(*value) if self.unpack else self.solution(value)
+            rows.append((value, expected))
+        return rows
+
+    def version(self):
+        """Хэш файла задания."""
+        return file_version(self.source)
+
+    def path(self, seed=None):
+        """Файл набора тестов для seed и текущей версии файла задания."""
+        return os.path.join(TESTSET_DIRECTORY, '{}-{}-{}.bin'.format(
+            self.problem_name, self.seed if seed is None else seed, self.version()))
+
+    def prepare(self, seed=None):
+        """Строит файл набора тестов, если его еще нет, и возвращает путь к нему."""
+        path = self.path(seed)
+        if not os.path.exists(path):
+            os.makedirs(TESTSET_DIRECTORY, exist_ok=True)
+            write_table(path, self.build(seed))
+        return path
+
+    def load(self, seed=None):
+        """
+        Возвращает набор тестов как Table. Таблица открывается один раз
+        на процесс и наследуется дочерними процессами.
+        """
+        seed = self.seed if seed is None else seed
+        table = self._tables.get(seed)
+        if table is None:
+            table = self._tables[seed] = Table(self.prepare(seed))
+        return table
+
+
+def testsets_of(module):
+    """Наборы тестов, объявленные в модуле задания."""
+    return [value for value in vars(module).values() if isinstance(value, TestSet)]
+
+
+def prepare(module):
+    """
+    Строит файлы всех наборов тестов задания с seed по умолчанию и удаляет
+    файлы, построенные для предыдущих версий задания. Возвращает пути к файлам.
+    """
+    paths = []
+    for testset in testsets_of(module):
+        paths.append(testset.prepare())
+        version = testset.version()
+        pattern = os.path.join(TESTSET_DIRECTORY, '{}-*.bin'.format(testset.problem_name))
+        for path in glob.glob(pattern):
+            if not path.endswith('-{}.bin'.format(version)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return paths
+
+
+def preload(module):
+    """Открывает наборы тестов задания, чтобы дочерние процессы получили их готовыми."""
+    for testset in testsets_of(module):
+        testset.load()
@@ -0,0 +1,93 @@
+"""
+Время этапов обработки одного решения.
+
+Обработчик запроса создает RequestTrace и делает его текущим для своего
+потока или задачи asyncio, а функции грейдера отмечают этапы вызовом
+stage(name). Если текущего запроса нет, этапы не учитываются.
+
+Этапы:
+    read    чтение тела запроса
+    parse   разбор запроса (get_info)
+    queue   ожидание свободного слота планировщика
+    spawn   запуск тестировщика
+    import  загрузка модуля задания в тестировщике
+    check   выполнение check() или check_inout() в тестировщике
+    tester  время от запуска тестировщика до получения итогового результата
+    result  разбор вывода тестировщика
+    render  формирование HTML отчета
+    write   отправка ответа
+"""
+
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from util import request_id
+
+_current = ContextVar('request_trace', default=None)
+
+
+class RequestTrace:
+    """
+    Время этапов обработки одного запроса.
+
+    Аргументы:
+        trace_id (str): идентификатор запроса, по умолчанию создается случайный.
+    """
+    def __init__(self, trace_id=None):
+        self.request_id = trace_id or uuid.uuid4().hex[:16]
+        self.stages = {}
+        # Сведения о запросе для итоговой записи лога: задание, пользователь, результат
+        self.info = {}
+        self._started = time.monotonic()
+
+    def add(self, name, seconds):
+        """Добавляет seconds ко времени этапа name."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        """Время с начала обработки запроса в секундах."""
+        return time.monotonic() - self._started
+
+    def as_dict(self):
+        """Время этапов в миллисекундах."""
+        return {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+
+
+@contextmanager
+def trace_request(trace_id=None):
+    """
+    Делает новый RequestTrace текущим на время блока и возвращает его.
+    Его идентификатор добавляется ко всем записям лога внутри блока.
+    """
+    trace = RequestTrace(trace_id)
+    trace_token = _current.set(trace)
+    id_token = request_id.set(trace.request_id)
+    try:
+        yield trace
+    finally:
+        request_id.reset(id_token)
+        _current.reset(trace_token)
+
+
+def current():
+    """Текущий RequestTrace или None."""
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Учитывает время выполнения блока как этап name текущего запроса."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        add(name, time.monotonic() - start)
+
+
+def add(name, seconds):
+    """Добавляет seconds ко времени этапа name текущего запроса, если он есть."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
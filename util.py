@@ -2,24 +2,131 @@
 В данном модуле содержатся вспомогатльные функции, используемые в остальных модулях.
 """
 
-import time
 import datetime
-import random
+import hashlib
+import json
+import queue
+import sys
+import threading
+from contextvars import ContextVar
+
+# Идентификатор запроса, к которому относятся записи лога текущего потока или задачи asyncio
+request_id = ContextVar('request_id', default=None)
+
+# Очередь записей структурированного лога. Пока она не создана вызовом
+# start_logging(), print_log() печатает сообщения как обычно
+_log_queue = None
+_log_thread = None
+_log_dropped = 0
+
 
 def print_log(str):
     """
     Функция для печати логов с указанием времени в терминал, где запущен грейдер.
 
+    Если включен структурированный лог (см. start_logging()), сообщение
+    записывается в него как событие 'log'.
+
     Аргументы:
             str (string): сообщение, которое необходимо вывести в терминал.
     """
+    if _log_queue is not None:
+        log_event('log', message=str)
+        return
     now = datetime.datetime.now()
     print('{} {}.'.format(now.strftime("%d-%m-%Y %H:%M"), str))
 
-def generate_random_filename():
+
+def log_event(event, **fields):
+    """
+    Записывает событие в структурированный лог одной строкой JSON.
+
+    Запись не блокирует вызывающий поток: она помещается в очередь, которую
+    разбирает фоновый поток. Если очередь заполнена, запись отбрасывается,
+    а количество отброшенных записей сообщается в следующей записи.
+
+    Аргументы:
+        event (str): тип события
+        fields: поля записи, которые должны сериализоваться в JSON
     """
-    Функция для генерации случайного имени для файла
+    global _log_dropped
+    record = {'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+              'event': event}
+    current = request_id.get()
+    if current is not None:
+        record['request_id'] = current
+    record.update(fields)
+
+    if _log_queue is None:
+        print(json.dumps(record, ensure_ascii=False, default=repr))
+        return
+    if _log_dropped:
+        record['dropped'], _log_dropped = _log_dropped, 0
+    try:
+        _log_queue.put_nowait(record)
+    except queue.Full:
+        _log_dropped += record.get('dropped', 0) + 1
+
+
+def start_logging(stream=None, max_queue=10000):
     """
-    return '_'.join([time.strftime('%Y%m%d%H%M%S'),
-                     str(time.time()).split('.')[-1],
-                     str(random.random()).split('.')[-1]])
\ No newline at end of file
+    Включает структурированный лог в формате JSON lines.
+
+    Аргументы:
+        stream: файл, в который пишется лог, по умолчанию sys.stdout
+        max_queue (int): количество записей, ожидающих записи в файл
+    """
+    global _log_queue, _log_thread
+    if _log_queue is not None:
+        return
+    _log_queue = queue.Queue(max_queue)
+    _log_thread = threading.Thread(target=_write_log, args=(_log_queue, stream or sys.stdout),
+                                   name='log-writer', daemon=True)
+    _log_thread.start()
+
+
+def stop_logging():
+    """Дописывает оставшиеся записи и возвращается к обычному выводу print_log()."""
+    global _log_queue, _log_thread
+    if _log_queue is None:
+        return
+    log_queue, thread = _log_queue, _log_thread
+    _log_queue = _log_thread = None
+    log_queue.put(None)
+    thread.join()
+
+
+def _write_log(log_queue, stream):
+    # Записи, накопившиеся в очереди, записываются в файл одним вызовом
+    while True:
+        records = [log_queue.get()]
+        while len(records) < 1000:
+            try:
+                records.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in records
+        lines = [json.dumps(record, ensure_ascii=False, default=repr)
+                 for record in records if record is not None]
+        if lines:
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+        if stop:
+            return
+
+
+def source_version(source):
+    """
+    Версия файла задания - хэш его содержимого. Используется кэшем результатов,
+    калибровкой и наборами тестов, чтобы они одинаково определяли изменение задания.
+
+    Аргументы:
+            source (bytes): содержимое файла задания.
+    """
+    return hashlib.sha256(source).hexdigest()[:16]
+
+
+def file_version(path):
+    """Версия файла задания path, см. source_version()."""
+    with open(path, 'rb') as f:
+        return source_version(f.read())
@@ -0,0 +1,365 @@
+"""
+Работа грейдера в режиме опроса очереди XQueue.
+
+Вместо того чтобы ждать POST запросов от XQueue (grader.start()), грейдер
+сам забирает решения из очереди через API внешних грейдеров XQueue:
+    POST /xqueue/login/             вход, сессия хранится в cookie
+    GET  /xqueue/get_submission/    следующее решение из очереди
+    POST /xqueue/put_result/        результат оценки решения
+
+Решения забирают slots потоков, и каждый поток запрашивает следующее решение,
+только закончив оценку предыдущего. Поэтому узел берет из очереди ровно
+столько решений, сколько может оценивать одновременно, а остальные решения
+остаются в очереди для других узлов. Потоки используют постоянные
+соединения из общего пула.
+
+Для проверки без настоящего XQueue можно запустить local_xqueue.py.
+
+Запуск:
+    python3 xqueue_client.py --url http://localhost:18040 --queue python \\
+        --user grader --password secret
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from urllib.parse import urlencode, urlsplit
+
+import grader
+import timing
+from scheduler import QueueFull
+from util import print_log, stop_logging
+
+# Сколько секунд ждать между запросами к пустой очереди. Интервал удваивается,
+# пока очередь пуста, от POLL_INTERVAL до MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2
+
+# Сколько раз повторять отправку результата при ошибке соединения
+PUT_RETRIES = 5
+
+
+class XQueueError(Exception):
+    """XQueue ответил ошибкой."""
+
+
+class ResponseTimeout(TimeoutError):
+    """Запрос отправлен, но ответ не получен за timeout секунд: сервер мог его обработать."""
+
+
+class ConnectionPool:
+    """
+    Пул постоянных HTTP соединений с одним сервером.
+
+    Соединение, при работе с которым произошла ошибка, закрывается
+    и не возвращается в пул. Если сервер закрыл соединение, пока оно
+    ожидало в пуле, запрос один раз повторяется в новом соединении.
+    """
+    def __init__(self, url, size, timeout=30):
+        address = urlsplit(url)
+        self.scheme = address.scheme or 'http'
+        self.host = address.hostname
+        self.port = address.port
+        self.prefix = address.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(size)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Выполняет запрос и возвращает (status, headers, body) ответа.
+
+        Выбрасывает:
+            ResponseTimeout: если запрос отправлен, но ответ не получен за timeout секунд
+        """
+        try:
+            connection = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection = self._connect()
+            reused = False
+        try:
+            response, data = self._exchange(connection, method, path, body, headers)
+        except (ConnectionResetError, BrokenPipeError):
+            # Сервер закрывает простаивающие соединения (KEEP_ALIVE_TIMEOUT),
+            # такое соединение сбрасывается до получения ответа
+            if not reused:
+                raise
+            connection = self._connect()
+            response, data = self._exchange(connection, method, path, body, headers)
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, response.headers, data
+
+    def _exchange(self, connection, method, path, body, headers):
+        # Отправляет запрос и читает ответ. При ошибке соединение закрывается
+        try:
+            connection.request(method, self.prefix + path, body, headers or {})
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        try:
+            response = connection.getresponse()
+            return response, response.read()
+        except TimeoutError as err:
+            connection.close()
+            raise ResponseTimeout('Ответ не получен за {} сек.'.format(self.timeout)) from err
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+
+class XQueueClient:
+    """
+    Клиент API внешних грейдеров XQueue.
+
+    Аргументы:
+        url (str): адрес XQueue, например http://localhost:18040
+        queue_name (str): название очереди
+        username, password (str): учетные данные грейдера
+        pool_size (int): количество постоянных соединений
+    """
+    def __init__(self, url, queue_name, username=None, password=None, pool_size=4):
+        self.queue_name = queue_name
+        self.username = username
+        self.password = password
+        self.pool = ConnectionPool(url, pool_size)
+        self._lock = threading.Lock()
+        self._cookies = {}
+
+    def login(self):
+        body = urlencode({'username': self.username or '', 'password': self.password or ''})
+        status, headers, data = self.pool.request(
+            'POST', '/xqueue/login/', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        self._save_cookies(headers)
+        return_code, content = _parse_reply(status, data)
+        if return_code != 0:
+            raise XQueueError('Не удалось войти в XQueue: {}'.format(content))
+
+    def get_submission(self):
+        """
+        Забирает следующее решение из очереди.
+
+        Возвращает:
+            (header, body) - строки xqueue_header и xqueue_body решения,
+            или None, если очередь пуста
+        """
+        return_code, content = self._call('GET', '/xqueue/get_submission/?' + urlencode(
+            {'queue_name': self.queue_name}))
+        if return_code != 0:
+            # XQueue отвечает кодом 1, если в очереди нет решений
+            return None
+        submission = json.loads(content) if isinstance(content, str) else content
+        return submission['xqueue_header'], submission['xqueue_body']
+
+    def put_result(self, header, response):
+        """Отправляет результат оценки решения с заголовком header."""
+        body = urlencode({'xqueue_header': header, 'xqueue_body': json.dumps(response)})
+        return_code, content = self._call('POST', '/xqueue/put_result/', body,
+                                          {'Content-Type': 'application/x-www-form-urlencoded'})
+        if return_code != 0:
+            raise XQueueError('XQueue не принял результат: {}'.format(content))
+
+    def close(self):
+        self.pool.close()
+
+    def _call(self, method, path, body=None, headers=None):
+        # Выполняет запрос, при необходимости войдя в XQueue заново
+        for attempt in range(2):
+            request_headers = dict(headers or {}, Cookie=self._cookie_header())
+            status, response_headers, data = self.pool.request(method, path, body, request_headers)
+            if status in (401, 403) and attempt == 0:
+                self.login()
+                continue
+            self._save_cookies(response_headers)
+            return _parse_reply(status, data)
+
+    def _cookie_header(self):
+        with self._lock:
+            return '; '.join('{}={}'.format(name, value) for name, value in self._cookies.items())
+
+    def _save_cookies(self, headers):
+        with self._lock:
+            for header in headers.get_all('Set-Cookie') or ():
+                name, _, value = header.split(';', 1)[0].partition('=')
+                self._cookies[name.strip()] = value.strip()
+
+
+def _parse_reply(status, data):
+    # Ответы XQueue имеют вид {"return_code": 0, "content": ...}
+    if status != 200:
+        raise XQueueError('XQueue ответил кодом {}'.format(status))
+    reply = json.loads(data)
+    return reply.get('return_code'), reply.get('content')
+
+
+class PullRunner:
+    """
+    Забирает решения из очереди XQueue, оценивает их и отправляет результаты.
+
+    Аргументы:
+        client (XQueueClient): клиент очереди
+        slots (int): количество одновременно оцениваемых решений,
+                     по умолчанию равно числу слотов планировщика грейдера
+        drain (bool): остановиться, когда очередь опустеет
+    """
+    def __init__(self, client, slots=None, drain=False):
+        self.client = client
+        self.slots = slots or (grader.scheduler.slots if grader.scheduler is not None else 1)
+        self.drain = drain
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.graded = 0
+        self.failed = 0
+
+    def start(self):
+        for i in range(self.slots):
+            thread = threading.Thread(target=self._worker, name='xqueue-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Останавливает опрос. Оцениваемые решения дооцениваются и отправляются."""
+        self._stop.set()
+        self.join()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _worker(self):
+        interval = POLL_INTERVAL
+        while not self._stop.is_set():
+            try:
+                submission = self.client.get_submission()
+            except (OSError, http.client.HTTPException, XQueueError, ValueError) as err:
+                print_log('Не удалось получить решение из XQueue: {}'.format(err))
+                submission = None
+            if submission is None:
+                if self.drain:
+                    break
+                self._stop.wait(interval)
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+                continue
+            interval = POLL_INTERVAL
+            try:
+                self._process(*submission)
+            except Exception:
+                # Ошибка в одном решении не должна останавливать поток опроса
+                print_log('Не удалось обработать решение из XQueue: {}'.format(
+                    traceback.format_exc()))
+                with self._lock:
+                    self.failed += 1
+
+    def _process(self, header, body):
+        with timing.trace_request() as trace:
+            try:
+                problem_name, hide_answer, student_response, user_id = grader.get_info(
+                    {'xqueue_body': body})
+                hide_answer = hide_answer == 'True'
+            except (ValueError, KeyError, TypeError):
+                print_log('Решение из XQueue не удалось разобрать')
+                response = grader.create_response(
+                    {'correct': False, 'error': 'Решение не удалось разобрать'}, False)
+                trace.info['outcome'] = 'bad_request'
+            else:
+                trace.info.update(problem=problem_name, user=user_id)
+                response, complete = self._grade(problem_name, student_response, hide_answer)
+                grader.store_submission(problem_name, user_id, student_response, hide_answer,
+                                        response, complete)
+                trace.info.update(outcome='graded', correct=response.get('correct'),
+                                  score=response.get('score'))
+            with timing.stage('write'):
+                sent = self._put_result(header, response)
+            with self._lock:
+                if sent:
+                    self.graded += 1
+                else:
+                    self.failed += 1
+            grader.log_request(trace)
+
+    def _grade(self, problem_name, student_response, hide_answer):
+        while True:
+            try:
+                response, _, complete = grader.grade_scheduled(
+                    problem_name, student_response, hide_answer)
+                return response, complete
+            except QueueFull as err:
+                # Слоты заняты запросами, пришедшими другим путем
+                time.sleep(err.retry_after)
+
+    def _put_result(self, header, response):
+        delay = POLL_INTERVAL
+        for attempt in range(PUT_RETRIES):
+            try:
+                self.client.put_result(header, response)
+                return True
+            except (OSError, http.client.HTTPException, XQueueError, ValueError) as err:
+                print_log('Не удалось отправить результат в XQueue (попытка {}): {}'.format(
+                    attempt + 1, err))
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_POLL_INTERVAL)
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Грейдер в режиме опроса очереди XQueue')
+    parser.add_argument('--url', required=True, help='адрес XQueue')
+    parser.add_argument('--queue', required=True, help='название очереди')
+    parser.add_argument('--user', help='имя пользователя грейдера в XQueue')
+    parser.add_argument('--password', help='пароль пользователя грейдера в XQueue')
+    parser.add_argument('--slots', type=int, help='количество одновременно оцениваемых решений')
+    parser.add_argument('--pool-size', type=int, help='количество процессов-шаблонов тестировщика')
+    parser.add_argument('--drain', action='store_true', help='остановиться, когда очередь опустеет')
+    parser.add_argument('--store', help='файл хранилища оцененных решений (store.py)')
+    args = parser.parse_args(argv)
+
+    store_path = args.store and os.path.abspath(args.store)
+    grader.setup(args.pool_size, slots=args.slots, store_path=store_path)
+    client = XQueueClient(args.url, args.queue, args.user, args.password,
+                          pool_size=grader.scheduler.slots)
+    runner = PullRunner(client, grader.scheduler.slots, args.drain)
+    try:
+        client.login()
+        runner.start()
+        print_log('Грейдер опрашивает очередь {} на {}'.format(args.queue, args.url))
+        runner.join()
+    except KeyboardInterrupt:
+        runner.stop()
+    except (OSError, XQueueError) as err:
+        print_log('Не удалось подключиться к XQueue: {}'.format(err))
+    finally:
+        print_log('Оценено решений: {}, не удалось отправить: {}'.format(
+            runner.graded, runner.failed))
+        client.close()
+        grader.calibrator.stop()
+        grader.tester_pool.close()
+        if grader.submission_store is not None:
+            grader.submission_store.close()
+        stop_logging()
+
+
+if __name__ == '__main__':
+    main()